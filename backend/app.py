@@ -4,10 +4,48 @@ app.py - Flask 主服务入口
 配置 CORS、文件上传限制等中间件
 """
 
-from flask import Flask, jsonify
+from flask import Flask, Request, jsonify
 from flask_cors import CORS
 from config import Config
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
 import os
+import queue
+import tempfile
+
+# 根 logger 原有的输出 handler，以及已启动日志后台线程的进程号
+_log_handlers = None
+_log_listener_pid = None
+
+def start_log_listener():
+    """
+    将根 logger 的输出改为经队列交给后台线程写出，请求线程记录日志时不再等待 stdout
+    每个进程启动一次；后台线程不会跨 fork 保留，预加载应用时由 gunicorn 的 post_fork 在 worker 中再次调用
+    """
+    global _log_handlers, _log_listener_pid
+    
+    if _log_listener_pid == os.getpid():
+        return
+    
+    root = logging.getLogger()
+    if _log_handlers is None:
+        _log_handlers = list(root.handlers)
+    
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    atexit.register(listener.stop)
+    _log_listener_pid = os.getpid()
+
+class UploadRequest(Request):
+    """multipart 上传的大文件直接写入上传目录下的临时文件，保存时无需跨文件系统复制"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > Config.UPLOAD_SPOOL_MAX_SIZE:
+            return tempfile.NamedTemporaryFile('wb+', dir=Config.UPLOAD_TMP_FOLDER)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
 
 def create_app(config_name='development'):
     """
@@ -15,10 +53,28 @@ def create_app(config_name='development'):
     :param config_name: 配置名称
     :return: Flask应用实例
     """
+    from config import config
+    
+    # 统一日志格式（只需配置一次，各模块的 logger 继承根配置）
+    logging.basicConfig(
+        level=config[config_name].LOG_LEVEL,
+        format='%(asctime)s %(levelname)s %(name)s %(message)s'
+    )
+    start_log_listener()
+    
+    # BSON 编解码是否使用 C 扩展（纯 Python 实现解码大文档明显更慢）
+    import bson
+    if not bson.has_c():
+        logging.getLogger(__name__).warning("bson C extension is not available, BSON decoding will be slow")
+    
     app = Flask(__name__)
+    app.request_class = UploadRequest
+    
+    # 使用 orjson 序列化响应（支持 datetime / ObjectId）
+    from json_provider import ORJSONProvider
+    app.json = ORJSONProvider(app)
     
     # 加载配置
-    from config import config
     app.config.from_object(config[config_name])
     
     # 配置CORS
@@ -27,6 +83,14 @@ def create_app(config_name='development'):
     # 设置文件上传限制
     app.config['MAX_CONTENT_LENGTH'] = Config.MAX_CONTENT_LENGTH
     
+    # 确保上传目录存在
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(Config.UPLOAD_TMP_FOLDER, exist_ok=True)
+    
+    # 预加载 Embedding 控制器（同时加载 embedding 模型和向量库），避免首个请求承担加载开销
+    from controllers.embedding_controller import get_embedding_controller
+    app.extensions['embedding_ctrl'] = get_embedding_controller()
+    
     # 注册蓝图
     from routes.upload_routes import upload_bp
     from routes.parse_routes import parse_bp
@@ -49,17 +113,20 @@ def create_app(config_name='development'):
             'status': 'running',
             'endpoints': {
                 'upload': '/api/upload',
+                'upload_stream': '/api/upload/stream',
                 'files': '/api/files',
                 'delete': '/api/files/<id>',
                 'download': '/api/files/download/<id>',
                 'stats': '/api/files/stats',
                 'parse_local': '/api/parse/local',
                 'parse_database': '/api/parse/database/<file_id>',
+                'parse_database_batch': '/api/parse/database/batch',
                 'parse_history': '/api/parse/history',
                 'parse_content': '/api/parse/<parse_id>',
                 'parse_download': '/api/parse/download/<parse_id>',
                 'parse_search': '/api/parse/search',
                 'segment_create': '/api/segment/create/<file_id>',
+                'segment_create_batch': '/api/segment/create/batch',
                 'segment_file': '/api/segment/file/<file_id>',
                 'segment_tag': '/api/segment/tag',
                 'segment_tag_batch': '/api/segment/tag/batch',
@@ -74,6 +141,7 @@ def create_app(config_name='development'):
                 'embed_search': '/api/embed/search/<file_id>',
                 'embed_search_multi': '/api/embed/search/multi',
                 'embed_health': '/api/embed/health',
+                'warmup': '/warmup',
                 'qa_rag': '/api/qa/rag',
                 'qa_health': '/api/qa/health',
                 'qa_available_files': '/api/qa/available-files'
@@ -88,6 +156,14 @@ def create_app(config_name='development'):
             'service': 'chem-knowledge-base-backend'
         })
     
+    # 预热接口：执行一次编码和向量搜索，预热模型与索引缓存
+    @app.route('/warmup')
+    def warmup():
+        return jsonify({
+            'success': True,
+            'data': app.extensions['embedding_ctrl'].warmup()
+        })
+    
     # 全局错误处理器
     @app.errorhandler(404)
     def not_found(error):
@@ -100,7 +176,7 @@ def create_app(config_name='development'):
     def too_large(error):
         return jsonify({
             'success': False,
-            'error': f'Request entity too large. Maximum file size is {Config.MAX_CONTENT_LENGTH / 1024 / 1024:.1f}MB'
+            'error': f'Request entity too large. Maximum file size is {Config.MAX_CONTENT_LENGTH_MB_STR}MB'
         }), 413
     
     @app.errorhandler(500)
@@ -112,24 +188,18 @@ def create_app(config_name='development'):
     
     return app
 
-# 创建应用实例
-app = create_app()
-
 if __name__ == "__main__":
-    # 确保上传目录存在
-    if not os.path.exists(Config.UPLOAD_FOLDER):
-        os.makedirs(Config.UPLOAD_FOLDER)
-        print(f"Created upload directory: {Config.UPLOAD_FOLDER}")
-    
     print(f"Starting Chemical Industry LLM Knowledge Base Backend...")
     print(f"Upload folder: {Config.UPLOAD_FOLDER}")
-    print(f"Max file size: {Config.MAX_CONTENT_LENGTH / 1024 / 1024:.1f}MB")
+    print(f"Max file size: {Config.MAX_CONTENT_LENGTH_MB_STR}MB")
     print(f"Allowed extensions: {', '.join(Config.ALLOWED_EXTENSIONS)}")
     print(f"MongoDB URI: {Config.MONGO_URI}")
     
-    # 启动开发服务器
-    app.run(
-        debug=Config.DEBUG,
-        host="0.0.0.0",
-        port=5001
-    )
+    # 使用 Gunicorn 多线程 worker 启动服务（替代 Flask 单线程开发服务器）
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    os.execvp("gunicorn", [
+        "gunicorn",
+        "--chdir", backend_dir,
+        "-c", os.path.join(backend_dir, "gunicorn.conf.py"),
+        "wsgi:app"
+    ])
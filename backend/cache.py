@@ -0,0 +1,79 @@
+"""
+cache.py - 控制器结果缓存
+进程内 TTL 缓存读多写少的控制器方法结果；每个命名空间维护一个版本号，
+写操作递增版本号即可让该命名空间下的旧缓存全部失效（无需逐个查找删除）
+"""
+
+import threading
+from functools import wraps
+
+import orjson
+from cachetools import TTLCache
+
+from config import Config
+
+_cache = TTLCache(maxsize=Config.RESULT_CACHE_SIZE, ttl=Config.RESULT_CACHE_TTL)
+_versions = {}
+_lock = threading.Lock()
+
+
+def _current_version(namespace):
+    with _lock:
+        return _versions.get(namespace, 0)
+
+
+def invalidate(*namespaces):
+    """
+    使命名空间下的所有缓存失效
+    :param namespaces: 命名空间列表
+    """
+    with _lock:
+        for namespace in namespaces:
+            _versions[namespace] = _versions.get(namespace, 0) + 1
+
+
+def cached(namespace):
+    """
+    缓存控制器方法的成功结果（返回值为 (True, data) 时才缓存）
+    缓存键由方法名、命名空间版本号和调用参数组成
+    :param namespace: 命名空间
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            # 先取版本号：执行期间发生写操作时，结果写入旧版本键，不会被后续读取命中
+            version = _current_version(namespace)
+            key = (
+                func.__qualname__,
+                version,
+                orjson.dumps([args, kwargs], option=orjson.OPT_SORT_KEYS)
+            )
+            
+            with _lock:
+                result = _cache.get(key)
+            if result is not None:
+                return result
+            
+            result = func(self, *args, **kwargs)
+            if result[0]:
+                with _lock:
+                    _cache[key] = result
+            return result
+        return wrapper
+    return decorator
+
+
+def invalidates(*namespaces):
+    """
+    标记写操作方法：执行后使相关命名空间的缓存失效
+    :param namespaces: 命名空间列表
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                invalidate(*namespaces)
+        return wrapper
+    return decorator
@@ -14,20 +14,45 @@ load_dotenv()
 class Config:
     # Flask配置
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-development")
-    DEBUG = bool(os.getenv("DEBUG", True))
+    DEBUG = os.getenv("DEBUG", "true").lower() in ("1", "true", "yes")
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
     
     # 数据库配置
     MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/chem_knowledge_base")
     MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "chem_knowledge_base")
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+    # 数据库不可用时快速失败，而不是让请求线程阻塞 30 秒（pymongo 默认值）；
+    # 单次操作的 socket 超时需覆盖最慢的聚合/批量写入
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+    # 网络传输压缩算法（按优先级，未安装对应库的算法会被忽略）
+    MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+    # 网络抖动或主节点切换时自动重试一次写操作
+    MONGO_RETRY_WRITES = os.getenv("MONGO_RETRY_WRITES", "true").lower() == "true"
+    # 启动后在后台预读索引页到 WiredTiger 缓存（开发环境可关闭），以及每个索引预读的键数
+    MONGO_INDEX_WARMUP = os.getenv("MONGO_INDEX_WARMUP", "true").lower() == "true"
+    MONGO_INDEX_WARMUP_KEYS = int(os.getenv("MONGO_INDEX_WARMUP_KEYS", "1000"))
     
     # 文件上传配置
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB
+    MAX_CONTENT_LENGTH_MB = MAX_CONTENT_LENGTH / 1024 / 1024
+    MAX_CONTENT_LENGTH_MB_STR = f"{MAX_CONTENT_LENGTH_MB:.1f}"  # 错误提示中使用的大小文本
+    UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传文件落盘时的分块大小（1MB）
+    # multipart 上传中超过该大小的请求体，文件部分直接写入上传目录下的临时目录（与目标文件同一文件系统），
+    # 保存时硬链接到目标路径而不是再复制一遍；较小的请求仍在内存中解析
+    UPLOAD_SPOOL_MAX_SIZE = 500 * 1024
+    UPLOAD_TMP_FOLDER = os.path.join(UPLOAD_FOLDER, ".tmp")
+    DOWNLOAD_MAX_AGE = int(os.getenv("DOWNLOAD_MAX_AGE", "3600"))  # 文件下载的浏览器缓存时间（秒）
+    UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "4"))  # 待落盘文件队列长度
+    UPLOAD_DB_BATCH_SIZE = int(os.getenv("UPLOAD_DB_BATCH_SIZE", "64"))  # 文件记录批量写入条数
+    UPLOAD_DB_BATCH_TIMEOUT = float(os.getenv("UPLOAD_DB_BATCH_TIMEOUT", "0.5"))  # 批量写入最长等待秒数
     ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt', 'doc'}
-    
-    # 确保上传目录存在
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
+    # 不超过该大小（MB）的上传文件直接在内存中解析，更大的文件先写入临时文件
+    PARSE_IN_MEMORY_MAX_SIZE = int(os.getenv("PARSE_IN_MEMORY_MAX_MB", "32")) * 1024 * 1024
+    FILE_STATS_CACHE_TTL = int(os.getenv("FILE_STATS_CACHE_TTL", "30"))  # 文件统计结果缓存秒数
     
     # CORS配置
     CORS_ORIGINS = ["http://localhost:5173", "http://localhost:3000"]
@@ -39,11 +64,77 @@ class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo")
     OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+    # 查询向量化微批：并发的查询在等待窗口（毫秒）内合并为一次 embeddings 调用（0 表示不合并）
+    OPENAI_EMBEDDING_BATCH_SIZE = int(os.getenv("OPENAI_EMBEDDING_BATCH_SIZE", "16"))
+    OPENAI_EMBEDDING_BATCH_WAIT_MS = float(os.getenv("OPENAI_EMBEDDING_BATCH_WAIT_MS", "10"))
+    # 同时进行中的合并调用数，以及等待合并结果的超时秒数（超时后单独调用一次 API）
+    OPENAI_EMBEDDING_BATCH_WORKERS = int(os.getenv("OPENAI_EMBEDDING_BATCH_WORKERS", "4"))
+    OPENAI_EMBEDDING_BATCH_TIMEOUT = float(os.getenv("OPENAI_EMBEDDING_BATCH_TIMEOUT", "10"))
+    # 回答缓存：相同提示词和生成参数直接返回缓存的回答（0 表示不缓存）
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "600"))
+    # 向 OpenAI 传递 prompt_cache_key（按上下文分组），使相同上下文的请求复用服务端的前缀缓存；
+    # 使用不支持该参数的兼容接口时关闭
+    OPENAI_PROMPT_CACHE_KEY = os.getenv("OPENAI_PROMPT_CACHE_KEY", "true").lower() == "true"
     
     # RAG 配置
     RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
     RAG_MIN_SIMILARITY = float(os.getenv("RAG_MIN_SIMILARITY", "0.0"))
     RAG_MAX_CONTEXT_LENGTH = int(os.getenv("RAG_MAX_CONTEXT_LENGTH", "4000"))
+    # 格式化上下文缓存：检索到相同段落（按顺序）时直接复用拼接好的上下文（0 表示不缓存；重建/删除索引时清空）
+    RAG_CONTEXT_CACHE_SIZE = int(os.getenv("RAG_CONTEXT_CACHE_SIZE", "4096"))
+    RAG_CONTEXT_CACHE_TTL = int(os.getenv("RAG_CONTEXT_CACHE_TTL", "600"))
+    # 近似查询缓存：查询向量余弦距离 <= RAG_PROX_TAU 时直接复用缓存结果
+    RAG_PROX_TAU = float(os.getenv("RAG_PROX_TAU", "0.05"))
+    RAG_PROX_CACHE = int(os.getenv("RAG_PROX_CACHE", "512"))
+    # 近似查询缓存条目的存活秒数（索引文件变化时立即失效，TTL 兜底限制缓存结果的最长使用时间）
+    RAG_PROX_CACHE_TTL = int(os.getenv("RAG_PROX_CACHE_TTL", "300"))
+    # 查询文本 -> 查询向量缓存条数（完全相同的查询不再重复执行模型推理，0 表示不缓存）
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+    
+    # 向量存储配置
+    # EMBEDDING_DTYPE: float32 使用精确的 IndexFlatIP；float16 使用 fp16 标量量化索引，内存和搜索带宽减半、
+    # 召回几乎无损；bfloat16 内存与 float16 相同且取值范围同 float32（适合未归一化的向量，需 FAISS >= 1.8）；
+    # int8 使用 8bit 标量量化索引，内存占用约为 1/4；binary 使用二值量化索引（内存约 1/32，
+    # 汉明距离粗排后用磁盘上的 float16 向量重新打分，适合超大文件）（只影响新建的索引）
+    EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float16")
+    # 向量矩阵超过该大小（MB）时使用磁盘映射（memmap）分块写入，避免常驻内存过高
+    EMBEDDING_MEMMAP_THRESHOLD_MB = int(os.getenv("EMBEDDING_MEMMAP_THRESHOLD_MB", "256"))
+    # IVF 索引：向量数少于 IVF_MIN_VECTORS 时仍使用 Flat 索引（倒排的训练和探查开销不划算）；
+    # IVF_NPROBE 为搜索时探查的聚类数（0 表示 sqrt(nlist)）
+    IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "10000"))
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", "0"))
+    # 段落向量化时每批的估算 token 上限（按文本长度打包批次）
+    EMBEDDING_MAX_TOKENS_PER_BATCH = int(os.getenv("EMBEDDING_MAX_TOKENS_PER_BATCH", "16384"))
+    
+    # 文件ID解析缓存（解析记录ID -> 文件ID 的映射在文件生命周期内不变）
+    FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", "4096"))
+    FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", "600"))
+    # 索引信息/索引列表缓存秒数（创建、删除索引时主动失效；列表中的段落数最多延迟一个 TTL）
+    EMBEDDING_INFO_CACHE_TTL = int(os.getenv("EMBEDDING_INFO_CACHE_TTL", "30"))
+    EMBEDDING_LIST_CACHE_TTL = int(os.getenv("EMBEDDING_LIST_CACHE_TTL", "10"))
+    
+    # 批量解析/分段进程池大小（0 表示使用 CPU 核数）
+    PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", "0"))
+    # 单个请求内解析/分段使用的线程池大小，以及等待结果的超时秒数
+    CPU_THREAD_POOL_WORKERS = int(os.getenv("CPU_THREAD_POOL_WORKERS", "4"))
+    CPU_TASK_TIMEOUT = float(os.getenv("CPU_TASK_TIMEOUT", "120"))
+    # 批量解析/分段单次请求的最大文件数，以及等待整批结果的超时秒数（超时未完成的文件计为失败）
+    BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+    BATCH_TASK_TIMEOUT = float(os.getenv("BATCH_TASK_TIMEOUT", "600"))
+    # 多文件向量搜索的共享线程池大小（0 表示 min(32, CPU 核数)）
+    SEARCH_THREAD_POOL_WORKERS = int(os.getenv("SEARCH_THREAD_POOL_WORKERS", "0"))
+    # 批量更新标签单次请求的最大条数（全部更新合并为一次 bulk_write，限制请求体和写入批次大小）
+    TAG_BATCH_MAX_UPDATES = int(os.getenv("TAG_BATCH_MAX_UPDATES", "1000"))
+    
+    # 控制器结果缓存（进程内缓存，多 worker 间的失效最多延迟一个 TTL）
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "30"))
+    # 按ID查询的文件/解析记录缓存（每个 worker 进程各自一份，跨 worker 依赖 TTL 过期保持一致）
+    RECORD_CACHE_SIZE = int(os.getenv("RECORD_CACHE_SIZE", "1024"))
+    RECORD_CACHE_TTL = int(os.getenv("RECORD_CACHE_TTL", "30"))
+    # 解析/分段统计结果缓存秒数（统计需要全集合聚合，写操作时主动失效）
+    STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", "30"))
     
     # 文件存储相关配置
     FILENAME_MAX_LENGTH = 255
@@ -57,6 +148,7 @@ class Config:
 # 生产环境配置（可根据需要扩展）
 class ProductionConfig(Config):
     DEBUG = False
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING")
     MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/chem_knowledge_base_prod")
 
 # 开发环境配置
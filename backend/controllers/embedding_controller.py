@@ -13,20 +13,122 @@ Embedding 业务逻辑控制器
 日期：2025-08-07
 """
 
+import os
 import time
 import logging
-from typing import Dict, Any, List
+import threading
+from concurrent.futures import Future
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
+import numpy as np
+import orjson
+from bson import ObjectId
+from cachetools import LRUCache, TTLCache
+from pymongo.errors import PyMongoError
+
 # 导入模型和服务
 from models.segment_model import SegmentModel
 from models.parse_model import ParseModel
 from services.embedding_service import get_embedding_service
-from services.vector_store import get_vector_store
+from services.vector_store import get_vector_store, VectorStore
+from services.worker_pool import get_search_pool
+from services.retriever import clear_context_cache
+from db import get_db
+from config import Config
 
 logger = logging.getLogger(__name__)
 
 
+def _json_default(obj):
+    """orjson 无法原生序列化的类型（ObjectId）转为字符串"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class _QueryCacheBucket:
+    """
+    单个 (文件, top_k) 分组的近似查询缓存
+    
+    查询向量存放在预分配的连续矩阵中（按需倍增），查找时只做一次矩阵向量乘和 argmax；
+    每个分组有自己的锁，不同文件的搜索互不阻塞
+    """
+    
+    __slots__ = ('lock', 'version', 'size', 'vectors', 'results', 'expires', 'last_used')
+    
+    def __init__(self, version):
+        self.lock = threading.Lock()
+        # 写入结果时索引文件的版本
+        self.version = version
+        self.size = 0
+        self.vectors = None
+        self.results = []
+        self.expires = None
+        self.last_used = None
+    
+    def _reserve(self, capacity: int, dim: int):
+        """扩容到 capacity 行（保留已有数据）"""
+        vectors = np.empty((capacity, dim), dtype=np.float32)
+        expires = np.empty(capacity, dtype=np.float64)
+        last_used = np.empty(capacity, dtype=np.float64)
+        if self.vectors is not None:
+            vectors[:self.size] = self.vectors[:self.size]
+            expires[:self.size] = self.expires[:self.size]
+            last_used[:self.size] = self.last_used[:self.size]
+        self.vectors, self.expires, self.last_used = vectors, expires, last_used
+    
+    def lookup(self, query_vector: np.ndarray, min_similarity: float, now: float):
+        """
+        查找与查询向量余弦相似度不低于 min_similarity 的未过期缓存
+        
+        Returns:
+            命中时返回缓存的原始搜索结果，否则返回 None
+        """
+        with self.lock:
+            n = self.size
+            if n == 0 or self.vectors.shape[1] != query_vector.shape[0]:
+                return None
+            sims = self.vectors[:n] @ query_vector
+            sims[self.expires[:n] <= now] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < min_similarity:
+                return None
+            self.last_used[best] = now
+            return self.results[best]
+    
+    def store(self, query_vector: np.ndarray, raw_results, expires_at: float, now: float,
+              capacity: int) -> int:
+        """
+        写入一条缓存，分组已满时覆盖已过期或最久未使用的一行
+        
+        Returns:
+            int: 新增的行数（覆盖时为 0）
+        """
+        with self.lock:
+            dim = query_vector.shape[0]
+            if self.vectors is not None and self.vectors.shape[1] != dim:
+                self.size, self.vectors, self.results = 0, None, []
+            n = self.size
+            if n < capacity:
+                if self.vectors is None or n == len(self.vectors):
+                    self._reserve(min(capacity, max(16, 2 * n)), dim)
+                row = n
+                self.size += 1
+                self.results.append(raw_results)
+                added = 1
+            else:
+                row = int(np.argmin(np.where(self.expires[:n] <= now, -np.inf, self.last_used[:n])))
+                self.results[row] = raw_results
+                added = 0
+            self.vectors[row] = query_vector
+            self.expires[row] = expires_at
+            self.last_used[row] = now
+            return added
+
+
 class EmbeddingController:
     """
     Embedding 业务逻辑控制器
@@ -34,36 +136,168 @@ class EmbeddingController:
     
     def __init__(self):
         """初始化控制器"""
-        from config import Config
-        
-        self.segment_model = SegmentModel(Config.MONGO_URI, Config.MONGO_DB_NAME)
-        self.parse_model = ParseModel(Config.MONGO_URI, Config.MONGO_DB_NAME)
+        db = get_db()
+        self.segment_model = SegmentModel(db)
+        self.parse_model = ParseModel(db)
         self.embedding_service = get_embedding_service()
         self.vector_store = get_vector_store()
         
+        # 近似查询缓存: (file_id, top_k) -> 该分组的查询向量矩阵和原始搜索结果；按分组 LRU 淘汰，
+        # 全部分组的总条数不超过 RAG_PROX_CACHE
+        self._query_cache = OrderedDict()
+        self._query_cache_rows = 0
+        self._query_cache_lock = threading.Lock()
+        self._query_cache_size = Config.RAG_PROX_CACHE
+        self._query_cache_tau = Config.RAG_PROX_TAU
+        self._query_cache_ttl = Config.RAG_PROX_CACHE_TTL
+        
+        # 查询向量缓存: 查询文本 -> 查询向量（只读数组，多个请求共享）
+        self._embedding_cache = LRUCache(maxsize=max(Config.QUERY_EMBEDDING_CACHE_SIZE, 1))
+        # 正在编码的查询: 查询文本 -> Future，同一查询的并发请求只执行一次模型推理
+        self._embedding_inflight = {}
+        self._embedding_cache_lock = threading.Lock()
+        
+        # 索引信息缓存: 实际文件ID -> 索引信息；索引列表缓存: None -> 列表结果
+        self._info_cache = TTLCache(maxsize=Config.FILE_ID_CACHE_SIZE, ttl=Config.EMBEDDING_INFO_CACHE_TTL)
+        self._list_cache = TTLCache(maxsize=1, ttl=Config.EMBEDDING_LIST_CACHE_TTL)
+        self._info_cache_lock = threading.Lock()
+        
+        # 文件ID解析缓存: 传入的ID -> 实际文件ID
+        self._file_id_cache = TTLCache(maxsize=Config.FILE_ID_CACHE_SIZE, ttl=Config.FILE_ID_CACHE_TTL)
+        self._file_id_cache_lock = threading.Lock()
+        
         logger.info("EmbeddingController 初始化完成")
     
     def _serialize_datetime(self, obj):
         """
-        递归处理对象中的 datetime 和 ObjectId 类型
-        """
-        from bson import ObjectId
-        from datetime import datetime
-        
-        if isinstance(obj, dict):
-            return {key: self._serialize_datetime(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [self._serialize_datetime(item) for item in obj]
-        elif isinstance(obj, ObjectId):
-            return str(obj)
-        elif isinstance(obj, datetime):
-            return obj.isoformat()
-        else:
-            return obj
+        将对象中的 datetime 和 ObjectId 转换为字符串
+        
+        通过 orjson（C 实现）一次完成序列化与反序列化，datetime 输出格式与 isoformat() 一致
+        """
+        return orjson.loads(orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY))
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """
+        将查询文本转换为向量，相同文本直接复用缓存的向量；
+        缓存未命中时，同一查询的并发请求（如前端同时搜索多个文件）等待同一次编码结果
+        
+        Args:
+            query (str): 查询文本
+            
+        Returns:
+            np.ndarray: 查询向量（只读）
+        """
+        if Config.QUERY_EMBEDDING_CACHE_SIZE <= 0:
+            return self.embedding_service.encode_text(query)
+        
+        with self._embedding_cache_lock:
+            cached = self._embedding_cache.get(query)
+            if cached is not None:
+                return cached
+            future = self._embedding_inflight.get(query)
+            owner = future is None
+            if owner:
+                future = self._embedding_inflight[query] = Future()
+        
+        if not owner:
+            return future.result(timeout=Config.CPU_TASK_TIMEOUT)
+        
+        try:
+            query_vector = self.embedding_service.encode_text(query)
+            query_vector.setflags(write=False)
+            with self._embedding_cache_lock:
+                # 编码失败时返回零向量，不缓存
+                if query_vector.any():
+                    self._embedding_cache[query] = query_vector
+                del self._embedding_inflight[query]
+            future.set_result(query_vector)
+            return query_vector
+        except BaseException as e:
+            with self._embedding_cache_lock:
+                self._embedding_inflight.pop(query, None)
+            future.set_exception(e)
+            raise
+    
+    def _lookup_query_cache(self, file_id: str, top_k: int,
+                            query_vector: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]]:
+        """
+        在近似查询缓存中查找与当前查询向量足够接近的历史查询
+        
+        Args:
+            file_id (str): 文件ID
+            top_k (int): 返回结果数量
+            query_vector (np.ndarray): 已归一化的查询向量
+            
+        Returns:
+            Optional[Tuple]: 命中时返回缓存的原始搜索结果 (相似度, 下标, 元数据)，否则返回 None
+        """
+        if self._query_cache_size <= 0:
+            return None
+        
+        # 索引可能已被其他 worker 重建或删除：缓存结果只在索引文件版本不变时有效
+        version = self.vector_store.index_version(file_id)
+        key = (file_id, top_k)
+        with self._query_cache_lock:
+            bucket = self._query_cache.get(key)
+            if bucket is None:
+                return None
+            if bucket.version != version:
+                self._query_cache_rows -= self._query_cache.pop(key).size
+                return None
+            self._query_cache.move_to_end(key)
+        
+        return bucket.lookup(query_vector, 1 - self._query_cache_tau, time.monotonic())
+    
+    def _store_query_cache(self, file_id: str, top_k: int, query_vector: np.ndarray,
+                           raw_results: Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]):
+        """
+        将搜索结果写入近似查询缓存，总条数超出容量时淘汰最久未使用的 (文件, top_k) 分组
+        """
+        # 搜索出错或无结果时 search_raw 返回空数组，不缓存，避免在 TTL 内持续返回空结果
+        if self._query_cache_size <= 0 or len(raw_results[0]) == 0:
+            return
+        
+        # 结果来自本进程已加载的索引，记录其版本
+        version = self.vector_store.index_versions.get(file_id)
+        key = (file_id, top_k)
+        with self._query_cache_lock:
+            bucket = self._query_cache.get(key)
+            if bucket is None or bucket.version != version:
+                if bucket is not None:
+                    self._query_cache_rows -= bucket.size
+                bucket = self._query_cache[key] = _QueryCacheBucket(version)
+            self._query_cache.move_to_end(key)
+        
+        now = time.monotonic()
+        added = bucket.store(query_vector, raw_results, now + self._query_cache_ttl, now,
+                             self._query_cache_size)
+        
+        with self._query_cache_lock:
+            # 写入期间分组可能已被淘汰或失效，此时不再计数
+            if self._query_cache.get(key) is bucket:
+                self._query_cache_rows += added
+            while self._query_cache_rows > self._query_cache_size and len(self._query_cache) > 1:
+                _, evicted = self._query_cache.popitem(last=False)
+                self._query_cache_rows -= evicted.size
+    
+    def _invalidate_query_cache(self, file_id: str):
+        """
+        清除指定文件的近似查询缓存（索引重建或删除后调用）
+        """
+        with self._query_cache_lock:
+            for key in [key for key in self._query_cache if key[0] == file_id]:
+                self._query_cache_rows -= self._query_cache.pop(key).size
+    
+    def _invalidate_info_cache(self, file_id: str):
+        """索引创建或删除后，清除该文件的索引信息缓存和索引列表缓存"""
+        with self._info_cache_lock:
+            self._info_cache.pop(file_id, None)
+            self._list_cache.clear()
+        clear_context_cache()
     
     def _resolve_file_id(self, file_id: str) -> str:
         """
-        解析文件ID，支持传入解析记录ID或文件ID
+        解析文件ID，支持传入解析记录ID或文件ID，结果在 TTL 内缓存
         
         Args:
             file_id (str): 文件ID或解析记录ID
@@ -71,35 +305,108 @@ class EmbeddingController:
         Returns:
             str: 实际的文件ID，用于段落查询
         """
+        with self._file_id_cache_lock:
+            cached = self._file_id_cache.get(file_id)
+        if cached is not None:
+            return cached
+        
         try:
-            # 首先尝试作为文件ID直接查询段落
-            segments = self.segment_model.get_segments_by_file_id(file_id)
-            if segments:
-                logger.info(f"直接使用文件ID查询到段落: {file_id}")
-                return file_id
-            
-            # 如果没有找到，尝试作为解析记录ID查询
-            parse_record = self.parse_model.get_parse_by_id(file_id)
-            if parse_record:
-                actual_file_id = parse_record.get('file_id', file_id)
-                logger.info(f"通过解析记录ID {file_id} 找到文件ID: {actual_file_id}")
-                return actual_file_id
-            
-            # 最后尝试通过文件ID查找解析记录
-            parse_record = self.parse_model.get_parse_by_file_id(file_id)
-            if parse_record:
-                logger.info(f"通过文件ID找到解析记录: {file_id}")
-                return file_id
-            
-            logger.warning(f"无法解析文件ID: {file_id}")
+            actual_file_id = self._query_file_id(file_id)
+        except PyMongoError as e:
+            # 查询失败时不写入缓存，下次请求重新解析
+            logger.exception("解析文件ID失败: %s", e)
             return file_id
+        
+        with self._file_id_cache_lock:
+            self._file_id_cache[file_id] = actual_file_id
+        return actual_file_id
+    
+    def _query_file_id(self, file_id: str) -> str:
+        """
+        通过数据库查询解析实际的文件ID
+        
+        Args:
+            file_id (str): 文件ID或解析记录ID
             
-        except Exception as e:
-            logger.error(f"解析文件ID失败: {str(e)}")
+        Returns:
+            str: 实际的文件ID
+        """
+        # 首先尝试作为文件ID直接查询段落（只判断是否存在，不读取段落内容）
+        if self.segment_model.get_file_ids_with_segments([file_id]):
+            logger.info("直接使用文件ID查询到段落: %s", file_id)
             return file_id
+        
+        # 如果没有找到，尝试作为解析记录ID查询
+        parse_record = self.parse_model.get_parse_by_id(file_id)
+        if parse_record:
+            actual_file_id = parse_record.get('file_id', file_id)
+            logger.info("通过解析记录ID %s 找到文件ID: %s", file_id, actual_file_id)
+            return actual_file_id
+        
+        # 最后检查该文件ID是否有解析记录
+        if self.parse_model.parse_exists(file_id):
+            logger.info("通过文件ID找到解析记录: %s", file_id)
+            return file_id
+        
+        logger.warning("无法解析文件ID: %s", file_id)
+        return file_id
+    
+    def _clear_file_id_cache(self):
+        """清空文件ID解析缓存（索引重建或删除后调用）"""
+        with self._file_id_cache_lock:
+            self._file_id_cache.clear()
+    
+    def _resolve_file_ids(self, file_ids: List[str]) -> List[str]:
+        """
+        批量解析文件ID，语义与 _resolve_file_id 一致，但最多只发起两次数据库查询
+        
+        Args:
+            file_ids (List[str]): 文件ID或解析记录ID列表
+            
+        Returns:
+            List[str]: 与输入一一对应的实际文件ID列表
+        """
+        with self._file_id_cache_lock:
+            resolved = {fid: self._file_id_cache[fid] for fid in file_ids if fid in self._file_id_cache}
+        
+        misses = [fid for fid in dict.fromkeys(file_ids) if fid not in resolved]
+        if misses:
+            try:
+                present = self.segment_model.get_file_ids_with_segments(misses)
+                parse_map = self.parse_model.get_parse_mapping(list(set(misses) - present))
+                fresh = {fid: fid if fid in present else parse_map.get(fid, fid) for fid in misses}
+                
+                with self._file_id_cache_lock:
+                    self._file_id_cache.update(fresh)
+                resolved.update(fresh)
+                
+            except PyMongoError as e:
+                logger.exception("批量解析文件ID失败: %s", e)
+        
+        return [resolved.get(fid, fid) for fid in file_ids]
+    
+    @staticmethod
+    def _check_index_params(index_type: str, n_vectors: int, embedding_dim: int,
+                            nlist: int = None, pq_m: int = None) -> Optional[str]:
+        """
+        校验新建 IVF 索引的参数，返回错误信息（合法时返回 None）
+        
+        向量数不足 Config.IVF_MIN_VECTORS 时索引退化为 Flat，nlist / pq_m 不生效，无需校验
+        """
+        if index_type == "flat" or n_vectors < Config.IVF_MIN_VECTORS:
+            return None
+        if nlist and nlist > n_vectors:
+            return f'nlist ({nlist}) 不能大于向量数 ({n_vectors})'
+        if index_type == "ivf_pq":
+            m = pq_m or embedding_dim // 8
+            if m < 1 or embedding_dim % m != 0:
+                return f'pq_m ({m}) 必须整除向量维度 ({embedding_dim})'
+        return None
     
     def create_embeddings(self, file_id: str, recreate: bool = False, 
-                         batch_size: int = 32) -> Dict[str, Any]:
+                         batch_size: int = 32, max_tokens_per_batch: int = None,
+                         dtype: str = None, index_type: str = "flat", nlist: int = None,
+                         pq_m: int = None) -> Dict[str, Any]:
         """
         为指定文件创建 embedding 索引
         
@@ -107,6 +414,11 @@ class EmbeddingController:
             file_id (str): 文件ID或解析记录ID
             recreate (bool): 是否强制重新创建索引
             batch_size (int): 批处理大小
+            max_tokens_per_batch (int): 每批估算 token 上限，默认使用配置值
+            dtype (str): 新建索引的向量存储精度 (float32 / float16 / bfloat16 / int8 / binary)，默认使用配置值
+            index_type (str): 新建索引的结构 (flat / ivf / ivf_pq)
+            nlist (int): IVF 聚类数，默认按向量数自动选择
+            pq_m (int): ivf_pq 子量化器个数，默认 维度/8
             
         Returns:
             Dict[str, Any]: 处理结果
@@ -114,7 +426,13 @@ class EmbeddingController:
         start_time = time.time()
         
         try:
-            logger.info(f"开始为文件 {file_id} 创建 embedding，重新创建: {recreate}")
+            logger.info("开始为文件 %s 创建 embedding，重新创建: %s", file_id, recreate)
+            
+            if dtype and not VectorStore.supports_dtype(dtype):
+                return {
+                    'success': False,
+                    'error': f'当前 FAISS 版本不支持 {dtype} 索引'
+                }
             
             # 解析实际的文件ID
             actual_file_id = self._resolve_file_id(file_id)
@@ -122,7 +440,7 @@ class EmbeddingController:
             # 检查是否已存在索引
             if not recreate and self.vector_store.index_exists(actual_file_id):
                 index_info = self.vector_store.get_index_info(actual_file_id)
-                logger.info(f"文件 {actual_file_id} 的索引已存在")
+                logger.info("文件 %s 的索引已存在", actual_file_id)
                 
                 processing_time = time.time() - start_time
                 return {
@@ -138,7 +456,7 @@ class EmbeddingController:
                 }
             
             # 获取段落数据
-            logger.info(f"获取文件 {actual_file_id} 的段落数据")
+            logger.info("获取文件 %s 的段落数据", actual_file_id)
             segments = self.segment_model.get_segments_by_file_id(actual_file_id)
             
             if not segments:
@@ -147,13 +465,16 @@ class EmbeddingController:
                     'error': f'文件 {actual_file_id} 没有可用的段落数据，请先进行文档分段'
                 }
             
-            logger.info(f"找到 {len(segments)} 个段落，开始生成 embedding")
+            logger.info("找到 %s 个段落，开始生成 embedding", len(segments))
             
             # 序列化段落数据
-            serialized_segments = [self._serialize_datetime(segment) for segment in segments]
+            serialized_segments = self._serialize_datetime(segments)
             
             # 生成 embedding
-            embeddings, metadata = self.embedding_service.encode_segments(serialized_segments)
+            embeddings, metadata = self.embedding_service.encode_segments(
+                serialized_segments, max_tokens_per_batch=max_tokens_per_batch
+            )
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
             
             if embeddings.size == 0:
                 return {
@@ -161,13 +482,29 @@ class EmbeddingController:
                     'error': '向量生成失败，请检查段落文本内容'
                 }
             
+            # 先校验 IVF 参数，避免 recreate 时删除了可用的旧索引后才在建索引时失败
+            param_error = self._check_index_params(
+                index_type, len(embeddings), embeddings.shape[1], nlist, pq_m
+            )
+            if param_error:
+                return {
+                    'success': False,
+                    'error': param_error
+                }
+            
             # 如果需要重新创建，先删除现有索引
             if recreate:
                 self.vector_store.delete_index(actual_file_id)
+                self._clear_file_id_cache()
             
             # 存储到向量库
-            logger.info(f"将 {len(embeddings)} 个向量存储到向量库")
-            success = self.vector_store.add_vectors(actual_file_id, embeddings, metadata)
+            logger.info("将 %s 个向量存储到向量库", len(embeddings))
+            success = self.vector_store.add_vectors(
+                actual_file_id, embeddings, metadata,
+                dtype=dtype, index_type=index_type, nlist=nlist, pq_m=pq_m
+            )
+            self._invalidate_query_cache(actual_file_id)
+            self._invalidate_info_cache(actual_file_id)
             
             if not success:
                 return {
@@ -180,7 +517,7 @@ class EmbeddingController:
             
             processing_time = time.time() - start_time
             
-            logger.info(f"文件 {actual_file_id} 的 embedding 创建完成，耗时 {processing_time:.2f}s")
+            logger.info("文件 %s 的 embedding 创建完成，耗时 %.2fs", actual_file_id, processing_time)
             
             return {
                 'success': True,
@@ -194,7 +531,7 @@ class EmbeddingController:
             }
             
         except Exception as e:
-            logger.error(f"创建 embedding 失败: {str(e)}")
+            logger.exception("创建 embedding 失败: %s", e)
             return {
                 'success': False,
                 'error': f'创建 embedding 失败: {str(e)}'
@@ -214,25 +551,31 @@ class EmbeddingController:
             # 解析实际的文件ID
             actual_file_id = self._resolve_file_id(file_id)
             
+            with self._info_cache_lock:
+                cached = self._info_cache.get(actual_file_id)
+            if cached is not None:
+                return cached
+            
             # 获取索引信息
             info = self.vector_store.get_index_info(actual_file_id)
             
             if info.get('exists'):
-                # 添加创建时间信息
-                try:
-                    # 尝试从文件修改时间获取创建时间
-                    import os
-                    index_path = info.get('index_path')
-                    if index_path and os.path.exists(index_path):
-                        created_timestamp = os.path.getmtime(index_path)
-                        info['created_at'] = datetime.fromtimestamp(created_timestamp).isoformat()
-                except:
+                # 从索引文件修改时间获取创建时间
+                index_path = info.get('index_path')
+                if index_path and os.path.exists(index_path):
+                    created_timestamp = os.path.getmtime(index_path)
+                    info['created_at'] = datetime.fromtimestamp(created_timestamp).isoformat()
+                else:
                     info['created_at'] = None
             
+            # 读取失败（带 error）的结果不缓存
+            if 'error' not in info:
+                with self._info_cache_lock:
+                    self._info_cache[actual_file_id] = info
             return info
             
         except Exception as e:
-            logger.error(f"获取 embedding 信息失败: {str(e)}")
+            logger.exception("获取 embedding 信息失败: %s", e)
             return {
                 'exists': False,
                 'error': str(e)
@@ -261,9 +604,12 @@ class EmbeddingController:
             
             # 删除索引
             success = self.vector_store.delete_index(actual_file_id)
+            self._invalidate_query_cache(actual_file_id)
+            self._invalidate_info_cache(actual_file_id)
+            self._clear_file_id_cache()
             
             if success:
-                logger.info(f"文件 {actual_file_id} 的索引删除成功")
+                logger.info("文件 %s 的索引删除成功", actual_file_id)
                 return {
                     'success': True,
                     'data': {
@@ -278,7 +624,7 @@ class EmbeddingController:
                 }
                 
         except Exception as e:
-            logger.error(f"删除 embedding 失败: {str(e)}")
+            logger.exception("删除 embedding 失败: %s", e)
             return {
                 'success': False,
                 'error': f'删除 embedding 失败: {str(e)}'
@@ -291,31 +637,39 @@ class EmbeddingController:
         Returns:
             Dict[str, Any]: 索引列表
         """
+        with self._info_cache_lock:
+            cached = self._list_cache.get(None)
+        if cached is not None:
+            return cached
+        
         try:
             indices = self.vector_store.list_all_indices()
             
+            # 一次聚合查询获取所有文件的段落数量和文件名
+            file_ids = [info['file_id'] for info in indices if info.get('file_id')]
+            counts_and_names = self.segment_model.get_counts_and_names(file_ids)
+            
             # 添加额外信息
             for index_info in indices:
-                try:
-                    file_id = index_info.get('file_id')
-                    if file_id:
-                        # 尝试获取段落数量
-                        segments = self.segment_model.get_segments_by_file_id(file_id)
-                        index_info['segment_count'] = len(segments) if segments else 0
-                        
-                        # 尝试获取文件名
-                        if segments:
-                            index_info['file_name'] = segments[0].get('file_name', 'Unknown')
-                except:
-                    pass
+                file_id = index_info.get('file_id')
+                if not file_id:
+                    continue
+                
+                segment_count, file_name = counts_and_names.get(file_id, (0, None))
+                index_info['segment_count'] = segment_count
+                if segment_count:
+                    index_info['file_name'] = file_name or 'Unknown'
             
-            return {
+            result = {
                 'total': len(indices),
                 'indices': indices
             }
+            with self._info_cache_lock:
+                self._list_cache[None] = result
+            return result
             
         except Exception as e:
-            logger.error(f"列出 embedding 索引失败: {str(e)}")
+            logger.exception("列出 embedding 索引失败: %s", e)
             return {
                 'total': 0,
                 'indices': [],
@@ -323,7 +677,7 @@ class EmbeddingController:
             }
     
     def search_embeddings(self, file_id: str, query: str, top_k: int = 5, 
-                         min_score: float = 0.0) -> Dict[str, Any]:
+                         min_score: float = 0.0, nprobe: int = None) -> Dict[str, Any]:
         """
         在指定文件的向量索引中搜索
         
@@ -332,6 +686,7 @@ class EmbeddingController:
             query (str): 查询文本
             top_k (int): 返回结果数量
             min_score (float): 最小相似度阈值
+            nprobe (int): IVF 索引探查的聚类数，默认使用索引默认值
             
         Returns:
             Dict[str, Any]: 搜索结果
@@ -339,7 +694,7 @@ class EmbeddingController:
         start_time = time.time()
         
         try:
-            logger.info(f"搜索文件 {file_id}，查询: '{query[:50]}...'")
+            logger.info("搜索文件 %s，查询: '%s...'", file_id, query[:50])
             
             # 解析实际的文件ID
             actual_file_id = self._resolve_file_id(file_id)
@@ -352,26 +707,37 @@ class EmbeddingController:
                 }
             
             # 将查询文本转换为向量
-            query_vector = self.embedding_service.encode_text(query)
-            
-            # 在向量库中搜索
-            results = self.vector_store.search(actual_file_id, query_vector, top_k)
+            query_vector = self._encode_query(query)
+            
+            # 先查近似查询缓存，未命中再在向量库中搜索（指定 nprobe 的搜索不经过缓存）
+            norm = np.linalg.norm(query_vector)
+            use_cache = norm > 0 and nprobe is None
+            raw_results = None
+            if norm > 0:
+                query_vector = (query_vector / norm).astype(np.float32)
+            if use_cache:
+                raw_results = self._lookup_query_cache(actual_file_id, top_k, query_vector)
+            
+            if raw_results is None:
+                raw_results = self.vector_store.search_raw(actual_file_id, query_vector, top_k, nprobe=nprobe)
+                if use_cache:
+                    self._store_query_cache(actual_file_id, top_k, query_vector, raw_results)
+            else:
+                logger.info("近似查询缓存命中，文件: %s", actual_file_id)
             
             # 过滤低分结果
-            filtered_results = [
-                result for result in results 
-                if result.get('similarity', 0) >= min_score
-            ]
+            filtered_results = VectorStore.build_results(*raw_results, min_score=min_score)
             
             search_time = time.time() - start_time
             
-            logger.info(f"搜索完成，返回 {len(filtered_results)} 个结果，耗时 {search_time:.3f}s")
+            logger.info("搜索完成，返回 %s 个结果，耗时 %.3fs", len(filtered_results), search_time)
             
             return {
                 'success': True,
                 'data': {
                     'query': query,
                     'file_id': actual_file_id,
+                    'dtype': self.vector_store.get_index_dtype(actual_file_id),
                     'total_results': len(filtered_results),
                     'search_time': round(search_time, 3),
                     'results': filtered_results
@@ -379,14 +745,42 @@ class EmbeddingController:
             }
             
         except Exception as e:
-            logger.error(f"搜索 embedding 失败: {str(e)}")
+            logger.exception("搜索 embedding 失败: %s", e)
             return {
                 'success': False,
                 'error': f'搜索失败: {str(e)}'
             }
     
+    def _search_single_file(self, file_id: str, query_vector: np.ndarray, top_k: int,
+                            min_score: float, nprobe: int = None) -> List[Dict[str, Any]]:
+        """
+        在单个文件的索引中搜索并按最小相似度过滤，供多文件并发搜索使用
+        
+        Args:
+            file_id (str): 实际文件ID
+            query_vector (np.ndarray): 查询向量
+            top_k (int): 返回结果数量
+            min_score (float): 最小相似度阈值
+            nprobe (int): IVF 索引探查的聚类数
+            
+        Returns:
+            List[Dict[str, Any]]: 过滤后的搜索结果
+        """
+        try:
+            if not self.vector_store.index_exists(file_id):
+                logger.warning("文件 %s 的索引不存在", file_id)
+                return []
+            
+            raw_results = self.vector_store.search_raw(file_id, query_vector, top_k, nprobe=nprobe)
+            return VectorStore.build_results(*raw_results, min_score=min_score)
+            
+        except Exception as e:
+            logger.exception("搜索文件 %s 失败: %s", file_id, e)
+            return []
+    
     def search_multiple_files(self, file_ids: List[str], query: str, 
-                            top_k: int = 5, min_score: float = 0.0) -> Dict[str, Any]:
+                            top_k: int = 5, min_score: float = 0.0,
+                            nprobe: int = None) -> Dict[str, Any]:
         """
         在多个文件的向量索引中搜索
         
@@ -395,6 +789,7 @@ class EmbeddingController:
             query (str): 查询文本
             top_k (int): 每个文件返回结果数量
             min_score (float): 最小相似度阈值
+            nprobe (int): IVF 索引探查的聚类数
             
         Returns:
             Dict[str, Any]: 搜索结果
@@ -402,34 +797,27 @@ class EmbeddingController:
         start_time = time.time()
         
         try:
-            logger.info(f"多文件搜索，文件数: {len(file_ids)}，查询: '{query[:50]}...'")
+            logger.info("多文件搜索，文件数: %s，查询: '%s...'", len(file_ids), query[:50])
             
             # 解析实际的文件ID列表
-            actual_file_ids = [self._resolve_file_id(fid) for fid in file_ids]
+            actual_file_ids = self._resolve_file_ids(file_ids)
             
             # 将查询文本转换为向量
-            query_vector = self.embedding_service.encode_text(query)
-            
-            # 在向量库中搜索
-            all_results = self.vector_store.search_multiple_files(
-                actual_file_ids, query_vector, top_k
-            )
+            query_vector = self._encode_query(query)
             
-            # 过滤低分结果
-            filtered_results = {}
-            total_results = 0
+            # 在向量库中并发搜索各文件（FAISS 搜索期间释放 GIL）并过滤低分结果
+            pool = get_search_pool()
+            futures = {
+                fid: pool.submit(self._search_single_file, fid, query_vector, top_k, min_score, nprobe)
+                for fid in dict.fromkeys(actual_file_ids)
+            }
+            filtered_results = {fid: future.result() for fid, future in futures.items()}
             
-            for file_id, results in all_results.items():
-                filtered = [
-                    result for result in results 
-                    if result.get('similarity', 0) >= min_score
-                ]
-                filtered_results[file_id] = filtered
-                total_results += len(filtered)
+            total_results = sum(len(results) for results in filtered_results.values())
             
             search_time = time.time() - start_time
             
-            logger.info(f"多文件搜索完成，总结果数: {total_results}，耗时 {search_time:.3f}s")
+            logger.info("多文件搜索完成，总结果数: %s，耗时 %.3fs", total_results, search_time)
             
             return {
                 'success': True,
@@ -443,12 +831,38 @@ class EmbeddingController:
             }
             
         except Exception as e:
-            logger.error(f"多文件搜索失败: {str(e)}")
+            logger.exception("多文件搜索失败: %s", e)
             return {
                 'success': False,
                 'error': f'多文件搜索失败: {str(e)}'
             }
     
+    def warmup(self) -> Dict[str, Any]:
+        """
+        预热模型和向量索引：执行一次编码并在首个索引上做一次搜索，
+        使后续真实请求无需承担模型/索引的首次加载开销
+        
+        Returns:
+            Dict[str, Any]: 预热结果
+        """
+        start_time = time.time()
+        
+        query_vector = self.embedding_service.encode_text("warmup")
+        
+        # list_all_indices 会把所有索引加载到内存缓存
+        indices = self.vector_store.list_all_indices()
+        if indices:
+            self.vector_store.search(indices[0]['file_id'], query_vector, top_k=1)
+        
+        warmup_time = time.time() - start_time
+        logger.info("预热完成，加载索引 %s 个，耗时 %.3fs", len(indices), warmup_time)
+        
+        return {
+            'model_loaded': self.embedding_service.model is not None,
+            'loaded_indices': len(indices),
+            'warmup_time': round(warmup_time, 3)
+        }
+    
     def health_check(self) -> Dict[str, Any]:
         """
         健康检查
@@ -472,9 +886,20 @@ class EmbeddingController:
             }
             
         except Exception as e:
-            logger.error(f"健康检查失败: {str(e)}")
+            logger.exception("健康检查失败: %s", e)
             return {
                 'service_status': 'unhealthy',
                 'error': str(e),
                 'timestamp': datetime.now().isoformat()
-            }
\ No newline at end of file
+            }
+
+
+@lru_cache(maxsize=1)
+def get_embedding_controller() -> EmbeddingController:
+    """
+    获取 Embedding 控制器单例
+    
+    Returns:
+        EmbeddingController: 控制器实例
+    """
+    return EmbeddingController()
@@ -4,12 +4,34 @@ file_controller.py - 文件控制器
 """
 
 import os
+import queue
+import threading
+import time
 import uuid
-import mimetypes
 from datetime import datetime
+from cachetools import TTLCache
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
 from config import Config
+from models.pagination import decode_cursor, encode_cursor
+
+# 允许的扩展名集合与扩展名 -> MIME 类型映射，导入时计算一次
+_ALLOWED_EXT_SET = frozenset(Config.ALLOWED_EXTENSIONS)
+_MIME_TYPES = dict(Config.SUPPORTED_FILE_TYPES)
+
+
+def sharded_path(upload_folder, filename):
+    """
+    计算文件在分片上传目录中的路径
+    按文件名 UUID 部分的前两个十六进制字符分到子目录，避免单个目录下文件过多
+    :param upload_folder: 上传根目录
+    :param filename: 存储文件名（新格式 <uuid hex>.<ext>，兼容旧格式 <时间戳>_<uuid>.<ext>）
+    :return: 文件完整路径
+    """
+    unique_id = os.path.splitext(filename)[0].rpartition('_')[2]
+    return os.path.join(upload_folder, unique_id[:2].lower(), filename)
+
 
 class FileController:
     """文件控制器类，处理文件相关的业务逻辑"""
@@ -21,8 +43,15 @@ class FileController:
         """
         self.file_model = file_model
         self.upload_folder = Config.UPLOAD_FOLDER
-        self.allowed_extensions = Config.ALLOWED_EXTENSIONS
+        self.allowed_extensions = _ALLOWED_EXT_SET
         self.max_file_size = Config.MAX_CONTENT_LENGTH
+        self.chunk_size = Config.UPLOAD_CHUNK_SIZE
+        self.queue_size = Config.UPLOAD_QUEUE_SIZE
+        self.db_batch_size = Config.UPLOAD_DB_BATCH_SIZE
+        self.db_batch_timeout = Config.UPLOAD_DB_BATCH_TIMEOUT
+        # 统计接口通常被轮询，短时间内复用统计结果
+        self._stats_cache = TTLCache(maxsize=1, ttl=Config.FILE_STATS_CACHE_TTL)
+        self._stats_cache_lock = threading.Lock()
     
     def allowed_file(self, filename):
         """
@@ -31,24 +60,58 @@ class FileController:
         :return: 是否允许
         """
         return '.' in filename and \
-               filename.rsplit('.', 1)[1].lower() in self.allowed_extensions
+               filename.rpartition('.')[2].lower() in self.allowed_extensions
     
-    def generate_unique_filename(self, original_filename):
+    def generate_unique_filename(self, file_ext):
         """
         生成唯一的文件名
-        :param original_filename: 原始文件名
+        :param file_ext: 文件扩展名（不含点，已转为小写）
         :return: 唯一文件名
         """
-        # 获取文件扩展名
-        file_ext = os.path.splitext(original_filename)[1].lower()
-        
-        # 生成UUID作为文件名
-        unique_id = str(uuid.uuid4())
-        
-        # 添加时间戳确保唯一性
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        return f"{timestamp}_{unique_id}{file_ext}"
+        # uuid4 本身即全局唯一，无需再拼接时间戳
+        suffix = f".{file_ext}" if file_ext else ""
+        return f"{uuid.uuid4().hex}{suffix}"
+    
+    def _stream_to_disk(self, stream, file_path):
+        """
+        分块将上传流写入磁盘，边写边统计大小
+        :param stream: 上传文件的输入流
+        :param file_path: 目标文件路径
+        :return: 写入的字节数
+        :raises RequestEntityTooLarge: 文件大小超过限制
+        """
+        size = 0
+        with open(file_path, 'wb', buffering=self.chunk_size) as fh:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_file_size:
+                    raise RequestEntityTooLarge()
+                fh.write(chunk)
+        return size
+    
+    def _link_spooled_file(self, stream, file_path):
+        """
+        上传内容已由 multipart 解析写入上传目录下的临时文件时，直接硬链接到目标路径（不复制文件内容）
+        :param stream: 上传文件的输入流
+        :param file_path: 目标文件路径
+        :return: 文件大小；无法链接（内存中的小文件、跨文件系统等）时返回 None
+        :raises RequestEntityTooLarge: 文件大小超过限制
+        """
+        temp_path = getattr(stream, 'name', None)
+        if not isinstance(temp_path, str):
+            return None
+        try:
+            stream.flush()
+            os.link(temp_path, file_path)
+        except (OSError, ValueError):
+            return None
+        size = os.path.getsize(file_path)
+        if size > self.max_file_size:
+            raise RequestEntityTooLarge()
+        return size
     
     def save_uploaded_file(self, file_storage, original_filename):
         """
@@ -56,23 +119,37 @@ class FileController:
         :param file_storage: 文件存储对象
         :param original_filename: 原始文件名
         :return: 保存后的文件信息字典或None
+        :raises RequestEntityTooLarge: 文件大小超过限制（已写入的部分会被删除）
         """
+        return self.save_stream(file_storage.stream, original_filename)
+    
+    def save_stream(self, stream, original_filename, mime_type=None):
+        """
+        将输入流保存为本地文件
+        :param stream: 文件内容输入流
+        :param original_filename: 原始文件名
+        :param mime_type: 客户端声明的MIME类型，扩展名无对应类型时使用
+        :return: 保存后的文件信息字典或None
+        :raises RequestEntityTooLarge: 文件大小超过限制（已写入的部分会被删除）
+        """
+        file_path = None
         try:
-            # 生成安全的文件名
+            # 生成安全的文件名；扩展名只解析一次，同时用于文件名和文件类型
+            # （从原始文件名解析：secure_filename 会去掉非 ASCII 字符，中文文件名的点号可能随之丢失）
             secure_name = secure_filename(original_filename)
-            unique_filename = self.generate_unique_filename(secure_name)
+            file_type = os.path.splitext(original_filename)[1].lower().lstrip('.')
+            unique_filename = self.generate_unique_filename(file_type)
             
-            # 构建文件保存路径
-            file_path = os.path.join(self.upload_folder, unique_filename)
+            # 构建文件保存路径（按文件名前缀分片存放）
+            file_path = sharded_path(self.upload_folder, unique_filename)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
             
-            # 保存文件
-            file_storage.save(file_path)
+            # 已落盘的上传内容直接链接；否则分块写入文件，同时得到文件大小
+            file_size = self._link_spooled_file(stream, file_path)
+            if file_size is None:
+                file_size = self._stream_to_disk(stream, file_path)
             
-            # 获取文件信息
-            file_size = os.path.getsize(file_path)
-            # 从原始文件名中提取文件类型，确保正确性
-            file_type = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-            mime_type, _ = mimetypes.guess_type(file_path)
+            mime_type = _MIME_TYPES.get(file_type, mime_type or 'application/octet-stream')
             
             return {
                 'name': unique_filename,
@@ -80,22 +157,37 @@ class FileController:
                 'path': file_path,
                 'type': file_type,
                 'size': file_size,
-                'mime_type': mime_type or ''
+                'mime_type': mime_type
             }
             
+        except RequestEntityTooLarge:
+            self._remove_partial_file(file_path)
+            raise
+        
         except Exception as e:
             print(f"Error saving file: {e}")
             # 如果保存失败，尝试删除已创建的文件
-            if 'file_path' in locals() and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
+            self._remove_partial_file(file_path)
             return None
     
+    def _remove_partial_file(self, file_path):
+        """
+        删除写入失败时残留的文件
+        :param file_path: 文件路径
+        """
+        if file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except:
+                pass
+    
     def upload_files(self, files):
         """
         处理多文件上传
+        
+        采用三段流水线：当前线程校验文件并放入落盘队列，落盘线程分块写入磁盘，
+        入库线程攒批（每 UPLOAD_DB_BATCH_SIZE 条或 UPLOAD_DB_BATCH_TIMEOUT 秒）批量写入数据库，
+        使磁盘写入与数据库写入相互重叠。
         :param files: 文件列表
         :return: 上传结果字典
         """
@@ -105,80 +197,203 @@ class FileController:
             'total': len(files)
         }
         
-        for file in files:
-            if not isinstance(file, FileStorage) or file.filename == '':
-                results['failed'].append({
-                    'filename': getattr(file, 'filename', 'unknown'),
-                    'error': 'Invalid file'
-                })
-                continue
-            
-            # 检查文件类型
-            if not self.allowed_file(file.filename):
-                results['failed'].append({
-                    'filename': file.filename,
-                    'error': f'File type not allowed. Supported types: {", ".join(self.allowed_extensions)}'
-                })
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        saved_queue = queue.Queue()
+        
+        writer = threading.Thread(
+            target=self._write_worker, args=(write_queue, saved_queue, results), daemon=True
+        )
+        recorder = threading.Thread(
+            target=self._record_worker, args=(saved_queue, results), daemon=True
+        )
+        writer.start()
+        recorder.start()
+        
+        try:
+            for file in files:
+                if not isinstance(file, FileStorage) or file.filename == '':
+                    results['failed'].append({
+                        'filename': getattr(file, 'filename', 'unknown'),
+                        'error': 'Invalid file'
+                    })
+                    continue
+                
+                # 检查文件类型
+                if not self.allowed_file(file.filename):
+                    results['failed'].append({
+                        'filename': file.filename,
+                        'error': f'File type not allowed. Supported types: {", ".join(self.allowed_extensions)}'
+                    })
+                    continue
+                
+                write_queue.put((file, file.filename))
+        finally:
+            # 结束信号：落盘线程处理完剩余文件后通知入库线程
+            write_queue.put(None)
+            writer.join()
+            recorder.join()
+        
+        return results
+    
+    def upload_stream(self, stream, filename, mime_type=None):
+        """
+        处理原始请求体上传（不经过 multipart 解析）
+        :param stream: 请求体输入流
+        :param filename: 原始文件名
+        :param mime_type: 客户端声明的MIME类型
+        :return: 上传结果字典
+        :raises RequestEntityTooLarge: 文件大小超过限制
+        """
+        if not filename:
+            return {'success': False, 'error': 'Invalid file'}
+        
+        # 检查文件类型
+        if not self.allowed_file(filename):
+            return {
+                'success': False,
+                'error': f'File type not allowed. Supported types: {", ".join(self.allowed_extensions)}'
+            }
+        
+        file_info = self.save_stream(stream, filename, mime_type)
+        if not file_info:
+            return {'success': False, 'error': 'Failed to save file to disk'}
+        
+        # 保存到数据库
+        file_id = self.file_model.create_file_record(file_info)
+        if not file_id:
+            # 如果数据库保存失败，删除本地文件
+            self._remove_partial_file(file_info['path'])
+            return {'success': False, 'error': 'Failed to save file metadata to database'}
+        
+        self._clear_stats_cache()
+        return {
+            'success': True,
+            'data': {
+                'id': str(file_id),
+                'filename': filename,
+                'saved_as': file_info['name'],
+                'size': file_info['size'],
+                'type': file_info['type']
+            }
+        }
+    
+    def _write_worker(self, write_queue, saved_queue, results):
+        """
+        落盘线程：从队列中取出文件写入磁盘，成功后交给入库线程
+        :param write_queue: 待落盘文件队列，None 表示结束
+        :param saved_queue: 已落盘文件队列
+        :param results: 上传结果字典
+        """
+        try:
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    break
+                
+                file, filename = item
+                # 保存文件（写入过程中检查文件大小）
+                try:
+                    file_info = self.save_uploaded_file(file, filename)
+                except RequestEntityTooLarge:
+                    results['failed'].append({
+                        'filename': filename,
+                        'error': f'File size exceeds limit ({Config.MAX_CONTENT_LENGTH_MB_STR}MB)'
+                    })
+                    continue
+                
+                if not file_info:
+                    results['failed'].append({
+                        'filename': filename,
+                        'error': 'Failed to save file to disk'
+                    })
+                    continue
+                
+                saved_queue.put((filename, file_info))
+        finally:
+            saved_queue.put(None)
+    
+    def _record_worker(self, saved_queue, results):
+        """
+        入库线程：攒批后批量写入文件记录，达到批量大小或等待超时即写入
+        :param saved_queue: 已落盘文件队列，None 表示结束
+        :param results: 上传结果字典
+        """
+        batch = []
+        deadline = None
+        
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = saved_queue.get(timeout=timeout)
+            except queue.Empty:
+                # 等待超时，写入当前批次
+                self._flush_file_records(batch, results)
+                batch = []
                 continue
             
-            # 检查文件大小
-            file.seek(0, os.SEEK_END)
-            file_size = file.tell()
-            file.seek(0)
+            if item is None:
+                break
             
-            if file_size > self.max_file_size:
-                results['failed'].append({
-                    'filename': file.filename,
-                    'error': f'File size exceeds limit ({self.max_file_size / 1024 / 1024:.1f}MB)'
-                })
-                continue
+            if not batch:
+                deadline = time.monotonic() + self.db_batch_timeout
+            batch.append(item)
             
-            # 保存文件
-            file_info = self.save_uploaded_file(file, file.filename)
-            if not file_info:
-                results['failed'].append({
-                    'filename': file.filename,
-                    'error': 'Failed to save file to disk'
-                })
-                continue
-            
-            # 保存到数据库
-            file_id = self.file_model.create_file_record(file_info)
+            if len(batch) >= self.db_batch_size:
+                self._flush_file_records(batch, results)
+                batch = []
+        
+        self._flush_file_records(batch, results)
+    
+    def _flush_file_records(self, batch, results):
+        """
+        批量写入文件记录并汇总结果，写入失败的文件会从磁盘删除
+        :param batch: (原始文件名, 文件信息) 列表
+        :param results: 上传结果字典
+        """
+        if not batch:
+            return
+        
+        file_ids = self.file_model.create_file_records_bulk([file_info for _, file_info in batch])
+        
+        for (filename, file_info), file_id in zip(batch, file_ids):
             if not file_id:
                 # 如果数据库保存失败，删除本地文件
-                try:
-                    os.remove(file_info['path'])
-                except:
-                    pass
+                self._remove_partial_file(file_info['path'])
                 results['failed'].append({
-                    'filename': file.filename,
+                    'filename': filename,
                     'error': 'Failed to save file metadata to database'
                 })
                 continue
             
-            # 添加文件ID到结果
-            file_info['id'] = str(file_id)
-            file_info['createdAt'] = datetime.utcnow().isoformat()
-            
             results['success'].append({
                 'id': str(file_id),
-                'filename': file.filename,
+                'filename': filename,
                 'saved_as': file_info['name'],
                 'size': file_info['size'],
                 'type': file_info['type']
             })
         
-        return results
+        self._clear_stats_cache()
     
-    def get_all_files(self, page=1, per_page=50):
+    def get_all_files(self, page=1, per_page=50, cursor=None):
         """
         获取所有文件列表
-        :param page: 页码
+        :param page: 页码（提供游标时忽略）
         :param per_page: 每页数量
+        :param cursor: 上一页返回的 next_cursor，提供时使用范围查询分页
         :return: 文件列表和分页信息
+        :raises ValueError: 游标格式不正确
         """
+        after_time, after_id = decode_cursor(cursor) if cursor else (None, None)
         skip = (page - 1) * per_page
-        files = self.file_model.get_all_files(skip=skip, limit=per_page)
+        # 多取一条用于判断是否还有下一页
+        files = self.file_model.get_all_files(skip=skip, limit=per_page + 1,
+                                              after_time=after_time, after_id=after_id)
+        next_cursor = None
+        if len(files) > per_page:
+            files = files[:per_page]
+            last = files[-1]
+            next_cursor = encode_cursor(datetime.fromisoformat(last['upload_time']), last['id'])
         total = self.file_model.get_files_count()
         
         return {
@@ -187,7 +402,8 @@ class FileController:
                 'page': page,
                 'per_page': per_page,
                 'total': total,
-                'pages': (total + per_page - 1) // per_page
+                'pages': (total + per_page - 1) // per_page,
+                'next_cursor': next_cursor
             }
         }
     
@@ -223,6 +439,7 @@ class FileController:
         db_deleted = self.file_model.delete_file_record(file_id)
         
         if db_deleted:
+            self._clear_stats_cache()
             return {
                 'success': True,
                 'message': 'File deleted successfully',
@@ -259,16 +476,28 @@ class FileController:
         获取文件统计信息
         :return: 统计信息字典
         """
+        with self._stats_cache_lock:
+            cached = self._stats_cache.get('stats')
+        if cached is not None:
+            return cached
+        
         total_files = self.file_model.get_files_count()
         
-        # 按类型统计
-        type_stats = {}
-        for ext in self.allowed_extensions:
-            files = self.file_model.get_files_by_type(ext)
-            type_stats[ext] = len(files)
+        # 按类型统计（一次聚合查询）
+        counts = self.file_model.get_counts_by_type()
+        type_stats = {ext: counts.get(ext, 0) for ext in self.allowed_extensions}
         
-        return {
+        stats = {
             'total_files': total_files,
             'by_type': type_stats,
             'upload_folder': self.upload_folder
-        }
\ No newline at end of file
+        }
+        
+        with self._stats_cache_lock:
+            self._stats_cache['stats'] = stats
+        return stats
+    
+    def _clear_stats_cache(self):
+        """清空文件统计缓存（文件新增或删除后调用）"""
+        with self._stats_cache_lock:
+            self._stats_cache.clear()
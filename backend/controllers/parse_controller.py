@@ -3,34 +3,105 @@
 # 连接解析服务和数据模型，处理文件解析、历史管理等功能
 
 import os
+import shutil
 import tempfile
 import logging
+import operator
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
 from typing import Dict, List, Any, Tuple, Optional
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
 from werkzeug.datastructures import FileStorage
 
-from models.parse_model import ParseModel
+from models.parse_model import ParseModel, parsed_at_str
 from models.file_model import FileModel
+from models.pagination import decode_cursor, encode_cursor
 from services.parsing_service import parsing_service
+from services.worker_pool import get_process_pool, run_blocking
 from config import Config
+from db import get_db
+from cache import cached, invalidates
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 允许的扩展名集合，导入时计算一次
+_ALLOWED = frozenset(Config.ALLOWED_EXTENSIONS)
+
+# 解析用临时文件目录：存在 /dev/shm（tmpfs）时放在内存中，省去一次磁盘写入和读取
+_TEMP_DIR = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+
+
+def _iter_download(parse_record: Dict[str, Any], chunk_size: int = 65536):
+    """
+    逐块生成下载文本（UTF-8 字节），先输出文件头信息，再分块输出正文，
+    避免拼接出完整的大字符串
+    
+    Args:
+        parse_record (Mapping): 包含 text_content 的解析记录（dict 或 RawBSONDocument）
+        chunk_size (int): 每块的字符数
+    """
+    header = (
+        f"文件名: {parse_record['original_name']}\n"
+        f"解析时间: {parsed_at_str(parse_record)}\n"
+        f"文件类型: {parse_record['file_type']}\n"
+        f"文本长度: {parse_record['text_length']} 字符\n"
+        + "=" * 50 + "\n\n"
+    )
+    text = parse_record['text_content']
+    # 只保留正文字符串：释放原始 BSON 字节及其解码结果，流式输出期间内存中只有一份正文
+    del parse_record
+    yield header.encode('utf-8')
+    
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size].encode('utf-8')
+
+
+def _ext(name: str) -> str:
+    """获取文件扩展名（不含点，小写），没有扩展名时返回空字符串"""
+    return os.path.splitext(name)[1][1:].lower()
+
+
+# 列表项需要的字段，一次 itemgetter 调用（C 实现）取出
+_SUMMARY_FIELDS = operator.itemgetter("id", "original_name", "file_type", "summary", "text_length", "status")
+
+
+def _format_summary(record: Dict[str, Any]) -> Dict[str, Any]:
+    """将解析记录格式化为历史/搜索列表项（不含完整文本）"""
+    record_id, original_name, file_type, summary, text_length, status = _SUMMARY_FIELDS(record)
+    return {
+        "id": record_id,
+        "file_id": record.get("file_id"),
+        "original_name": original_name,
+        "file_type": file_type,
+        "summary": summary,
+        "text_length": text_length,
+        "parsed_at": parsed_at_str(record),
+        "status": status
+    }
+
+
+def _oid(value: str) -> Optional[ObjectId]:
+    """将字符串 ID 转换为 ObjectId（只转换一次），非法 ID 返回 None"""
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
 class ParseController:
     """文档解析控制器类"""
     
     def __init__(self):
         """初始化控制器"""
-        from pymongo import MongoClient
-        
-        # 创建数据库连接
-        client = MongoClient(Config.MONGO_URI)
-        db = client[Config.MONGO_DB_NAME]
+        # 所有模型共用同一个连接池
+        db = get_db()
         
         # 初始化模型
-        self.parse_model = ParseModel(Config.MONGO_URI, Config.MONGO_DB_NAME)
+        self.parse_model = ParseModel(db)
         self.file_model = FileModel(db)
     
+    @invalidates("parse")
     def parse_uploaded_file(self, file: FileStorage) -> Tuple[bool, Dict[str, Any]]:
         """
         解析上传的文件
@@ -47,18 +118,37 @@ class ParseController:
                 return False, {"error": "未提供文件"}
             
             # 获取文件扩展名
-            file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-            if file_ext not in Config.ALLOWED_EXTENSIONS:
+            file_ext = _ext(file.filename)
+            if file_ext not in _ALLOWED:
                 return False, {"error": f"不支持的文件类型: {file_ext}"}
             
-            # 创建临时文件保存上传的文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_ext}') as temp_file:
-                file.save(temp_file.name)
-                temp_file_path = temp_file.name
+            # 小文件直接在内存中解析，省去临时文件的写入和回读
+            data = file.stream.read(Config.PARSE_IN_MEMORY_MAX_SIZE + 1)
+            temp_file_path = None
+            from_stream = False
+            if len(data) > Config.PARSE_IN_MEMORY_MAX_SIZE:
+                if file_ext in parsing_service.streamable_types and file.stream.seekable():
+                    # DOCX/TXT 可直接从上传流解析，无需落盘
+                    del data
+                    from_stream = True
+                else:
+                    # 其余大文件写入临时文件（大块无缓冲写入，优先放在内存文件系统中）
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_ext}',
+                                                     dir=_TEMP_DIR, buffering=0) as temp_file:
+                        temp_file.write(data)
+                        del data
+                        shutil.copyfileobj(file.stream, temp_file, length=Config.UPLOAD_CHUNK_SIZE)
+                        temp_file_path = temp_file.name
             
             try:
                 # 解析文档
-                success, result = parsing_service.parse_document(temp_file_path, file_ext)
+                if from_stream:
+                    success, result = run_blocking(parsing_service.parse_document_stream,
+                                                   file.stream, file_ext, file.filename)
+                elif temp_file_path:
+                    success, result = run_blocking(parsing_service.parse_document, temp_file_path, file_ext)
+                else:
+                    success, result = run_blocking(parsing_service.parse_bytes, data, file_ext, file.filename)
                 
                 if not success:
                     return False, {"error": result}
@@ -67,7 +157,6 @@ class ParseController:
                 summary = parsing_service.get_text_summary(result, 200)
                 
                 # 生成一个唯一的文件ID用于临时上传文件
-                from bson import ObjectId
                 temp_file_id = str(ObjectId())
                 
                 # 保存解析结果到数据库
@@ -98,13 +187,17 @@ class ParseController:
                 
             finally:
                 # 清理临时文件
-                if os.path.exists(temp_file_path):
+                if temp_file_path and os.path.exists(temp_file_path):
                     os.unlink(temp_file_path)
                     
+        except FuturesTimeoutError:
+            logger.error(f"解析上传文件超时: {file.filename}")
+            return False, {"error": "解析超时，请稍后重试"}
         except Exception as e:
             logger.error(f"解析上传文件失败: {str(e)}")
             return False, {"error": f"解析失败: {str(e)}"}
     
+    @invalidates("parse")
     def parse_existing_file(self, file_id: str) -> Tuple[bool, Dict[str, Any]]:
         """
         解析数据库中已存在的文件
@@ -116,112 +209,212 @@ class ParseController:
             Tuple[bool, Dict]: (是否成功, 响应数据)
         """
         try:
-            # 检查是否已经解析过
-            existing_parse = self.parse_model.get_parse_by_file_id(file_id)
-            if existing_parse:
-                logger.info(f"文件 {file_id} 已有解析记录，返回现有结果")
-                return True, {
-                    "parse_id": existing_parse["id"],
-                    "original_name": existing_parse["original_name"],
-                    "file_type": existing_parse["file_type"],
-                    "text_content": existing_parse["text_content"],
-                    "summary": existing_parse["summary"],
-                    "text_length": existing_parse["text_length"],
-                    "parsed_at": existing_parse["parsed_at"].isoformat(),
-                    "message": "返回已有解析结果"
-                }
-            
-            # 获取文件信息
-            file_info = self.file_model.get_file_by_id(file_id)
-            if not file_info:
-                return False, {"error": f"文件不存在: {file_id}"}
-            
-            # 检查文件是否存在于磁盘
-            file_path = file_info["path"]
-            if not os.path.exists(file_path):
-                return False, {"error": f"物理文件不存在: {file_path}"}
-            
-            # 检查文件类型，如果数据库中为空则从文件名推断
-            file_type = file_info["type"]
-            if not file_type:
-                # 从原始文件名或文件路径推断文件类型
-                original_name = file_info.get("original_name", "")
-                if '.' in original_name:
-                    file_type = original_name.rsplit('.', 1)[1].lower()
-                elif '.' in file_path:
-                    file_type = file_path.rsplit('.', 1)[1].lower()
-                else:
-                    return False, {"error": "无法确定文件类型"}
+            existing, file_info, file_type = self._prepare_existing_file(file_id)
+            if existing is not None:
+                return existing
             
             # 解析文档
-            success, result = parsing_service.parse_document(file_path, file_type)
-            
-            if not success:
-                return False, {"error": result}
-            
-            # 生成摘要
-            summary = parsing_service.get_text_summary(result, 200)
-            
-            # 保存解析结果到数据库
-            parse_id = self.parse_model.save_parsed_text(
-                file_id=file_id,
-                original_name=file_info["original_name"],
-                text_content=result,
-                file_type=file_info["type"],
-                summary=summary
-            )
-            
-            if not parse_id:
-                return False, {"error": "保存解析结果失败"}
+            success, result = run_blocking(parsing_service.parse_document, file_info["path"], file_type)
             
-            # 返回解析结果
-            response_data = {
-                "parse_id": parse_id,
-                "file_id": file_id,
-                "original_name": file_info["original_name"],
-                "file_type": file_info["type"],
-                "text_content": result,
-                "summary": summary,
-                "text_length": len(result),
-                "message": "文件解析成功"
-            }
-            
-            logger.info(f"成功解析数据库文件: {file_info['original_name']}")
-            return True, response_data
+            return self._save_existing_parse(file_id, file_info, success, result)
             
+        except FuturesTimeoutError:
+            logger.error(f"解析数据库文件超时: {file_id}")
+            return False, {"error": "解析超时，请稍后重试"}
         except Exception as e:
             logger.error(f"解析数据库文件失败: {str(e)}")
             return False, {"error": f"解析失败: {str(e)}"}
     
-    def get_parse_history(self, limit: int = 100, offset: int = 0) -> Tuple[bool, Dict[str, Any]]:
+    @invalidates("parse")
+    def parse_many_files(self, file_ids: List[str]) -> Tuple[bool, Dict[str, Any]]:
+        """
+        批量解析数据库中已存在的文件
+        
+        解析在进程池中并行执行，解析结果在当前线程中逐个写入数据库
+        
+        Args:
+            file_ids (List[str]): 文件 ID 列表
+        
+        Returns:
+            Tuple[bool, Dict]: (是否全部成功, 响应数据)
+        """
+        results = []
+        failed = []
+        futures = {}
+        
+        pool = get_process_pool()
+        for file_id in dict.fromkeys(file_ids):
+            try:
+                existing, file_info, file_type = self._prepare_existing_file(file_id)
+            except Exception as e:
+                logger.error(f"解析数据库文件失败: {str(e)}")
+                existing = (False, {"error": f"解析失败: {str(e)}"})
+            
+            if existing is not None:
+                success, data = existing
+                if success:
+                    results.append(data)
+                else:
+                    failed.append({"file_id": file_id, "error": data.get("error")})
+                continue
+            
+            future = pool.submit(parsing_service.parse_document, file_info["path"], file_type)
+            futures[future] = (file_id, file_info)
+        
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=Config.BATCH_TASK_TIMEOUT):
+                pending.discard(future)
+                file_id, file_info = futures[future]
+                try:
+                    success, result = future.result()
+                    success, data = self._save_existing_parse(file_id, file_info, success, result)
+                except Exception as e:
+                    logger.error(f"解析数据库文件失败: {str(e)}")
+                    success, data = False, {"error": f"解析失败: {str(e)}"}
+                
+                if success:
+                    results.append(data)
+                else:
+                    failed.append({"file_id": file_id, "error": data.get("error")})
+        except FuturesTimeoutError:
+            # 超时未完成的文件计为失败，尚未开始的任务直接取消
+            logger.error("批量解析超时，%d 个文件未完成", len(pending))
+            for future in pending:
+                future.cancel()
+                failed.append({"file_id": futures[future][0], "error": "解析超时，请稍后重试"})
+        
+        return not failed, {
+            "results": results,
+            "failed": failed,
+            "total": len(results) + len(failed),
+            "message": f"成功解析 {len(results)} 个文件，失败 {len(failed)} 个"
+        }
+    
+    def _prepare_existing_file(self, file_id: str) -> Tuple[Optional[Tuple[bool, Dict[str, Any]]],
+                                                             Optional[Dict[str, Any]], Optional[str]]:
+        """
+        解析前的准备：复用已有解析结果，或查出文件信息并确定文件类型
+        
+        Args:
+            file_id (str): 文件 ID
+        
+        Returns:
+            Tuple: (可直接返回的结果或 None, 文件信息, 文件类型)
+        """
+        # 检查是否已经解析过
+        existing_parse = self.parse_model.get_parse_by_file_id(file_id, include_text=True)
+        if existing_parse:
+            logger.info(f"文件 {file_id} 已有解析记录，返回现有结果")
+            return (True, {
+                "parse_id": existing_parse["id"],
+                "original_name": existing_parse["original_name"],
+                "file_type": existing_parse["file_type"],
+                "text_content": existing_parse["text_content"],
+                "summary": existing_parse["summary"],
+                "text_length": existing_parse["text_length"],
+                "parsed_at": parsed_at_str(existing_parse),
+                "message": "返回已有解析结果"
+            }), None, None
+        
+        # 获取文件信息
+        file_info = self.file_model.get_file_by_id(file_id)
+        if not file_info:
+            return (False, {"error": f"文件不存在: {file_id}"}), None, None
+        
+        # 检查文件是否存在于磁盘
+        file_path = file_info["path"]
+        if not os.path.exists(file_path):
+            return (False, {"error": f"物理文件不存在: {file_path}"}), None, None
+        
+        # 检查文件类型，如果数据库中为空则从文件名推断
+        file_type = (file_info["type"]
+                     or _ext(file_info.get("original_name", ""))
+                     or _ext(file_path))
+        if not file_type:
+            return (False, {"error": "无法确定文件类型"}), None, None
+        
+        return None, file_info, file_type
+    
+    def _save_existing_parse(self, file_id: str, file_info: Dict[str, Any],
+                             success: bool, result: str) -> Tuple[bool, Dict[str, Any]]:
+        """
+        保存数据库文件的解析结果
+        
+        Args:
+            file_id (str): 文件 ID
+            file_info (Dict): 文件信息
+            success (bool): 解析是否成功
+            result (str): 解析的文本内容或错误信息
+        
+        Returns:
+            Tuple[bool, Dict]: (是否成功, 响应数据)
+        """
+        if not success:
+            return False, {"error": result}
+        
+        # 生成摘要
+        summary = parsing_service.get_text_summary(result, 200)
+        
+        # 保存解析结果到数据库
+        parse_id = self.parse_model.save_parsed_text(
+            file_id=file_id,
+            original_name=file_info["original_name"],
+            text_content=result,
+            file_type=file_info["type"],
+            summary=summary
+        )
+        
+        if not parse_id:
+            return False, {"error": "保存解析结果失败"}
+        
+        # 返回解析结果
+        response_data = {
+            "parse_id": parse_id,
+            "file_id": file_id,
+            "original_name": file_info["original_name"],
+            "file_type": file_info["type"],
+            "text_content": result,
+            "summary": summary,
+            "text_length": len(result),
+            "message": "文件解析成功"
+        }
+        
+        logger.info(f"成功解析数据库文件: {file_info['original_name']}")
+        return True, response_data
+    
+    @cached("parse")
+    def get_parse_history(self, limit: int = 100, offset: int = 0,
+                          cursor: Optional[str] = None) -> Tuple[bool, Dict[str, Any]]:
         """
         获取解析历史记录
         
         Args:
             limit (int): 限制返回数量
-            offset (int): 偏移量
+            offset (int): 偏移量（提供游标时忽略）
+            cursor (Optional[str]): 上一页返回的 next_cursor，提供时使用范围查询分页
         
         Returns:
             Tuple[bool, Dict]: (是否成功, 响应数据)
         """
         try:
-            history = self.parse_model.get_all_parse_history(limit, offset)
-            stats = self.parse_model.get_parse_stats()
+            try:
+                after_time, after_id = decode_cursor(cursor) if cursor else (None, None)
+            except ValueError:
+                return False, {"error": f"无效的分页游标: {cursor}"}
+            
+            # 历史记录和统计信息在一次聚合查询中获取（多取一条用于判断是否还有下一页）
+            result = self.parse_model.get_history_with_stats(limit + 1, offset, after_time, after_id)
+            history = result["history"]
+            stats = result["stats"]
+            
+            next_cursor = None
+            if len(history) > limit:
+                history = history[:limit]
+                next_cursor = encode_cursor(history[-1]["parsed_at"], history[-1]["id"])
             
             # 格式化历史记录
-            formatted_history = []
-            for record in history:
-                formatted_record = {
-                    "id": record["id"],
-                    "file_id": record.get("file_id"),
-                    "original_name": record["original_name"],
-                    "file_type": record["file_type"],
-                    "summary": record["summary"],
-                    "text_length": record["text_length"],
-                    "parsed_at": record["parsed_at"].isoformat(),
-                    "status": record["status"]
-                }
-                formatted_history.append(formatted_record)
+            formatted_history = [_format_summary(record) for record in history]
             
             response_data = {
                 "history": formatted_history,
@@ -230,7 +423,8 @@ class ParseController:
                 "pagination": {
                     "limit": limit,
                     "offset": offset,
-                    "returned": len(formatted_history)
+                    "returned": len(formatted_history),
+                    "next_cursor": next_cursor
                 }
             }
             
@@ -251,19 +445,23 @@ class ParseController:
             Tuple[bool, Dict]: (是否成功, 响应数据)
         """
         try:
-            parse_record = self.parse_model.get_parse_by_id(parse_id)
-            if not parse_record:
+            # 元数据（命中记录缓存时无需查询）与正文分开读取；正文可能很大，每次从数据库读取，不进入任何缓存
+            oid = _oid(parse_id)
+            parse_record = self.parse_model.get_parse_by_id(oid) if oid else None
+            text_content = self.parse_model.get_parse_text(oid) if parse_record else None
+            if text_content is None:
                 return False, {"error": f"解析记录不存在: {parse_id}"}
+            parse_record["text_content"] = text_content
             
             response_data = {
-                "parse_id": parse_record["id"],
+                "parse_id": parse_id,
                 "file_id": parse_record.get("file_id"),
                 "original_name": parse_record["original_name"],
                 "file_type": parse_record["file_type"],
                 "text_content": parse_record["text_content"],
                 "summary": parse_record["summary"],
                 "text_length": parse_record["text_length"],
-                "parsed_at": parse_record["parsed_at"].isoformat(),
+                "parsed_at": parsed_at_str(parse_record),
                 "status": parse_record["status"]
             }
             
@@ -273,6 +471,7 @@ class ParseController:
             logger.error(f"获取解析内容失败: {str(e)}")
             return False, {"error": f"获取解析内容失败: {str(e)}"}
     
+    @invalidates("parse")
     def delete_parse_record(self, parse_id: str) -> Tuple[bool, Dict[str, Any]]:
         """
         删除解析记录
@@ -284,7 +483,8 @@ class ParseController:
             Tuple[bool, Dict]: (是否成功, 响应数据)
         """
         try:
-            success = self.parse_model.delete_parse_record(parse_id)
+            oid = _oid(parse_id)
+            success = self.parse_model.delete_parse_record(oid) if oid else False
             
             if success:
                 return True, {"message": "解析记录删除成功"}
@@ -303,21 +503,15 @@ class ParseController:
             parse_id (str): 解析记录 ID
         
         Returns:
-            Tuple[bool, Any]: (是否成功, 文件数据或错误信息)
+            Tuple[bool, Any]: (是否成功, 文件数据或错误信息)；content 为按块产出 UTF-8 字节的生成器
         """
         try:
-            parse_record = self.parse_model.get_parse_by_id(parse_id)
+            # 一次查询读取原始 BSON 记录，只解码下载用到的字段
+            oid = _oid(parse_id)
+            parse_record = self.parse_model.get_parse_raw(oid) if oid else None
             if not parse_record:
                 return False, {"error": f"解析记录不存在: {parse_id}"}
             
-            # 生成文本文件内容
-            content = f"文件名: {parse_record['original_name']}\n"
-            content += f"解析时间: {parse_record['parsed_at'].isoformat()}\n"
-            content += f"文件类型: {parse_record['file_type']}\n"
-            content += f"文本长度: {parse_record['text_length']} 字符\n"
-            content += "=" * 50 + "\n\n"
-            content += parse_record['text_content']
-            
             # 生成文件名
             safe_name = parse_record['original_name'].replace(' ', '_')
             if '.' in safe_name:
@@ -325,7 +519,7 @@ class ParseController:
             filename = f"{safe_name}_解析结果.txt"
             
             return True, {
-                "content": content,
+                "content": _iter_download(parse_record),
                 "filename": filename,
                 "mimetype": "text/plain; charset=utf-8"
             }
@@ -334,6 +528,7 @@ class ParseController:
             logger.error(f"下载解析文本失败: {str(e)}")
             return False, {"error": f"下载失败: {str(e)}"}
     
+    @cached("parse")
     def search_parsed_texts(self, keyword: str, limit: int = 50) -> Tuple[bool, Dict[str, Any]]:
         """
         搜索解析文本
@@ -352,19 +547,7 @@ class ParseController:
             results = self.parse_model.search_parsed_texts(keyword, limit)
             
             # 格式化搜索结果
-            formatted_results = []
-            for record in results:
-                formatted_record = {
-                    "id": record["id"],
-                    "file_id": record.get("file_id"),
-                    "original_name": record["original_name"],
-                    "file_type": record["file_type"],
-                    "summary": record["summary"],
-                    "text_length": record["text_length"],
-                    "parsed_at": record["parsed_at"].isoformat(),
-                    "status": record["status"]
-                }
-                formatted_results.append(formatted_record)
+            formatted_results = [_format_summary(record) for record in results]
             
             response_data = {
                 "keyword": keyword,
@@ -3,48 +3,36 @@
 # 连接分段服务和数据模型，处理分段、标签管理、搜索等功能
 
 import logging
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
 from typing import Dict, List, Any, Tuple
-from datetime import datetime
 
 from models.segment_model import SegmentModel
 from models.parse_model import ParseModel
 from services.segment_service import segmentation_service
+from services.worker_pool import get_process_pool, run_blocking
+from db import get_db
 from config import Config
+from cache import cached, invalidates
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+
+def _clean_tags(tags: List[str]) -> List[str]:
+    """去除标签首尾空白并丢弃空标签（每个标签只 strip 一次，过滤在 C 层完成）"""
+    return list(filter(None, map(str.strip, tags)))
+
+
 class SegmentController:
     """文档分段控制器类"""
     
     def __init__(self):
         """初始化控制器"""
-        self.segment_model = SegmentModel(Config.MONGO_URI, Config.MONGO_DB_NAME)
-        self.parse_model = ParseModel(Config.MONGO_URI, Config.MONGO_DB_NAME)
-    
-    def _serialize_datetime(self, obj: Any) -> Any:
-        """
-        递归处理对象中的datetime和ObjectId序列化
-        
-        Args:
-            obj: 需要处理的对象
-        
-        Returns:
-            序列化后的对象
-        """
-        from bson.objectid import ObjectId
-        
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        elif isinstance(obj, ObjectId):
-            return str(obj)
-        elif isinstance(obj, dict):
-            return {key: self._serialize_datetime(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [self._serialize_datetime(item) for item in obj]
-        else:
-            return obj
+        db = get_db()
+        self.segment_model = SegmentModel(db)
+        self.parse_model = ParseModel(db)
     
+    @invalidates("segments")
     def create_segments_from_file(self, file_id: str) -> Tuple[bool, Dict[str, Any]]:
         """
         从解析文件创建分段
@@ -56,73 +44,28 @@ class SegmentController:
             Tuple[bool, Dict]: (是否成功, 响应数据)
         """
         try:
-            # 尝试获取解析记录，支持文件ID或解析记录ID
-            parse_record = self.parse_model.get_parse_by_file_id(file_id)
-            
-            # 如果通过文件ID找不到，尝试通过解析记录ID查找
-            if not parse_record:
-                parse_record = self.parse_model.get_parse_by_id(file_id)
-                if parse_record:
-                    # 如果找到了，更新file_id为实际的文件ID
-                    file_id = parse_record.get("file_id", file_id)
-            
-            if not parse_record:
-                return False, {
-                    "code": 404,
-                    "msg": f"ID {file_id} 对应的解析记录不存在，请确保文档已成功解析",
-                    "data": None
-                }
-            
-            # 序列化解析记录中的datetime对象
-            parse_record = self._serialize_datetime(parse_record)
-            
-            # 检查是否已经分段（临时允许重新分段以测试新算法）
-            existing_segments = self.segment_model.get_segments_by_file_id(file_id)
-            if existing_segments:
-                logger.info(f"文件 {file_id} 已经分段，但允许重新分段以测试新算法")
-                # 删除现有分段以重新分段
-                self.segment_model.delete_segments_by_file_id(file_id)
-                logger.info(f"已删除文件 {file_id} 的现有分段，准备重新分段")
+            error, file_id, parse_record = self._load_parse_record(file_id)
+            if error is not None:
+                return error
             
             # 执行分段
-            text_content = parse_record["text_content"]
             file_name = parse_record["original_name"]
-            
-            segments_data = segmentation_service.segment_document(
+            segments_data = run_blocking(
+                segmentation_service.segment_document,
                 file_id=file_id,
-                text_content=text_content,
+                text_content=parse_record["text_content"],
                 file_name=file_name
             )
             
-            if not segments_data:
-                return False, {
-                    "code": 400,
-                    "msg": "文档分段失败，可能文档内容为空或格式不支持",
-                    "data": None
-                }
+            return self._store_segments(file_id, file_name, segments_data)
             
-            # 保存分段到数据库
-            if not self.segment_model.save_segments(segments_data):
-                return False, {
-                    "code": 500,
-                    "msg": "保存分段数据到数据库失败",
-                    "data": None
-                }
-            
-            logger.info(f"成功为文件 {file_id} 创建 {len(segments_data)} 个分段")
-            # 序列化日期时间对象
-            serialized_segments = self._serialize_datetime(segments_data)
-            return True, {
-                "code": 200,
-                "msg": "文档分段成功",
-                "data": {
-                    "file_id": file_id,
-                    "file_name": file_name,
-                    "segment_count": len(segments_data),
-                    "segments": serialized_segments
-                }
+        except FuturesTimeoutError:
+            logger.error(f"文件 {file_id} 分段超时")
+            return False, {
+                "code": 504,
+                "msg": "分段处理超时，请稍后重试",
+                "data": None
             }
-            
         except Exception as e:
             logger.error(f"创建分段失败: {str(e)}")
             return False, {
@@ -131,6 +74,153 @@ class SegmentController:
                 "data": None
             }
     
+    @invalidates("segments")
+    def create_segments_from_files(self, file_ids: List[str]) -> Tuple[bool, Dict[str, Any]]:
+        """
+        批量为多个解析文件创建分段
+        
+        分段计算在进程池中并行执行，分段结果在当前线程中逐个写入数据库
+        
+        Args:
+            file_ids (List[str]): 文件 ID 或解析记录 ID 列表
+        
+        Returns:
+            Tuple[bool, Dict]: (是否全部成功, 响应数据)
+        """
+        results = []
+        failed = []
+        futures = {}
+        
+        pool = get_process_pool()
+        for requested_id in dict.fromkeys(file_ids):
+            try:
+                error, file_id, parse_record = self._load_parse_record(requested_id)
+            except Exception as e:
+                logger.error(f"创建分段失败: {str(e)}")
+                error = (False, {"code": 500, "msg": f"分段处理失败: {str(e)}", "data": None})
+            
+            if error is not None:
+                failed.append({"file_id": requested_id, "msg": error[1]["msg"]})
+                continue
+            
+            file_name = parse_record["original_name"]
+            future = pool.submit(
+                segmentation_service.segment_document,
+                file_id, parse_record["text_content"], file_name
+            )
+            futures[future] = (requested_id, file_id, file_name)
+        
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=Config.BATCH_TASK_TIMEOUT):
+                pending.discard(future)
+                requested_id, file_id, file_name = futures[future]
+                try:
+                    success, result = self._store_segments(file_id, file_name, future.result())
+                except Exception as e:
+                    logger.error(f"创建分段失败: {str(e)}")
+                    success, result = False, {"msg": f"分段处理失败: {str(e)}"}
+                
+                if success:
+                    data = result["data"]
+                    results.append({
+                        "file_id": data["file_id"],
+                        "file_name": data["file_name"],
+                        "segment_count": data["segment_count"]
+                    })
+                else:
+                    failed.append({"file_id": requested_id, "msg": result["msg"]})
+        except FuturesTimeoutError:
+            # 超时未完成的文件计为失败，尚未开始的任务直接取消
+            logger.error("批量分段超时，%d 个文件未完成", len(pending))
+            for future in pending:
+                future.cancel()
+                failed.append({"file_id": futures[future][0], "msg": "分段处理超时，请稍后重试"})
+        
+        return not failed, {
+            "code": 200 if not failed else 207,
+            "msg": f"成功分段 {len(results)} 个文件，失败 {len(failed)} 个",
+            "data": {
+                "results": results,
+                "failed": failed,
+                "total": len(results) + len(failed)
+            }
+        }
+    
+    def _load_parse_record(self, file_id: str):
+        """
+        获取用于分段的解析记录，支持文件ID或解析记录ID
+        
+        Args:
+            file_id (str): 文件 ID 或解析记录 ID
+        
+        Returns:
+            Tuple: (错误响应或 None, 实际文件ID, 序列化后的解析记录)
+        """
+        # 一次查询获取解析记录，支持文件ID或解析记录ID，只取分段需要的字段
+        parse_record = self.parse_model.get_parse_by_file_id_or_id(
+            file_id,
+            projection={"text_content": 1, "original_name": 1, "file_id": 1}
+        )
+        if parse_record:
+            # 传入的是解析记录ID时，更新file_id为实际的文件ID
+            file_id = parse_record.get("file_id", file_id)
+        
+        if not parse_record:
+            return (False, {
+                "code": 404,
+                "msg": f"ID {file_id} 对应的解析记录不存在，请确保文档已成功解析",
+                "data": None
+            }), file_id, None
+        
+        return None, file_id, parse_record
+    
+    def _store_segments(self, file_id: str, file_name: str,
+                        segments_data: List[Dict[str, Any]]) -> Tuple[bool, Dict[str, Any]]:
+        """
+        用新的分段结果替换文件已有的分段
+        
+        Args:
+            file_id (str): 文件 ID
+            file_name (str): 文件名
+            segments_data (List[Dict]): 分段结果
+        
+        Returns:
+            Tuple[bool, Dict]: (是否成功, 响应数据)
+        """
+        if not segments_data:
+            return False, {
+                "code": 400,
+                "msg": "文档分段失败，可能文档内容为空或格式不支持",
+                "data": None
+            }
+        
+        # 删除已有分段以重新分段（临时允许重新分段以测试新算法）
+        # 直接删除而不先查询，避免依据可能过期的段落缓存做判断
+        if self.segment_model.delete_segments_by_file_id(file_id):
+            logger.info(f"已删除文件 {file_id} 的现有分段，准备重新分段")
+        
+        # 保存分段到数据库
+        if not self.segment_model.save_segments(segments_data):
+            return False, {
+                "code": 500,
+                "msg": "保存分段数据到数据库失败",
+                "data": None
+            }
+        
+        logger.info(f"成功为文件 {file_id} 创建 {len(segments_data)} 个分段")
+        return True, {
+            "code": 200,
+            "msg": "文档分段成功",
+            "data": {
+                "file_id": file_id,
+                "file_name": file_name,
+                "segment_count": len(segments_data),
+                "segments": segments_data
+            }
+        }
+    
+    @cached("segments")
     def get_file_segments(self, file_id: str) -> Tuple[bool, Dict[str, Any]]:
         """
         获取文件的所有分段，支持文件ID或解析记录ID
@@ -153,16 +243,13 @@ class SegmentController:
                     actual_file_id = parse_record.get("file_id", file_id)
                     segments = self.segment_model.get_segments_by_file_id(actual_file_id)
             
-            # 序列化日期时间对象
-            serialized_segments = self._serialize_datetime(segments)
-            
             return True, {
                 "code": 200,
                 "msg": "获取分段成功",
                 "data": {
                     "file_id": actual_file_id,
                     "segment_count": len(segments),
-                    "segments": serialized_segments
+                    "segments": segments
                 }
             }
             
@@ -174,6 +261,7 @@ class SegmentController:
                 "data": None
             }
     
+    @invalidates("segments")
     def update_segment_tags(self, segment_id: str, tags: List[str]) -> Tuple[bool, Dict[str, Any]]:
         """
         更新段落标签
@@ -202,7 +290,7 @@ class SegmentController:
                 }
             
             # 清理和验证标签
-            cleaned_tags = [tag.strip() for tag in tags if tag.strip()]
+            cleaned_tags = _clean_tags(tags)
             
             # 更新标签
             success = self.segment_model.update_segment_tags(segment_id, cleaned_tags)
@@ -231,6 +319,7 @@ class SegmentController:
                 "data": None
             }
     
+    @invalidates("segments")
     def batch_update_tags(self, tag_updates: List[Dict[str, Any]]) -> Tuple[bool, Dict[str, Any]]:
         """
         批量更新段落标签
@@ -249,31 +338,32 @@ class SegmentController:
                     "data": None
                 }
             
-            # 验证更新数据格式
-            validated_updates = []
-            for update in tag_updates:
-                if not isinstance(update, dict):
-                    continue
-                
-                segment_id = update.get("segment_id", "").strip()
-                tags = update.get("tags", [])
-                
-                if segment_id and isinstance(tags, list):
-                    validated_updates.append({
-                        "segment_id": segment_id,
-                        "tags": [tag.strip() for tag in tags if tag.strip()]
-                    })
-            
-            if not validated_updates:
+            if not isinstance(tag_updates, list) or len(tag_updates) > Config.TAG_BATCH_MAX_UPDATES:
                 return False, {
                     "code": 400,
-                    "msg": "没有有效的更新数据",
+                    "msg": f"更新列表必须为数组且不能超过 {Config.TAG_BATCH_MAX_UPDATES} 条",
                     "data": None
                 }
             
+            # 校验与清洗放在生成器中，由模型层在构建批量写操作时一次遍历完成，格式不正确的项直接忽略
+            validated_updates = (
+                (update["segment_id"].strip(), _clean_tags(update.get("tags", [])))
+                for update in tag_updates
+                if isinstance(update, dict)
+                and isinstance(update.get("segment_id"), str) and update["segment_id"].strip()
+                and isinstance(update.get("tags", []), list)
+            )
+            
             # 执行批量更新
             result = self.segment_model.batch_update_tags(validated_updates)
             
+            if result["total"] == 0:
+                return False, {
+                    "code": 400,
+                    "msg": "没有有效的更新数据",
+                    "data": None
+                }
+            
             return True, {
                 "code": 200,
                 "msg": f"批量更新完成",
@@ -339,6 +429,7 @@ class SegmentController:
                 "data": None
             }
     
+    @cached("segments")
     def search_segments(self, keyword: str, limit: int = 50) -> Tuple[bool, Dict[str, Any]]:
         """
         搜索段落
@@ -366,8 +457,6 @@ class SegmentController:
             
             # 执行搜索
             segments = self.segment_model.search_segments_by_keyword(keyword, limit)
-            # 序列化日期时间对象
-            serialized_segments = self._serialize_datetime(segments)
             
             return True, {
                 "code": 200,
@@ -376,7 +465,7 @@ class SegmentController:
                     "keyword": keyword,
                     "total_found": len(segments),
                     "limit": limit,
-                    "segments": serialized_segments
+                    "segments": segments
                 }
             }
             
@@ -388,6 +477,7 @@ class SegmentController:
                 "data": None
             }
     
+    @cached("segments")
     def get_segments_by_tags(self, tags: List[str], limit: int = 50) -> Tuple[bool, Dict[str, Any]]:
         """
         根据标签查询段落
@@ -408,7 +498,7 @@ class SegmentController:
                 }
             
             # 清理标签
-            cleaned_tags = [tag.strip() for tag in tags if tag.strip()]
+            cleaned_tags = _clean_tags(tags)
             if not cleaned_tags:
                 return False, {
                     "code": 400,
@@ -422,8 +512,6 @@ class SegmentController:
             
             # 查询段落
             segments = self.segment_model.get_segments_by_tags(cleaned_tags, limit)
-            # 序列化日期时间对象
-            serialized_segments = self._serialize_datetime(segments)
             
             return True, {
                 "code": 200,
@@ -432,7 +520,7 @@ class SegmentController:
                     "tags": cleaned_tags,
                     "total_found": len(segments),
                     "limit": limit,
-                    "segments": serialized_segments
+                    "segments": segments
                 }
             }
             
@@ -444,6 +532,7 @@ class SegmentController:
                 "data": None
             }
     
+    @cached("segments")
     def get_segment_stats(self) -> Tuple[bool, Dict[str, Any]]:
         """
         获取分段统计信息
@@ -453,13 +542,11 @@ class SegmentController:
         """
         try:
             stats = self.segment_model.get_segment_stats()
-            # 序列化日期时间对象
-            serialized_stats = self._serialize_datetime(stats)
             
             return True, {
                 "code": 200,
                 "msg": "获取统计信息成功",
-                "data": serialized_stats
+                "data": stats
             }
             
         except Exception as e:
@@ -470,6 +557,7 @@ class SegmentController:
                 "data": None
             }
     
+    @invalidates("segments")
     def delete_file_segments(self, file_id: str) -> Tuple[bool, Dict[str, Any]]:
         """
         删除文件的所有分段
@@ -0,0 +1,53 @@
+"""
+db.py - MongoDB 连接管理
+进程内共享一个 MongoClient（自带连接池），避免每个模型/控制器各自建立连接
+"""
+
+import os
+import threading
+
+from pymongo import MongoClient
+from config import Config
+
+# 进程级共享的客户端实例，以及创建它的进程号
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    获取共享的 MongoClient 实例（懒加载）
+    MongoClient 不是 fork 安全的：fork 出的 worker 进程中会新建自己的客户端和连接池，
+    不复用父进程的连接
+    :return: MongoClient 实例
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client_pid != pid:
+        with _client_lock:
+            if _client_pid != pid:
+                _client = MongoClient(
+                    Config.MONGO_URI,
+                    maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                    waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=Config.MONGO_SOCKET_TIMEOUT_MS,
+                    compressors=Config.MONGO_COMPRESSORS,
+                    retryWrites=Config.MONGO_RETRY_WRITES,
+                    # 第一次操作时才建立连接，构造客户端本身不产生网络 I/O
+                    connect=False
+                )
+                _client_pid = pid
+
+    return _client
+
+
+def get_db():
+    """
+    获取应用使用的数据库实例
+    :return: Database 实例
+    """
+    return get_client()[Config.MONGO_DB_NAME]
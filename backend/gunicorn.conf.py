@@ -0,0 +1,45 @@
+"""
+gunicorn.conf.py - Gunicorn 配置
+多线程 worker：FAISS 搜索与 embedding 推理会释放 GIL，同一进程内多线程即可并行，
+向量索引和模型在每个进程中只常驻一份
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+
+# 进程数 x 线程数 = 最大并发请求数
+# 每个 worker 各自缓存向量索引：索引文件保存时原子替换，其他 worker 在下次访问时发现文件版本变化并重新加载；
+# 查询结果缓存以索引文件版本校验并带 TTL，索引信息/列表等缓存跨 worker 最多延迟一个 TTL
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# embedding 生成、OpenAI 调用可能耗时较长
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# MongoClient 与 torch 线程池都不是 fork 安全的，默认每个 worker 各自加载应用；
+# 仅在确认 fork 前未建立数据库连接时再开启 preload_app
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+# 文件下载通过 wsgi.file_wrapper 使用 sendfile(2) 发送，文件内容不经过用户态
+sendfile = os.getenv("GUNICORN_SENDFILE", "true").lower() == "true"
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    """
+    预加载应用时，日志后台线程不会随 fork 复制到 worker，需要在 worker 中重新启动；
+    随后在 worker 中预先创建数据库客户端和文件控制器，第一个请求无需等待建立连接
+    """
+    if preload_app:
+        from app import start_log_listener
+        start_log_listener()
+    
+    from routes.upload_routes import get_file_controller
+    get_file_controller()
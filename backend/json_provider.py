@@ -0,0 +1,40 @@
+"""
+json_provider.py - 基于 orjson 的 Flask JSON 序列化
+在响应出口一次完成整棵对象树的编码：datetime 原生输出为 ISO 字符串，
+ObjectId 转为字符串，控制器无需再逐层转换 Mongo 文档
+"""
+
+import decimal
+
+import orjson
+from bson.objectid import ObjectId
+from flask.json.provider import JSONProvider
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    """orjson 无法原生序列化的类型转为字符串"""
+    if isinstance(obj, (ObjectId, decimal.Decimal)):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONProvider(JSONProvider):
+    """使用 orjson 编解码的 JSON Provider"""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # 直接写入 orjson 生成的字节，省去一次 bytes -> str -> bytes 转换
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=_OPTIONS),
+            mimetype=self.mimetype
+        )
@@ -0,0 +1,64 @@
+"""
+migrate_upload_shards.py - 上传目录分片迁移脚本
+将旧版平铺在上传根目录中的文件移动到按文件名前缀划分的子目录，并同步更新数据库中的 path 字段
+
+用法：python migrate_upload_shards.py [--dry-run]
+"""
+
+import os
+import sys
+
+from config import Config
+from db import get_db
+from controllers.file_controller import sharded_path
+
+
+def migrate(dry_run=False):
+    """
+    迁移上传根目录下的平铺文件
+    :param dry_run: 仅打印迁移计划，不移动文件
+    :return: (已迁移数量, 失败数量)
+    """
+    collection = get_db().files
+    upload_folder = os.path.abspath(Config.UPLOAD_FOLDER)
+    moved, failed = 0, 0
+    
+    for doc in collection.find({}, {'name': 1, 'path': 1}):
+        old_path = doc.get('path', '')
+        # 只处理仍位于上传根目录下的文件
+        if os.path.dirname(os.path.abspath(old_path)) != upload_folder:
+            continue
+        
+        new_path = sharded_path(Config.UPLOAD_FOLDER, doc['name'])
+        print(f"{old_path} -> {new_path}")
+        if dry_run:
+            continue
+        
+        if not os.path.exists(old_path):
+            print("  skipped: file not found")
+            failed += 1
+            continue
+        
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(old_path, new_path)
+        
+        # 以旧路径为条件更新，避免覆盖并发修改；更新失败则把文件移回原处
+        try:
+            result = collection.update_one(
+                {'_id': doc['_id'], 'path': old_path},
+                {'$set': {'path': new_path}}
+            )
+            if result.modified_count != 1:
+                raise RuntimeError('record changed during migration')
+            moved += 1
+        except Exception as e:
+            print(f"  failed: {e}")
+            os.replace(new_path, old_path)
+            failed += 1
+    
+    return moved, failed
+
+
+if __name__ == '__main__':
+    moved, failed = migrate(dry_run='--dry-run' in sys.argv[1:])
+    print(f"Migrated: {moved}, failed: {failed}")
@@ -5,19 +5,114 @@ file_model.py - 文件数据模型定义
 
 from datetime import datetime
 from bson import ObjectId
-from pymongo.errors import PyMongoError
+from bson.errors import InvalidId
+from cachetools import TTLCache
+from pymongo.errors import BulkWriteError, PyMongoError
+import logging
 import os
+import threading
+
+from config import Config
+from models.pagination import seek_filter
+
+logger = logging.getLogger(__name__)
+
+# 按ID查询的文件记录缓存，所有 FileModel 实例共享（每个 worker 进程各自一份，依赖 TTL 过期）
+_record_cache = TTLCache(maxsize=Config.RECORD_CACHE_SIZE, ttl=Config.RECORD_CACHE_TTL)
+_record_cache_lock = threading.Lock()
+
+
+def _oid(file_id):
+    """
+    将字符串ID转换为 ObjectId（只解析一次），非法ID返回None
+    :param file_id: 文件ID
+    :return: ObjectId 或 None
+    """
+    try:
+        return ObjectId(file_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _evict_record(file_id):
+    """从缓存中移除文件记录"""
+    with _record_cache_lock:
+        _record_cache.pop(file_id, None)
+
+
+# 文件列表的服务端投影：字段默认值由数据库填充，返回的文档可直接使用
+_LIST_PROJECTION = {
+    '_id': 0,
+    'id': {'$toString': '$_id'},
+    'name': 1,
+    'original_name': {'$ifNull': ['$original_name', '$name']},
+    'type': 1,
+    'size': {'$ifNull': ['$size', 0]},
+    'upload_time': 1,
+    'status': {'$ifNull': ['$status', 'uploaded']},
+    'mime_type': {'$ifNull': ['$mime_type', '']}
+}
+
+
+def _list_item(doc):
+    """
+    将投影后的文档转换为文件列表项（上传时间只格式化一次）
+    :param doc: 按 _LIST_PROJECTION 投影的文档
+    :return: 文件信息字典
+    """
+    doc['upload_time'] = doc['createdAt'] = doc['upload_time'].isoformat()  # createdAt 为前端兼容字段
+    return doc
+
 
 class FileModel:
     """文件模型类，处理文件元数据的数据库操作"""
     
+    # 索引每个进程只需创建一次（多个控制器各自持有模型实例）
+    _indexes_ready = False
+    
     def __init__(self, db):
         """
         初始化文件模型
         :param db: MongoDB数据库实例
         """
         self.collection = db.files
+        self._create_indexes()
+    
+    def _create_indexes(self):
+        """创建数据库索引"""
+        if FileModel._indexes_ready:
+            return
+        try:
+            # 按类型筛选并按上传时间排序；按类型统计时也可只扫描该索引
+            self.collection.create_index([('type', 1), ('upload_time', -1)])
+            # 文件列表按上传时间游标分页
+            self.collection.create_index([('upload_time', -1), ('_id', -1)])
+            FileModel._indexes_ready = True
+        except PyMongoError as e:
+            logger.error("Error creating file indexes: %s", e)
         
+    def _build_document(self, file_data, now=None):
+        """
+        根据文件数据构建待插入的文档
+        :param file_data: 文件数据字典
+        :param now: 写入时间（批量写入时整批共用同一时间）
+        :return: 文档字典
+        """
+        if now is None:
+            now = datetime.utcnow()
+        return {
+            'name': file_data['name'],
+            'original_name': file_data.get('original_name', file_data['name']),
+            'path': file_data['path'],
+            'type': file_data['type'],
+            'size': file_data.get('size', 0),
+            'upload_time': now,
+            'status': file_data.get('status', 'uploaded'),
+            'mime_type': file_data.get('mime_type', ''),
+            'created_at': now,
+            'updated_at': now
+        }
+    
     def create_file_record(self, file_data):
         """
         创建文件记录
@@ -25,56 +120,64 @@ class FileModel:
         :return: 插入的文档ID或None
         """
         try:
-            # 设置默认字段
-            document = {
-                'name': file_data['name'],
-                'original_name': file_data.get('original_name', file_data['name']),
-                'path': file_data['path'],
-                'type': file_data['type'],
-                'size': file_data.get('size', 0),
-                'upload_time': datetime.utcnow(),
-                'status': file_data.get('status', 'uploaded'),
-                'mime_type': file_data.get('mime_type', ''),
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow()
-            }
-            
-            result = self.collection.insert_one(document)
+            result = self.collection.insert_one(self._build_document(file_data))
             return result.inserted_id
             
         except PyMongoError as e:
-            print(f"Error creating file record: {e}")
+            logger.error("Error creating file record: %s", e)
             return None
     
-    def get_all_files(self, skip=0, limit=100):
+    def create_file_records_bulk(self, records):
+        """
+        批量创建文件记录（无序写入，单条失败不影响其余记录）
+        :param records: 文件数据字典列表
+        :return: 与 records 一一对应的文档ID列表，写入失败的位置为None
+        """
+        if not records:
+            return []
+        
+        now = datetime.utcnow()
+        documents = [self._build_document(record, now) for record in records]
+        # 预先分配 _id，无序写入部分失败时仍能对应到每条记录
+        for document in documents:
+            document['_id'] = ObjectId()
+        inserted_ids = [document['_id'] for document in documents]
+        
+        try:
+            self.collection.insert_many(documents, ordered=False)
+            
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            logger.error("Error creating file records in bulk: %d failed", len(write_errors))
+            for error in write_errors:
+                inserted_ids[error['index']] = None
+        
+        except PyMongoError as e:
+            logger.error("Error creating file records in bulk: %s", e)
+            return [None] * len(documents)
+        
+        return inserted_ids
+    
+    def get_all_files(self, skip=0, limit=100, after_time=None, after_id=None):
         """
         获取所有文件记录
-        :param skip: 跳过的记录数
+        :param skip: 跳过的记录数（提供游标时忽略）
         :param limit: 限制返回的记录数
+        :param after_time: 游标时间，提供时返回排在该记录之后的文件（范围查询，不使用skip）
+        :param after_id: 游标记录ID
         :return: 文件记录列表
         """
         try:
-            cursor = self.collection.find().sort('upload_time', -1).skip(skip).limit(limit)
-            files = []
+            query = seek_filter('upload_time', after_time, after_id) if after_time is not None else {}
+            cursor = self.collection.find(query, _LIST_PROJECTION)
+            if after_time is None:
+                cursor = cursor.skip(skip)
+            cursor = cursor.sort([('upload_time', -1), ('_id', -1)]).limit(limit).batch_size(limit)
             
-            for doc in cursor:
-                file_info = {
-                    'id': str(doc['_id']),
-                    'name': doc['name'],
-                    'original_name': doc.get('original_name', doc['name']),
-                    'type': doc['type'],
-                    'size': doc.get('size', 0),
-                    'upload_time': doc['upload_time'].isoformat(),
-                    'status': doc.get('status', 'uploaded'),
-                    'mime_type': doc.get('mime_type', ''),
-                    'createdAt': doc['upload_time'].isoformat()  # 前端兼容字段
-                }
-                files.append(file_info)
-                
-            return files
+            return [_list_item(doc) for doc in cursor]
             
         except PyMongoError as e:
-            print(f"Error getting files: {e}")
+            logger.error("Error getting files: %s", e)
             return []
     
     def get_file_by_id(self, file_id):
@@ -83,14 +186,20 @@ class FileModel:
         :param file_id: 文件ID
         :return: 文件记录字典或None
         """
+        with _record_cache_lock:
+            cached = _record_cache.get(file_id)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            if not ObjectId.is_valid(file_id):
+            oid = _oid(file_id)
+            if oid is None:
                 return None
                 
-            doc = self.collection.find_one({'_id': ObjectId(file_id)})
+            doc = self.collection.find_one({'_id': oid})
             
             if doc:
-                return {
+                record = {
                     'id': str(doc['_id']),
                     'name': doc['name'],
                     'original_name': doc.get('original_name', doc['name']),
@@ -101,10 +210,13 @@ class FileModel:
                     'status': doc.get('status', 'uploaded'),
                     'mime_type': doc.get('mime_type', '')
                 }
+                with _record_cache_lock:
+                    _record_cache[file_id] = record
+                return dict(record)
             return None
             
         except PyMongoError as e:
-            print(f"Error getting file by ID: {e}")
+            logger.error("Error getting file by ID: %s", e)
             return None
     
     def delete_file_record(self, file_id):
@@ -114,14 +226,16 @@ class FileModel:
         :return: 是否删除成功
         """
         try:
-            if not ObjectId.is_valid(file_id):
+            oid = _oid(file_id)
+            if oid is None:
                 return False
                 
-            result = self.collection.delete_one({'_id': ObjectId(file_id)})
+            result = self.collection.delete_one({'_id': oid})
+            _evict_record(file_id)
             return result.deleted_count > 0
             
         except PyMongoError as e:
-            print(f"Error deleting file record: {e}")
+            logger.error("Error deleting file record: %s", e)
             return False
     
     def update_file_status(self, file_id, status):
@@ -132,11 +246,12 @@ class FileModel:
         :return: 是否更新成功
         """
         try:
-            if not ObjectId.is_valid(file_id):
+            oid = _oid(file_id)
+            if oid is None:
                 return False
                 
             result = self.collection.update_one(
-                {'_id': ObjectId(file_id)},
+                {'_id': oid},
                 {
                     '$set': {
                         'status': status,
@@ -144,21 +259,22 @@ class FileModel:
                     }
                 }
             )
+            _evict_record(file_id)
             return result.modified_count > 0
             
         except PyMongoError as e:
-            print(f"Error updating file status: {e}")
+            logger.error("Error updating file status: %s", e)
             return False
     
     def get_files_count(self):
         """
-        获取文件总数
+        获取文件总数（读取集合元数据的估算值，无需扫描集合）
         :return: 文件数量
         """
         try:
-            return self.collection.count_documents({})
+            return self.collection.estimated_document_count()
         except PyMongoError as e:
-            print(f"Error getting files count: {e}")
+            logger.error("Error getting files count: %s", e)
             return 0
     
     def get_files_by_type(self, file_type):
@@ -184,5 +300,20 @@ class FileModel:
             return files
             
         except PyMongoError as e:
-            print(f"Error getting files by type: {e}")
-            return []
\ No newline at end of file
+            logger.error("Error getting files by type: %s", e)
+            return []
+    
+    def get_counts_by_type(self):
+        """
+        按文件类型统计文件数量（单次聚合查询）
+        :return: 文件类型 -> 数量 的字典
+        """
+        try:
+            cursor = self.collection.aggregate([
+                {'$group': {'_id': '$type', 'n': {'$sum': 1}}}
+            ])
+            return {doc['_id']: doc['n'] for doc in cursor}
+            
+        except PyMongoError as e:
+            logger.error("Error getting file counts by type: %s", e)
+            return {}
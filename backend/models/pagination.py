@@ -0,0 +1,52 @@
+"""
+pagination.py - 游标（范围）分页辅助函数
+按 (时间字段, _id) 降序分页：下一页从上一页最后一条记录之后开始查询，
+可直接利用复合索引定位，避免 skip 逐条跳过前面的文档
+
+游标格式: "<ISO 时间>_<ObjectId>"
+"""
+
+from datetime import datetime
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+
+def encode_cursor(sort_time: datetime, record_id) -> str:
+    """
+    根据一页中最后一条记录生成下一页的游标
+    :param sort_time: 排序时间字段的值（数据库中存储的 datetime）
+    :param record_id: 记录ID
+    :return: 游标字符串
+    """
+    return f"{sort_time.isoformat()}_{record_id}"
+
+
+def decode_cursor(token: str):
+    """
+    解析游标
+    :param token: 游标字符串
+    :return: (时间, ObjectId)
+    :raises ValueError: 游标格式不正确
+    """
+    sort_time, _, record_id = token.rpartition('_')
+    try:
+        return datetime.fromisoformat(sort_time), ObjectId(record_id)
+    except (InvalidId, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+
+
+def seek_filter(field: str, after_time: datetime, after_id: ObjectId) -> dict:
+    """
+    构建“排在游标之后”的查询条件（按 field、_id 降序）
+    :param field: 排序时间字段名
+    :param after_time: 游标时间
+    :param after_id: 游标记录ID
+    :return: 查询条件
+    """
+    return {
+        '$or': [
+            {field: {'$lt': after_time}},
+            {field: after_time, '_id': {'$lt': after_id}}
+        ]
+    }
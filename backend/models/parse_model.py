@@ -2,35 +2,125 @@
 # 负责解析记录的 MongoDB 数据库操作
 # 包括保存解析结果、查询解析历史、删除解析记录等功能
 
-from pymongo import MongoClient
+from pymongo import ReadPreference
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+from bson.codec_options import CodecOptions
 from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
 from datetime import datetime
 import logging
-from typing import Dict, List, Optional, Any
+import threading
+from typing import Dict, List, Optional, Any, Union
+
+from cachetools import TTLCache
+
+from config import Config
+from models.pagination import seek_filter
+from models.projection import rename_id
+from models.text_search import use_text_search
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 按ID查询的解析记录缓存，所有 ParseModel 实例共享: (ObjectId, include_text) -> 记录
+_record_cache = TTLCache(maxsize=Config.RECORD_CACHE_SIZE, ttl=Config.RECORD_CACHE_TTL)
+_record_cache_lock = threading.Lock()
+
+
+# 解析统计结果缓存
+_stats_cache = TTLCache(maxsize=1, ttl=Config.STATS_CACHE_TTL)
+
+# 按文件ID查询的最新解析记录缓存: file_id -> 不含文本的记录（只缓存命中的记录；正文可能很大，不进入缓存）
+_file_cache = TTLCache(maxsize=Config.RECORD_CACHE_SIZE, ttl=Config.RECORD_CACHE_TTL)
+
+
+def _as_oid(parse_id: Union[str, ObjectId]) -> ObjectId:
+    """调用方已构造好 ObjectId 时直接使用，避免重复解析字符串"""
+    return parse_id if isinstance(parse_id, ObjectId) else ObjectId(parse_id)
+
+
+def _evict_record(parse_id: ObjectId):
+    """从缓存中移除解析记录（包括带文本和不带文本两种）"""
+    with _record_cache_lock:
+        _record_cache.pop((parse_id, True), None)
+        _record_cache.pop((parse_id, False), None)
+
+
+def _evict_file(file_id: Optional[str]):
+    """从缓存中移除文件的最新解析记录，同时使统计结果失效"""
+    with _record_cache_lock:
+        _file_cache.pop(file_id, None)
+        _stats_cache.clear()
+
+
+def parsed_at_str(record: Dict[str, Any]) -> str:
+    """
+    获取解析时间的 ISO 字符串，优先使用写入时预先格式化的字段
+    
+    Args:
+        record (Dict): 解析记录
+    
+    Returns:
+        str: ISO 格式的解析时间
+    """
+    # 旧记录没有 parsed_at_iso 字段，回退到即时格式化
+    return record.get("parsed_at_iso") or record["parsed_at"].isoformat()
+
 class ParseModel:
     """解析记录数据模型类"""
     
-    def __init__(self, mongo_uri: str, db_name: str):
+    # 索引每个进程只需创建一次（多个控制器各自持有模型实例）
+    _indexes_ready = False
+    
+    def __init__(self, db: Database):
         """
         初始化数据库连接
         
         Args:
-            mongo_uri (str): MongoDB 连接字符串
-            db_name (str): 数据库名称
+            db (Database): 共享连接池上的 MongoDB 数据库实例
         """
         try:
-            self.client = MongoClient(mongo_uri)
-            self.db = self.client[db_name]
+            self.db = db
             self.collection = self.db.parsed_texts  # 解析文本集合
-            logger.info(f"成功连接到 MongoDB: {db_name}")
+            # 返回 RawBSONDocument 的集合句柄：字段在访问时才解码，用于读取大文本
+            self.raw_collection = self.db.get_collection(
+                "parsed_texts",
+                codec_options=CodecOptions(document_class=RawBSONDocument)
+            )
+            
+            # 创建索引以提高查询性能
+            self._create_indexes()
+            logger.info(f"成功连接到 MongoDB: {db.name}")
         except Exception as e:
             logger.error(f"MongoDB 连接失败: {str(e)}")
             raise
     
+    def _create_indexes(self):
+        """创建数据库索引"""
+        if ParseModel._indexes_ready:
+            return
+        try:
+            # 按文件ID查询最新解析记录（_id 默认已有索引）
+            self.collection.create_index([("file_id", 1), ("parsed_at", -1)])
+            # 解析历史按解析时间游标分页
+            self.collection.create_index([("parsed_at", -1), ("_id", -1)])
+            # 按文件类型统计时可只扫描索引
+            self.collection.create_index([("file_type", 1), ("text_length", 1)])
+            self.ensure_text_index()
+            ParseModel._indexes_ready = True
+        except PyMongoError as e:
+            logger.warning(f"创建索引失败: {str(e)}")
+    
+    def ensure_text_index(self):
+        """创建解析文本的全文索引（不做词干处理，化工术语按原词匹配）"""
+        self.collection.create_index(
+            [("original_name", "text"), ("summary", "text"), ("text_content", "text")],
+            weights={"original_name": 10, "summary": 5, "text_content": 1},
+            default_language="none",
+            name="parsed_text_search"
+        )
+    
     def save_parsed_text(self, file_id: str, original_name: str, text_content: str, 
                         file_type: str, summary: str = "") -> Optional[str]:
         """
@@ -47,6 +137,9 @@ class ParseModel:
             Optional[str]: 解析记录 ID，失败返回 None
         """
         try:
+            # MongoDB 只保存到毫秒，截断后 parsed_at_iso 与库中的 parsed_at 一致
+            now = datetime.utcnow()
+            now = now.replace(microsecond=now.microsecond // 1000 * 1000)
             document = {
                 "file_id": file_id,
                 "original_name": original_name,
@@ -54,13 +147,15 @@ class ParseModel:
                 "file_type": file_type,
                 "summary": summary,
                 "text_length": len(text_content),
-                "parsed_at": datetime.utcnow(),
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
+                "parsed_at": now,
+                "parsed_at_iso": now.isoformat(),  # 写入时预先格式化，读取时直接返回
+                "created_at": now,
+                "updated_at": now,
                 "status": "completed"
             }
             
             result = self.collection.insert_one(document)
+            _evict_file(file_id)
             logger.info(f"成功保存解析记录: {result.inserted_id}")
             return str(result.inserted_id)
             
@@ -68,94 +163,311 @@ class ParseModel:
             logger.error(f"保存解析记录失败: {str(e)}")
             return None
     
-    def get_parse_by_id(self, parse_id: str) -> Optional[Dict[str, Any]]:
+    def get_parse_by_id(self, parse_id: Union[str, ObjectId], include_text: bool = False) -> Optional[Dict[str, Any]]:
         """
         根据 ID 获取解析记录
         
         Args:
-            parse_id (str): 解析记录 ID
+            parse_id (Union[str, ObjectId]): 解析记录 ID
+            include_text (bool): 是否返回完整文本内容（text_content 可能很大，默认不返回；
+                只需要正文时请使用 get_parse_text）
         
         Returns:
             Optional[Dict]: 解析记录，不存在返回 None
         """
         try:
-            result = self.collection.find_one({"_id": ObjectId(parse_id)})
+            oid = _as_oid(parse_id)
+            key = (oid, include_text)
+            with _record_cache_lock:
+                cached = _record_cache.get(key)
+            if cached is not None:
+                return dict(cached)
+            
+            result = self.collection.find_one(
+                {"_id": oid},
+                None if include_text else {"text_content": 0}
+            )
             if result:
                 result["id"] = str(result["_id"])
                 del result["_id"]
+                with _record_cache_lock:
+                    _record_cache[key] = result
+                return dict(result)
             return result
         except Exception as e:
             logger.error(f"查询解析记录失败: {str(e)}")
             return None
     
-    def get_parse_by_file_id(self, file_id: str) -> Optional[Dict[str, Any]]:
+    def get_parse_text(self, parse_id: Union[str, ObjectId]) -> Optional[str]:
+        """
+        只获取解析记录的完整文本内容（不读取、不解码其他字段，结果不进入记录缓存）
+        
+        Args:
+            parse_id (Union[str, ObjectId]): 解析记录 ID
+        
+        Returns:
+            Optional[str]: 文本内容，不存在返回 None
+        """
+        try:
+            result = self.collection.find_one(
+                {"_id": _as_oid(parse_id)},
+                {"text_content": 1, "_id": 0}
+            )
+            return result.get("text_content") if result else None
+        except Exception as e:
+            logger.error(f"查询解析文本失败: {str(e)}")
+            return None
+    
+    def get_parse_raw(self, parse_id: Union[str, ObjectId]) -> Optional[RawBSONDocument]:
+        """
+        获取包含完整文本的原始 BSON 解析记录（只读，字段在访问时才解码）
+        
+        Args:
+            parse_id (Union[str, ObjectId]): 解析记录 ID
+        
+        Returns:
+            Optional[RawBSONDocument]: 解析记录，不存在返回 None
+        """
+        try:
+            return self.raw_collection.find_one({"_id": _as_oid(parse_id)})
+        except Exception as e:
+            logger.error(f"查询解析记录失败: {str(e)}")
+            return None
+    
+    def get_parse_by_file_id(self, file_id: str, include_text: bool = False) -> Optional[Dict[str, Any]]:
         """
         根据文件 ID 获取最新的解析记录
         
         Args:
             file_id (str): 原文件 ID
+            include_text (bool): 是否返回完整文本内容（text_content 可能很大，默认不返回）
         
         Returns:
             Optional[Dict]: 解析记录，不存在返回 None
         """
+        with _record_cache_lock:
+            cached = _file_cache.get(file_id)
+        
+        if cached is None:
+            try:
+                cached = self.collection.find_one(
+                    {"file_id": file_id}, 
+                    {"text_content": 0},
+                    sort=[("parsed_at", -1)]  # 按解析时间降序
+                )
+            except Exception as e:
+                logger.error(f"查询文件解析记录失败: {str(e)}")
+                return None
+            if not cached:
+                return None
+            cached["id"] = str(cached["_id"])
+            del cached["_id"]
+            with _record_cache_lock:
+                _file_cache[file_id] = cached
+        
+        result = dict(cached)
+        if include_text:
+            # 正文单独读取，不进入缓存
+            text_content = self.get_parse_text(result["id"])
+            if text_content is None:
+                return None
+            result["text_content"] = text_content
+        return result
+    
+    def parse_exists(self, file_id: str) -> bool:
+        """
+        判断文件是否已有解析记录（只查索引，不读取文档内容）
+        
+        Args:
+            file_id (str): 原文件 ID
+        
+        Returns:
+            bool: 是否存在解析记录
+        """
         try:
+            return self.collection.find_one(
+                {"file_id": file_id},
+                {"_id": 0, "file_id": 1}
+            ) is not None
+        except PyMongoError as e:
+            logger.error(f"查询解析记录是否存在失败: {str(e)}")
+            return False
+    
+    def get_parse_by_file_id_or_id(self, key: str,
+                                   projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        """
+        一次查询获取解析记录：key 可以是文件 ID，也可以是解析记录 ID
+        
+        Args:
+            key (str): 文件 ID 或解析记录 ID
+            projection (Optional[Dict]): 返回字段
+        
+        Returns:
+            Optional[Dict]: 解析记录（同一文件有多条时取最新的），不存在返回 None
+        """
+        try:
+            conditions = [{"file_id": key}]
+            if ObjectId.is_valid(key):
+                conditions.append({"_id": ObjectId(key)})
+            
             result = self.collection.find_one(
-                {"file_id": file_id}, 
-                sort=[("parsed_at", -1)]  # 按解析时间降序
+                {"$or": conditions},
+                projection,
+                sort=[("parsed_at", -1)]
             )
             if result:
                 result["id"] = str(result["_id"])
                 del result["_id"]
             return result
-        except Exception as e:
-            logger.error(f"查询文件解析记录失败: {str(e)}")
+        except PyMongoError as e:
+            logger.error(f"查询解析记录失败: {str(e)}")
             return None
     
-    def get_all_parse_history(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    def get_parse_mapping(self, parse_ids: List[str]) -> Dict[str, str]:
+        """
+        批量将解析记录 ID 映射为对应的文件 ID
+        
+        Args:
+            parse_ids (List[str]): 解析记录 ID 列表（非法 ObjectId 会被忽略）
+        
+        Returns:
+            Dict[str, str]: 解析记录 ID -> 文件 ID
+        """
+        try:
+            object_ids = [ObjectId(pid) for pid in parse_ids if ObjectId.is_valid(pid)]
+            if not object_ids:
+                return {}
+            
+            collection = self.collection.with_options(
+                read_preference=ReadPreference.SECONDARY_PREFERRED
+            )
+            cursor = collection.find({"_id": {"$in": object_ids}}, {"file_id": 1})
+            
+            return {
+                str(doc["_id"]): doc.get("file_id", str(doc["_id"]))
+                for doc in cursor
+            }
+            
+        except PyMongoError as e:
+            logger.exception("批量查询解析记录失败: %s", e)
+            return {}
+    
+    def get_all_parse_history(self, limit: int = 100, offset: int = 0,
+                              after_time: Optional[datetime] = None,
+                              after_id: Optional[ObjectId] = None) -> List[Dict[str, Any]]:
         """
         获取所有解析历史记录
         
         Args:
             limit (int): 限制返回数量
-            offset (int): 偏移量
+            offset (int): 偏移量（提供游标时忽略）
+            after_time (Optional[datetime]): 游标时间，提供时返回排在该记录之后的记录（范围查询，不使用skip）
+            after_id (Optional[ObjectId]): 游标记录ID
         
         Returns:
             List[Dict]: 解析历史记录列表
         """
         try:
-            cursor = self.collection.find(
-                {}, 
-                {
-                    "text_content": 0  # 不返回完整文本内容（太大）
-                }
-            ).sort("parsed_at", -1).skip(offset).limit(limit)
+            query = seek_filter("parsed_at", after_time, after_id) if after_time is not None else {}
+            # 不返回完整文本内容（太大）；按 (parsed_at, _id) 索引排序分页
+            cursor = self.collection.find(query, {"text_content": 0}, batch_size=limit).sort(
+                [("parsed_at", -1), ("_id", -1)]
+            )
+            if after_time is None:
+                cursor = cursor.skip(offset)
             
             results = []
-            for doc in cursor:
-                doc["id"] = str(doc["_id"])
-                del doc["_id"]
-                results.append(doc)
+            for record in cursor.limit(limit):
+                record["id"] = str(record.pop("_id"))
+                results.append(record)
             
-            logger.info(f"查询到 {len(results)} 条解析历史记录")
+            logger.debug("查询到 %d 条解析历史记录", len(results))
             return results
             
         except Exception as e:
             logger.error(f"查询解析历史失败: {str(e)}")
             return []
     
-    def delete_parse_record(self, parse_id: str) -> bool:
+    def get_history_with_stats(self, limit: int = 100, offset: int = 0,
+                               after_time: Optional[datetime] = None,
+                               after_id: Optional[ObjectId] = None) -> Dict[str, Any]:
+        """
+        获取解析历史和统计信息
+        
+        历史记录走 (parsed_at, _id) 索引单独分页查询；$facet 内无法使用索引，只用于统计
+        
+        Args:
+            limit (int): 限制返回数量
+            offset (int): 偏移量（提供游标时忽略）
+            after_time (Optional[datetime]): 游标时间
+            after_id (Optional[ObjectId]): 游标记录ID
+        
+        Returns:
+            Dict: {"history": 解析历史记录列表, "stats": 统计信息}
+        """
+        try:
+            history = self.get_all_parse_history(limit, offset, after_time=after_time, after_id=after_id)
+            
+            result = next(self.collection.aggregate([
+                # 统计只需要这三个字段，不把完整文本内容带入 $facet
+                {"$project": {"_id": 0, "file_type": 1, "text_length": 1, "parsed_at": 1}},
+                {"$facet": {
+                    "by_file_type": [
+                        {"$group": {
+                            "_id": "$file_type",
+                            "count": {"$sum": 1},
+                            "total_length": {"$sum": "$text_length"}
+                        }},
+                        {"$sort": {"count": -1}}
+                    ],
+                    "totals": [
+                        {"$group": {
+                            "_id": None,
+                            "total_parsed": {"$sum": 1},
+                            "last_parsed_at": {"$max": "$parsed_at"}
+                        }}
+                    ]
+                }}
+            ], allowDiskUse=False))
+            
+            totals = result["totals"][0] if result["totals"] else {}
+            stats = {
+                "total_parsed": totals.get("total_parsed", 0),
+                "by_file_type": result["by_file_type"],
+                "last_parsed_at": totals.get("last_parsed_at")
+            }
+            
+            logger.debug("查询到 %d 条解析历史记录", len(history))
+            return {"history": history, "stats": stats}
+            
+        except PyMongoError as e:
+            logger.error(f"查询解析历史和统计失败: {str(e)}")
+            return {
+                "history": [],
+                "stats": {
+                    "total_parsed": 0,
+                    "by_file_type": [],
+                    "last_parsed_at": None
+                }
+            }
+    
+    def delete_parse_record(self, parse_id: Union[str, ObjectId]) -> bool:
         """
         删除解析记录
         
         Args:
-            parse_id (str): 解析记录 ID
+            parse_id (Union[str, ObjectId]): 解析记录 ID
         
         Returns:
             bool: 是否删除成功
         """
         try:
-            result = self.collection.delete_one({"_id": ObjectId(parse_id)})
-            success = result.deleted_count > 0
+            oid = _as_oid(parse_id)
+            deleted = self.collection.find_one_and_delete({"_id": oid}, {"file_id": 1})
+            success = deleted is not None
+            _evict_record(oid)
+            if success:
+                _evict_file(deleted.get("file_id"))
             
             if success:
                 logger.info(f"成功删除解析记录: {parse_id}")
@@ -175,11 +487,18 @@ class ParseModel:
         Returns:
             Dict: 统计信息
         """
+        with _record_cache_lock:
+            cached = _stats_cache.get("stats")
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            total_count = self.collection.count_documents({})
+            # 总数读取集合元数据的估算值，无需扫描集合
+            total_count = self.collection.estimated_document_count()
             
-            # 按文件类型统计
+            # 按文件类型统计（只投影统计需要的字段，可由 file_type + text_length 索引覆盖）
             type_stats = list(self.collection.aggregate([
+                {"$project": {"_id": 0, "file_type": 1, "text_length": 1}},
                 {"$group": {
                     "_id": "$file_type",
                     "count": {"$sum": 1},
@@ -191,6 +510,7 @@ class ParseModel:
             # 最近解析记录
             recent_parse = self.collection.find_one(
                 {}, 
+                {"parsed_at": 1},
                 sort=[("parsed_at", -1)]
             )
             
@@ -200,7 +520,9 @@ class ParseModel:
                 "last_parsed_at": recent_parse["parsed_at"] if recent_parse else None
             }
             
-            return stats
+            with _record_cache_lock:
+                _stats_cache["stats"] = stats
+            return dict(stats)
             
         except Exception as e:
             logger.error(f"获取解析统计失败: {str(e)}")
@@ -222,27 +544,30 @@ class ParseModel:
             List[Dict]: 匹配的解析记录
         """
         try:
-            # 使用文本搜索
-            cursor = self.collection.find(
-                {
-                    "$or": [
-                        {"original_name": {"$regex": keyword, "$options": "i"}},
-                        {"text_content": {"$regex": keyword, "$options": "i"}},
-                        {"summary": {"$regex": keyword, "$options": "i"}}
-                    ]
-                },
-                {
-                    "text_content": 0  # 不返回完整文本
-                }
-            ).sort("parsed_at", -1).limit(limit)
-            
-            results = []
-            for doc in cursor:
-                doc["id"] = str(doc["_id"])
-                del doc["_id"]
-                results.append(doc)
+            if use_text_search(keyword):
+                # 使用全文索引，按相关度排序（支持用引号包裹的短语）
+                pipeline = [
+                    {"$match": {"$text": {"$search": keyword}}},
+                    {"$sort": {"score": {"$meta": "textScore"}}},
+                    {"$limit": limit},
+                    {"$addFields": {"score": {"$meta": "textScore"}}}
+                ]
+            else:
+                # 中文或包含正则元字符的关键词使用正则匹配
+                pipeline = [
+                    {"$match": {
+                        "$or": [
+                            {"original_name": {"$regex": keyword, "$options": "i"}},
+                            {"text_content": {"$regex": keyword, "$options": "i"}},
+                            {"summary": {"$regex": keyword, "$options": "i"}}
+                        ]
+                    }},
+                    {"$sort": {"parsed_at": -1}},
+                    {"$limit": limit}
+                ]
+            pipeline.extend(rename_id("text_content"))  # 不返回完整文本
             
-            return results
+            return list(self.collection.aggregate(pipeline, batchSize=limit, allowDiskUse=False))
             
         except Exception as e:
             logger.error(f"搜索解析文本失败: {str(e)}")
@@ -260,8 +585,9 @@ class ParseModel:
             bool: 是否更新成功
         """
         try:
+            oid = _as_oid(parse_id)
             result = self.collection.update_one(
-                {"_id": ObjectId(parse_id)},
+                {"_id": oid},
                 {
                     "$set": {
                         "status": status,
@@ -272,6 +598,10 @@ class ParseModel:
             
             success = result.modified_count > 0
             if success:
+                _evict_record(oid)
+                # 状态更新很少发生，不额外查询 file_id，直接清空按文件的缓存
+                with _record_cache_lock:
+                    _file_cache.clear()
                 logger.info(f"成功更新解析记录状态: {parse_id} -> {status}")
             
             return success
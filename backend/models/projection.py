@@ -0,0 +1,17 @@
+"""
+projection.py - 聚合管道中的文档整形
+在服务端把 _id 转换为字符串字段 id 并去掉 _id，
+返回的文档可直接用于响应，无需在 Python 中逐条改写
+"""
+
+
+def rename_id(*excluded):
+    """
+    生成把 _id 改写为 id 的管道阶段
+    :param excluded: 同时排除的字段
+    :return: 管道阶段列表
+    """
+    return [
+        {'$addFields': {'id': {'$toString': '$_id'}}},
+        {'$project': dict.fromkeys(('_id',) + excluded, 0)}
+    ]
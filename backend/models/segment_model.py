@@ -2,49 +2,120 @@
 # 负责文档段落的 MongoDB 数据库操作
 # 包括保存段落、查询段落、更新标签、搜索等功能
 
-from pymongo import MongoClient
+from pymongo import ReadPreference, UpdateOne
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, PyMongoError
 from bson.objectid import ObjectId
+from bson.son import SON
 from datetime import datetime
 import logging
-from typing import Dict, List, Optional, Any
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+from config import Config
+from models.projection import rename_id
+from models.text_search import use_text_search
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 按文件ID查询的段落缓存，所有 SegmentModel 实例共享: file_id -> 段落列表（只缓存非空结果）
+_segments_cache = TTLCache(maxsize=Config.RECORD_CACHE_SIZE, ttl=Config.RECORD_CACHE_TTL)
+_segments_cache_lock = threading.Lock()
+
+
+# 按标签查询使用的索引
+_TAGS_INDEX = [("tags", 1), ("updated_at", -1)]
+
+# 启动预热时按顺序扫描的索引（全文索引不支持 hint，不在其中）
+_WARMUP_INDEXES = [
+    [("file_id", 1)],
+    [("segment_id", 1)],
+    [("file_id", 1), ("order", 1)],
+    _TAGS_INDEX,
+    [("updated_at", -1)]
+]
+
+# 段落统计结果缓存
+_stats_cache = TTLCache(maxsize=1, ttl=Config.STATS_CACHE_TTL)
+
+
+def _evict_file(file_id: str):
+    """从缓存中移除文件的段落，同时使统计结果失效"""
+    with _segments_cache_lock:
+        _segments_cache.pop(file_id, None)
+        _stats_cache.clear()
+
+
+def _file_id_of(segment_id: str) -> str:
+    """从段落ID（格式: <file_id>_<序号>_<随机串>）中取出文件ID"""
+    return segment_id.rsplit("_", 2)[0]
+
 class SegmentModel:
     """段落数据模型类"""
     
-    def __init__(self, mongo_uri: str, db_name: str):
+    # 索引每个进程只需创建一次（多个控制器各自持有模型实例）
+    _indexes_ready = False
+    
+    def __init__(self, db: Database):
         """
         初始化数据库连接
         
         Args:
-            mongo_uri (str): MongoDB 连接字符串
-            db_name (str): 数据库名称
+            db (Database): 共享连接池上的 MongoDB 数据库实例
         """
         try:
-            self.client = MongoClient(mongo_uri)
-            self.db = self.client[db_name]
+            self.db = db
             self.collection = self.db.segments  # 段落集合
             
             # 创建索引以提高查询性能
             self._create_indexes()
-            logger.info(f"成功连接到 MongoDB segments 集合: {db_name}")
+            logger.info(f"成功连接到 MongoDB segments 集合: {db.name}")
         except Exception as e:
             logger.error(f"MongoDB 连接失败: {str(e)}")
             raise
     
     def _create_indexes(self):
         """创建数据库索引"""
+        if SegmentModel._indexes_ready:
+            return
         try:
             # 为常用查询字段创建索引
             self.collection.create_index("file_id")
             self.collection.create_index("segment_id")
             self.collection.create_index([("file_id", 1), ("order", 1)])
             self.collection.create_index([("text", "text")])  # 全文搜索索引
-            self.collection.create_index("tags")
+            # 按标签查询并按更新时间排序，limit 后可提前结束扫描（同时覆盖只按 tags 的查询）
+            self.collection.create_index(_TAGS_INDEX)
+            # 正则搜索按更新时间顺序扫描，取够 limit 条即停止，无需内存排序
+            self.collection.create_index([("updated_at", -1)])
+            SegmentModel._indexes_ready = True
         except Exception as e:
             logger.warning(f"创建索引失败: {str(e)}")
+            return
+        
+        if Config.MONGO_INDEX_WARMUP:
+            # 在后台线程中预热，不阻塞启动
+            threading.Thread(target=self._warm_up_indexes, name="segments-index-warmup", daemon=True).start()
+    
+    def _warm_up_indexes(self):
+        """
+        预读索引页到 WiredTiger 缓存，避免部署后第一个请求承担冷缓存的磁盘读取
+        （预热失败不影响服务，只记录日志）
+        """
+        try:
+            for index in _WARMUP_INDEXES:
+                # 按索引顺序扫描前若干个键，读入索引根节点和首批叶子页
+                for _ in self.collection.find({}, {"_id": 1}).hint(index).limit(Config.MONGO_INDEX_WARMUP_KEYS):
+                    pass
+            # 按实际查询形状各执行一次，让对应的执行计划进入计划缓存
+            self.collection.find_one({"file_id": ""}, sort=[("order", 1)])
+            self.collection.find_one({"tags": {"$in": [""]}}, sort=[("updated_at", -1)])
+            logger.info("segments 集合索引预热完成")
+        except Exception as e:
+            logger.warning("segments 集合索引预热失败: %s", e)
     
     def save_segments(self, segments_data: List[Dict[str, Any]]) -> bool:
         """
@@ -61,11 +132,14 @@ class SegmentModel:
                 return True
             
             # 添加时间戳
+            now = datetime.utcnow()
             for segment in segments_data:
-                segment["created_at"] = datetime.utcnow()
-                segment["updated_at"] = datetime.utcnow()
+                segment["created_at"] = now
+                segment["updated_at"] = now
             
-            result = self.collection.insert_many(segments_data)
+            result = self.collection.insert_many(segments_data, ordered=False)
+            for file_id in {segment.get("file_id") for segment in segments_data}:
+                _evict_file(file_id)
             logger.info(f"成功保存 {len(result.inserted_ids)} 个段落")
             return True
             
@@ -73,6 +147,21 @@ class SegmentModel:
             logger.error(f"保存段落失败: {str(e)}")
             return False
     
+    def iter_segments_by_file_id(self, file_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        按顺序逐个产出文件的段落（按批从游标读取，不在内存中保留整个列表，结果不经过缓存）
+        
+        Args:
+            file_id (str): 文件 ID
+        
+        Yields:
+            Dict: 段落数据
+        """
+        yield from self.collection.aggregate(
+            [{"$match": {"file_id": file_id}}, {"$sort": {"order": 1}}, *rename_id()],
+            batchSize=1000
+        )
+    
     def get_segments_by_file_id(self, file_id: str) -> List[Dict[str, Any]]:
         """
         根据文件 ID 获取所有段落
@@ -83,24 +172,77 @@ class SegmentModel:
         Returns:
             List[Dict]: 段落列表，按顺序排序
         """
+        with _segments_cache_lock:
+            cached = _segments_cache.get(file_id)
+        if cached is not None:
+            return [dict(segment) for segment in cached]
+        
         try:
-            cursor = self.collection.find(
-                {"file_id": file_id}
-            ).sort("order", 1)
-            
-            segments = []
-            for doc in cursor:
-                doc["id"] = str(doc["_id"])
-                del doc["_id"]
-                segments.append(doc)
+            segments = list(self.iter_segments_by_file_id(file_id))
             
-            logger.info(f"查询到文件 {file_id} 的 {len(segments)} 个段落")
+            logger.debug("查询到文件 %s 的 %d 个段落", file_id, len(segments))
+            if segments:
+                with _segments_cache_lock:
+                    _segments_cache[file_id] = segments
+                return [dict(segment) for segment in segments]
             return segments
             
         except Exception as e:
             logger.error(f"查询段落失败: {str(e)}")
             return []
     
+    def get_file_ids_with_segments(self, file_ids: List[str]) -> set:
+        """
+        批量查询哪些文件 ID 已有段落数据
+        
+        Args:
+            file_ids (List[str]): 文件 ID 列表
+        
+        Returns:
+            set: 存在段落的文件 ID 集合
+        """
+        try:
+            if not file_ids:
+                return set()
+            
+            collection = self.collection.with_options(
+                read_preference=ReadPreference.SECONDARY_PREFERRED
+            )
+            return set(collection.distinct("file_id", {"file_id": {"$in": list(file_ids)}}))
+            
+        except PyMongoError as e:
+            logger.exception("批量查询段落文件ID失败: %s", e)
+            return set()
+    
+    def get_counts_and_names(self, file_ids: List[str]) -> Dict[str, tuple]:
+        """
+        批量统计各文件的段落数量和文件名
+        
+        Args:
+            file_ids (List[str]): 文件 ID 列表
+        
+        Returns:
+            Dict[str, tuple]: 文件 ID -> (段落数量, 文件名)
+        """
+        try:
+            if not file_ids:
+                return {}
+            
+            cursor = self.collection.aggregate([
+                {"$match": {"file_id": {"$in": list(file_ids)}}},
+                {"$group": {
+                    "_id": "$file_id",
+                    "count": {"$sum": 1},
+                    "file_name": {"$first": "$file_name"}
+                }}
+            ])
+            
+            return {doc["_id"]: (doc["count"], doc.get("file_name")) for doc in cursor}
+            
+        except PyMongoError as e:
+            logger.exception("批量统计段落失败: %s", e)
+            return {}
+    
     def get_segment_by_id(self, segment_id: str) -> Optional[Dict[str, Any]]:
         """
         根据段落 ID 获取段落详情
@@ -145,6 +287,7 @@ class SegmentModel:
             
             success = result.modified_count > 0
             if success:
+                _evict_file(_file_id_of(segment_id))
                 logger.info(f"成功更新段落 {segment_id} 的标签: {tags}")
             else:
                 logger.warning(f"段落 {segment_id} 不存在或标签未改变")
@@ -155,39 +298,55 @@ class SegmentModel:
             logger.error(f"更新段落标签失败: {str(e)}")
             return False
     
-    def batch_update_tags(self, tag_updates: List[Dict[str, Any]]) -> Dict[str, int]:
+    def batch_update_tags(self, tag_updates: Iterable[Tuple[str, List[str]]]) -> Dict[str, int]:
         """
         批量更新段落标签
         
         Args:
-            tag_updates (List[Dict]): 更新列表，格式：[{"segment_id": "...", "tags": [...]}]
+            tag_updates (Iterable[Tuple]): 更新序列，格式：[(segment_id, [tag, ...]), ...]，可为生成器
         
         Returns:
             Dict[str, int]: 更新结果统计
         """
+        # 一次遍历直接构建批量写操作，不生成中间列表
+        now = datetime.utcnow()
+        operations = []
+        file_ids = set()  # 涉及的文件，更新后清除其段落缓存
+        for segment_id, tags in tag_updates:
+            operations.append(UpdateOne(
+                {"segment_id": segment_id},
+                {"$set": {"tags": tags, "updated_at": now}}
+            ))
+            file_ids.add(_file_id_of(segment_id))
+        total = len(operations)
+        
         try:
-            updated_count = 0
-            failed_count = 0
+            if not operations:
+                return {"updated": 0, "failed": 0, "total": 0}
             
-            for update in tag_updates:
-                segment_id = update.get("segment_id")
-                tags = update.get("tags", [])
-                
-                if self.update_segment_tags(segment_id, tags):
-                    updated_count += 1
-                else:
-                    failed_count += 1
+            # 所有更新合并为一次无序批量写入
+            # 以匹配数计为成功：标签与原值相同的段落也算更新成功，只有不存在或写入出错的计为失败
+            try:
+                result = self.collection.bulk_write(operations, ordered=False)
+                updated_count = result.matched_count
+            except BulkWriteError as e:
+                updated_count = e.details.get("nMatched", 0)
+                logger.warning(f"批量更新标签部分失败: {len(e.details.get('writeErrors', []))} 条")
             
+            for file_id in file_ids:
+                _evict_file(file_id)
+            
+            failed_count = total - updated_count
             logger.info(f"批量更新完成: 成功 {updated_count}, 失败 {failed_count}")
             return {
                 "updated": updated_count,
                 "failed": failed_count,
-                "total": len(tag_updates)
+                "total": total
             }
             
         except Exception as e:
             logger.error(f"批量更新标签失败: {str(e)}")
-            return {"updated": 0, "failed": len(tag_updates), "total": len(tag_updates)}
+            return {"updated": 0, "failed": total, "total": total}
     
     def search_segments_by_keyword(self, keyword: str, limit: int = 50) -> List[Dict[str, Any]]:
         """
@@ -201,23 +360,31 @@ class SegmentModel:
             List[Dict]: 匹配的段落列表
         """
         try:
-            # 使用正则表达式搜索
-            cursor = self.collection.find(
-                {
-                    "$or": [
-                        {"text": {"$regex": keyword, "$options": "i"}},
-                        {"tags": {"$regex": keyword, "$options": "i"}}
-                    ]
-                }
-            ).limit(limit).sort("updated_at", -1)
+            if use_text_search(keyword):
+                # 使用 text 字段的全文索引（标签按精确值匹配，走 tags 索引），按相关度排序
+                pipeline = [
+                    {"$match": {"$or": [{"$text": {"$search": keyword}}, {"tags": keyword}]}},
+                    {"$sort": {"score": {"$meta": "textScore"}}},
+                    {"$limit": limit},
+                    {"$addFields": {"score": {"$meta": "textScore"}}}
+                ]
+            else:
+                # 中文或包含正则元字符的关键词使用正则表达式搜索
+                pipeline = [
+                    {"$match": {
+                        "$or": [
+                            {"text": {"$regex": keyword, "$options": "i"}},
+                            {"tags": {"$regex": keyword, "$options": "i"}}
+                        ]
+                    }},
+                    {"$sort": {"updated_at": -1}},
+                    {"$limit": limit}
+                ]
+            pipeline.extend(rename_id())
             
-            segments = []
-            for doc in cursor:
-                doc["id"] = str(doc["_id"])
-                del doc["_id"]
-                segments.append(doc)
+            segments = list(self.collection.aggregate(pipeline, batchSize=limit, allowDiskUse=False))
             
-            logger.info(f"关键词 '{keyword}' 搜索到 {len(segments)} 个段落")
+            logger.debug("关键词 '%s' 搜索到 %d 个段落", keyword, len(segments))
             return segments
             
         except Exception as e:
@@ -236,17 +403,20 @@ class SegmentModel:
             List[Dict]: 匹配的段落列表
         """
         try:
-            cursor = self.collection.find(
-                {"tags": {"$in": tags}}
-            ).limit(limit).sort("updated_at", -1)
+            # 固定使用 (tags, updated_at) 索引：各标签按更新时间有序合并，取够 limit 条即停止，
+            # 避免热门标签数据倾斜时查询规划器选择更差的执行计划
+            pipeline = [
+                {"$match": {"tags": {"$in": tags}}},
+                {"$sort": {"updated_at": -1}},
+                {"$limit": limit},
+                *rename_id()
+            ]
+            # aggregate 不会转换 hint 的键列表，需要以有序文档（或索引名）传给服务端
+            segments = list(self.collection.aggregate(
+                pipeline, hint=SON(_TAGS_INDEX), batchSize=limit, allowDiskUse=False
+            ))
             
-            segments = []
-            for doc in cursor:
-                doc["id"] = str(doc["_id"])
-                del doc["_id"]
-                segments.append(doc)
-            
-            logger.info(f"标签 {tags} 查询到 {len(segments)} 个段落")
+            logger.debug("标签 %s 查询到 %d 个段落", tags, len(segments))
             return segments
             
         except Exception as e:
@@ -266,6 +436,7 @@ class SegmentModel:
         try:
             result = self.collection.delete_many({"file_id": file_id})
             deleted_count = result.deleted_count
+            _evict_file(file_id)
             logger.info(f"删除文件 {file_id} 的 {deleted_count} 个段落")
             return deleted_count
             
@@ -280,8 +451,14 @@ class SegmentModel:
         Returns:
             Dict: 统计信息
         """
+        with _segments_cache_lock:
+            cached = _stats_cache.get("stats")
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            total_segments = self.collection.count_documents({})
+            # 总数读取集合元数据的估算值，无需扫描集合
+            total_segments = self.collection.estimated_document_count()
             
             # 统计各文件的段落数
             file_stats = list(self.collection.aggregate([
@@ -302,11 +479,14 @@ class SegmentModel:
                 {"$limit": 20}
             ]))
             
-            return {
+            stats = {
                 "total_segments": total_segments,
                 "file_stats": file_stats,
                 "tag_stats": tag_stats
             }
+            with _segments_cache_lock:
+                _stats_cache["stats"] = stats
+            return dict(stats)
             
         except Exception as e:
             logger.error(f"获取段落统计失败: {str(e)}")
@@ -0,0 +1,23 @@
+"""
+text_search.py - 全文检索辅助函数
+判断关键词能否走 MongoDB $text 全文索引
+
+$text 按空白和标点分词，无法切分中文，也不支持正则和前缀匹配；
+因此只有由字母、数字、空格、引号（短语）和连字符组成、且至少包含一个完整词的关键词
+才使用全文索引，其余关键词（中文、正则、单个字符）仍使用正则匹配
+"""
+
+import re
+
+_TEXT_SEARCHABLE = re.compile(r'[A-Za-z0-9\s"\-]+')
+# 至少包含一个长度不小于 2 的词，单个字符通常是前缀/片段查询，全文索引无法命中
+_HAS_WORD = re.compile(r'[A-Za-z0-9]{2,}')
+
+
+def use_text_search(keyword: str) -> bool:
+    """
+    判断关键词是否适合使用 $text 全文索引查询
+    :param keyword: 搜索关键词
+    :return: 是否使用全文索引
+    """
+    return _TEXT_SEARCHABLE.fullmatch(keyword) is not None and _HAS_WORD.search(keyword) is not None
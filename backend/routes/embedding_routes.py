@@ -10,27 +10,101 @@ Embedding 和向量库相关的 API 路由
 4. GET /api/embed/list - 列出所有索引
 5. POST /api/embed/search/:file_id - 向量搜索
 
+部署：
+    gunicorn -c gunicorn.conf.py wsgi:app
+    使用 gthread worker（GUNICORN_WORKERS x GUNICORN_THREADS 个并发请求）。FAISS 搜索和
+    模型推理期间释放 GIL，同一进程内的多个线程共享一份模型和索引即可并行处理搜索请求；
+    增加进程数会让每个进程各自加载一份模型，内存随之成倍增长
+
 作者：AI Assistant
 日期：2025-08-07
 """
 
 import logging
-from flask import Blueprint, request, jsonify
+from functools import wraps
+
+import msgspec
+import orjson
+from flask import Blueprint, Response, request, jsonify, current_app
 from typing import Dict, Any
 
 # 导入业务逻辑控制器
 from controllers.embedding_controller import EmbeddingController
+from schemas import CreateEmbeddingRequest, MultiSearchRequest, SearchRequest, decode_request
 
 logger = logging.getLogger(__name__)
 
 # 创建 Blueprint
 embedding_bp = Blueprint('embedding', __name__, url_prefix='/api/embed')
 
-# 初始化控制器
-embedding_controller = EmbeddingController()
+
+def get_controller() -> EmbeddingController:
+    """获取应用启动时预加载的 Embedding 控制器"""
+    return current_app.extensions['embedding_ctrl']
+
+
+def _error_body(code: int, msg: str) -> bytes:
+    """编码固定的错误响应体"""
+    return orjson.dumps({"success": False, "code": code, "msg": msg, "data": None})
+
+
+_NOT_FOUND_BODY = _error_body(404, "API 接口不存在")
+_METHOD_NOT_ALLOWED_BODY = _error_body(405, "HTTP 方法不允许")
+_INTERNAL_ERROR_BODY = _error_body(500, "服务器内部错误")
+
+
+def api_response(success_msg: str):
+    """
+    统一响应包装：处理函数返回控制器结果 {'success', 'data' | 'error'}，
+    成功时返回 200 和 data，失败时返回 400 和 error，未捕获的异常返回 500；
+    处理函数直接返回的 (响应, 状态码) 原样返回（如参数校验失败）
+    :param success_msg: 成功时的提示信息
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                logger.exception("%s API 异常: %s", func.__name__, e)
+                return jsonify({
+                    "success": False,
+                    "code": 500,
+                    "msg": f"服务器内部错误: {str(e)}",
+                    "data": None
+                }), 500
+            
+            if isinstance(result, tuple):
+                return result
+            if result['success']:
+                return jsonify({
+                    "success": True,
+                    "code": 200,
+                    "msg": success_msg,
+                    "data": result['data']
+                }), 200
+            return jsonify({
+                "success": False,
+                "code": 400,
+                "msg": result['error'],
+                "data": None
+            }), 400
+        return wrapper
+    return decorator
+
+
+def _bad_request(error: msgspec.DecodeError):
+    """请求体解码或校验失败时的 400 响应"""
+    return jsonify({
+        "success": False,
+        "code": 400,
+        "msg": f"请求参数错误: {error}",
+        "data": None
+    }), 400
 
 
 @embedding_bp.route('/<file_id>', methods=['POST'])
+@api_response("Embedding 创建成功")
 def create_embeddings(file_id: str):
     """
     为指定文件的所有段落生成 embedding 并构建向量索引
@@ -42,8 +116,13 @@ def create_embeddings(file_id: str):
         
     Body (可选):
         {
-            "recreate": false,     // 是否强制重新创建索引
-            "batch_size": 32       // 批处理大小
+            "recreate": false,              // 是否强制重新创建索引
+            "batch_size": 32,               // 批处理大小
+            "max_tokens_per_batch": 16384,  // 每批估算 token 上限（按段落长度打包）
+            "dtype": "float16",             // 新建索引的向量存储精度: float32 / float16 / bfloat16 / int8 / binary
+            "index_type": "flat",           // 索引结构: flat / ivf / ivf_pq（向量数较少时仍使用 flat）
+            "nlist": 1024,                  // IVF 聚类数（可选）
+            "pq_m": 48                      // ivf_pq 子量化器个数（可选，须整除向量维度）
         }
     
     Returns:
@@ -60,47 +139,29 @@ def create_embeddings(file_id: str):
             }
         }
     """
+    logger.debug("创建 embedding API 被调用，文件ID: %s", file_id)
+    
+    # 解码并校验请求参数
     try:
-        logger.info(f"创建 embedding API 被调用，文件ID: {file_id}")
-        
-        # 获取请求参数
-        data = request.get_json() or {}
-        recreate = data.get('recreate', False)
-        batch_size = data.get('batch_size', 32)
-        
-        # 调用控制器处理
-        result = embedding_controller.create_embeddings(
-            file_id=file_id,
-            recreate=recreate,
-            batch_size=batch_size
-        )
-        
-        if result['success']:
-            return jsonify({
-                "success": True,
-                "code": 200,
-                "msg": "Embedding 创建成功",
-                "data": result['data']
-            }), 200
-        else:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": result['error'],
-                "data": None
-            }), 400
-            
-    except Exception as e:
-        logger.error(f"创建 embedding API 异常: {str(e)}")
-        return jsonify({
-            "success": False,
-            "code": 500,
-            "msg": f"服务器内部错误: {str(e)}",
-            "data": None
-        }), 500
+        body = decode_request(request.get_data(cache=False), CreateEmbeddingRequest)
+    except msgspec.DecodeError as e:
+        return _bad_request(e)
+    
+    # 调用控制器处理
+    return get_controller().create_embeddings(
+        file_id=file_id,
+        recreate=body.recreate,
+        batch_size=body.batch_size,
+        max_tokens_per_batch=body.max_tokens_per_batch,
+        dtype=body.dtype,
+        index_type=body.index_type,
+        nlist=body.nlist,
+        pq_m=body.pq_m
+    )
 
 
 @embedding_bp.route('/info/<file_id>', methods=['GET'])
+@api_response("获取索引信息成功")
 def get_embedding_info(file_id: str):
     """
     获取指定文件的 embedding 索引信息
@@ -120,35 +181,20 @@ def get_embedding_info(file_id: str):
                 "file_id": "xxx",
                 "vector_count": 30,
                 "embedding_dimension": 384,
+                "dtype": "float16",
                 "index_size_mb": 1.2,
                 "created_at": "2025-08-07T10:30:00"
             }
         }
     """
-    try:
-        logger.info(f"获取 embedding 信息API 被调用，文件ID: {file_id}")
-        
-        # 调用控制器处理
-        result = embedding_controller.get_embedding_info(file_id)
-        
-        return jsonify({
-            "success": True,
-            "code": 200,
-            "msg": "获取索引信息成功",
-            "data": result
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"获取 embedding 信息API 异常: {str(e)}")
-        return jsonify({
-            "success": False,
-            "code": 500,
-            "msg": f"服务器内部错误: {str(e)}",
-            "data": None
-        }), 500
+    logger.debug("获取 embedding 信息API 被调用，文件ID: %s", file_id)
+    
+    # 调用控制器处理
+    return {'success': True, 'data': get_controller().get_embedding_info(file_id)}
 
 
 @embedding_bp.route('/<file_id>', methods=['DELETE'])
+@api_response("索引删除成功")
 def delete_embeddings(file_id: str):
     """
     删除指定文件的 embedding 索引
@@ -169,38 +215,14 @@ def delete_embeddings(file_id: str):
             }
         }
     """
-    try:
-        logger.info(f"删除 embedding API 被调用，文件ID: {file_id}")
-        
-        # 调用控制器处理
-        result = embedding_controller.delete_embeddings(file_id)
-        
-        if result['success']:
-            return jsonify({
-                "success": True,
-                "code": 200,
-                "msg": "索引删除成功",
-                "data": result['data']
-            }), 200
-        else:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": result['error'],
-                "data": None
-            }), 400
-            
-    except Exception as e:
-        logger.error(f"删除 embedding API 异常: {str(e)}")
-        return jsonify({
-            "success": False,
-            "code": 500,
-            "msg": f"服务器内部错误: {str(e)}",
-            "data": None
-        }), 500
+    logger.debug("删除 embedding API 被调用，文件ID: %s", file_id)
+    
+    # 调用控制器处理
+    return get_controller().delete_embeddings(file_id)
 
 
 @embedding_bp.route('/list', methods=['GET'])
+@api_response("获取索引列表成功")
 def list_all_embeddings():
     """
     列出所有的 embedding 索引
@@ -226,30 +248,14 @@ def list_all_embeddings():
             }
         }
     """
-    try:
-        logger.info(f"列出所有 embedding API 被调用")
-        
-        # 调用控制器处理
-        result = embedding_controller.list_all_embeddings()
-        
-        return jsonify({
-            "success": True,
-            "code": 200,
-            "msg": "获取索引列表成功",
-            "data": result
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"列出所有 embedding API 异常: {str(e)}")
-        return jsonify({
-            "success": False,
-            "code": 500,
-            "msg": f"服务器内部错误: {str(e)}",
-            "data": None
-        }), 500
+    logger.debug("列出所有 embedding API 被调用")
+    
+    # 调用控制器处理
+    return {'success': True, 'data': get_controller().list_all_embeddings()}
 
 
 @embedding_bp.route('/search/<file_id>', methods=['POST'])
+@api_response("搜索完成")
 def search_embeddings(file_id: str):
     """
     在指定文件的向量索引中搜索相似内容
@@ -263,7 +269,8 @@ def search_embeddings(file_id: str):
         {
             "query": "化工反应的基本原理",    // 查询文本
             "top_k": 5,                    // 返回结果数量
-            "min_score": 0.0               // 最小相似度阈值
+            "min_score": 0.0,              // 最小相似度阈值
+            "nprobe": 32                   // IVF 索引探查的聚类数（可选）
         }
     
     Returns:
@@ -274,6 +281,7 @@ def search_embeddings(file_id: str):
             "data": {
                 "query": "化工反应的基本原理",
                 "file_id": "xxx",
+                "dtype": "float16",
                 "total_results": 3,
                 "search_time": 0.05,
                 "results": [
@@ -293,74 +301,26 @@ def search_embeddings(file_id: str):
             }
         }
     """
+    logger.debug("搜索 embedding API 被调用，文件ID: %s", file_id)
+    
+    # 解码并校验请求数据（query 非空，top_k 在 1-100 之间）
     try:
-        logger.info(f"搜索 embedding API 被调用，文件ID: {file_id}")
-        
-        # 验证请求数据
-        data = request.get_json()
-        if not data or 'query' not in data:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "缺少查询文本",
-                "data": None
-            }), 400
-        
-        query = data['query']
-        top_k = data.get('top_k', 5)
-        min_score = data.get('min_score', 0.0)
-        
-        # 验证参数
-        if not query.strip():
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "查询文本不能为空",
-                "data": None
-            }), 400
-        
-        if top_k <= 0 or top_k > 100:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "top_k 必须在 1-100 之间",
-                "data": None
-            }), 400
-        
-        # 调用控制器处理
-        result = embedding_controller.search_embeddings(
-            file_id=file_id,
-            query=query,
-            top_k=top_k,
-            min_score=min_score
-        )
-        
-        if result['success']:
-            return jsonify({
-                "success": True,
-                "code": 200,
-                "msg": "搜索完成",
-                "data": result['data']
-            }), 200
-        else:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": result['error'],
-                "data": None
-            }), 400
-            
-    except Exception as e:
-        logger.error(f"搜索 embedding API 异常: {str(e)}")
-        return jsonify({
-            "success": False,
-            "code": 500,
-            "msg": f"服务器内部错误: {str(e)}",
-            "data": None
-        }), 500
+        body = decode_request(request.get_data(cache=False), SearchRequest)
+    except msgspec.DecodeError as e:
+        return _bad_request(e)
+    
+    # 调用控制器处理
+    return get_controller().search_embeddings(
+        file_id=file_id,
+        query=body.query,
+        top_k=body.top_k,
+        min_score=body.min_score,
+        nprobe=body.nprobe
+    )
 
 
 @embedding_bp.route('/search/multi', methods=['POST'])
+@api_response("多文件搜索完成")
 def search_multiple_files():
     """
     在多个文件的向量索引中搜索相似内容
@@ -372,7 +332,8 @@ def search_multiple_files():
             "query": "化工反应的基本原理",      // 查询文本
             "file_ids": ["file1", "file2"],   // 文件ID列表
             "top_k": 5,                       // 每个文件返回结果数量
-            "min_score": 0.0                  // 最小相似度阈值
+            "min_score": 0.0,                 // 最小相似度阈值
+            "nprobe": 32                      // IVF 索引探查的聚类数（可选）
         }
     
     Returns:
@@ -392,75 +353,26 @@ def search_multiple_files():
             }
         }
     """
+    logger.debug("多文件搜索 embedding API 被调用")
+    
+    # 解码并校验请求数据（query 非空，file_ids 为非空字符串列表）
     try:
-        logger.info(f"多文件搜索 embedding API 被调用")
-        
-        # 验证请求数据
-        data = request.get_json()
-        if not data or 'query' not in data or 'file_ids' not in data:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "缺少查询文本或文件ID列表",
-                "data": None
-            }), 400
-        
-        query = data['query']
-        file_ids = data['file_ids']
-        top_k = data.get('top_k', 5)
-        min_score = data.get('min_score', 0.0)
-        
-        # 验证参数
-        if not query.strip():
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "查询文本不能为空",
-                "data": None
-            }), 400
-        
-        if not isinstance(file_ids, list) or len(file_ids) == 0:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "文件ID列表不能为空",
-                "data": None
-            }), 400
-        
-        # 调用控制器处理
-        result = embedding_controller.search_multiple_files(
-            file_ids=file_ids,
-            query=query,
-            top_k=top_k,
-            min_score=min_score
-        )
-        
-        if result['success']:
-            return jsonify({
-                "success": True,
-                "code": 200,
-                "msg": "多文件搜索完成",
-                "data": result['data']
-            }), 200
-        else:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": result['error'],
-                "data": None
-            }), 400
-            
-    except Exception as e:
-        logger.error(f"多文件搜索 embedding API 异常: {str(e)}")
-        return jsonify({
-            "success": False,
-            "code": 500,
-            "msg": f"服务器内部错误: {str(e)}",
-            "data": None
-        }), 500
+        body = decode_request(request.get_data(cache=False), MultiSearchRequest)
+    except msgspec.DecodeError as e:
+        return _bad_request(e)
+    
+    # 调用控制器处理
+    return get_controller().search_multiple_files(
+        file_ids=body.file_ids,
+        query=body.query,
+        top_k=body.top_k,
+        min_score=body.min_score,
+        nprobe=body.nprobe
+    )
 
 
 @embedding_bp.route('/health', methods=['GET'])
+@api_response("Embedding 服务正常")
 def health_check():
     """
     健康检查接口
@@ -479,56 +391,24 @@ def health_check():
             }
         }
     """
-    try:
-        # 调用控制器处理
-        result = embedding_controller.health_check()
-        
-        return jsonify({
-            "success": True,
-            "code": 200,
-            "msg": "Embedding 服务正常",
-            "data": result
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"健康检查API 异常: {str(e)}")
-        return jsonify({
-            "success": False,
-            "code": 500,
-            "msg": f"服务器内部错误: {str(e)}",
-            "data": None
-        }), 500
+    # 调用控制器处理
+    return {'success': True, 'data': get_controller().health_check()}
 
 
-# 错误处理
+# 错误处理（响应体预先编码，错误路径无需再构建和序列化）
 @embedding_bp.errorhandler(404)
 def not_found(error):
     """处理 404 错误"""
-    return jsonify({
-        "success": False,
-        "code": 404,
-        "msg": "API 接口不存在",
-        "data": None
-    }), 404
+    return Response(_NOT_FOUND_BODY, 404, mimetype='application/json')
 
 
 @embedding_bp.errorhandler(405)
 def method_not_allowed(error):
     """处理 405 错误"""
-    return jsonify({
-        "success": False,
-        "code": 405,
-        "msg": "HTTP 方法不允许",
-        "data": None
-    }), 405
+    return Response(_METHOD_NOT_ALLOWED_BODY, 405, mimetype='application/json')
 
 
 @embedding_bp.errorhandler(500)
 def internal_error(error):
     """处理 500 错误"""
-    return jsonify({
-        "success": False,
-        "code": 500,
-        "msg": "服务器内部错误",
-        "data": None
-    }), 500
\ No newline at end of file
+    return Response(_INTERNAL_ERROR_BODY, 500, mimetype='application/json')
@@ -2,12 +2,14 @@
 # 定义文档解析相关的 API 端点
 # 包括本地文件解析、数据库文件解析、历史查看、内容下载等接口
 
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from werkzeug.exceptions import RequestEntityTooLarge
 import logging
-import io
+from urllib.parse import quote
 
 from controllers.parse_controller import parse_controller
+from schemas import load_json
+from config import Config
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -63,7 +65,7 @@ def parse_local_file():
             "error": "文件大小超过限制"
         }), 413
     except Exception as e:
-        logger.error(f"解析本地文件API异常: {str(e)}")
+        logger.error("解析本地文件API异常: %s", e)
         return jsonify({
             "success": False,
             "error": f"服务器内部错误: {str(e)}"
@@ -103,7 +105,49 @@ def parse_database_file(file_id):
             }), 400
             
     except Exception as e:
-        logger.error(f"解析数据库文件API异常: {str(e)}")
+        logger.error("解析数据库文件API异常: %s", e)
+        return jsonify({
+            "success": False,
+            "error": f"服务器内部错误: {str(e)}"
+        }), 500
+
+@parse_bp.route('/database/batch', methods=['POST'])
+def parse_database_files():
+    """
+    批量解析数据库中的已有文件
+    
+    Request Body:
+        {
+            "file_ids": ["文件ID1", "文件ID2"]
+        }
+    
+    Returns:
+        JSON: 批量解析结果
+    """
+    try:
+        data = load_json(request.get_data(cache=False)) or {}
+        file_ids = data.get("file_ids")
+        if not file_ids or not isinstance(file_ids, list):
+            return jsonify({
+                "success": False,
+                "error": "file_ids 必须是非空列表"
+            }), 400
+        if len(file_ids) > Config.BATCH_MAX_FILES:
+            return jsonify({
+                "success": False,
+                "error": f"file_ids 不能超过 {Config.BATCH_MAX_FILES} 个"
+            }), 400
+        
+        success, result = parse_controller.parse_many_files(file_ids)
+        
+        return jsonify({
+            "success": bool(result["results"]),
+            "data": result,
+            "message": result["message"]
+        }), 200 if success else 207
+            
+    except Exception as e:
+        logger.error("批量解析数据库文件API异常: %s", e)
         return jsonify({
             "success": False,
             "error": f"服务器内部错误: {str(e)}"
@@ -117,6 +161,7 @@ def get_parse_history():
     Query Parameters:
         limit (int): 限制返回数量，默认100
         offset (int): 偏移量，默认0
+        cursor (str): 上一页返回的 next_cursor，提供时忽略 offset
     
     Returns:
         JSON: 解析历史记录列表
@@ -125,6 +170,7 @@ def get_parse_history():
         # 获取查询参数
         limit = request.args.get('limit', 100, type=int)
         offset = request.args.get('offset', 0, type=int)
+        cursor = request.args.get('cursor')
         
         # 参数验证
         if limit <= 0 or limit > 1000:
@@ -133,7 +179,7 @@ def get_parse_history():
             offset = 0
         
         # 调用控制器获取历史记录
-        success, result = parse_controller.get_parse_history(limit, offset)
+        success, result = parse_controller.get_parse_history(limit, offset, cursor)
         
         if success:
             return jsonify({
@@ -147,7 +193,7 @@ def get_parse_history():
             }), 400
             
     except Exception as e:
-        logger.error(f"获取解析历史API异常: {str(e)}")
+        logger.error("获取解析历史API异常: %s", e)
         return jsonify({
             "success": False,
             "error": f"服务器内部错误: {str(e)}"
@@ -186,7 +232,7 @@ def get_parsed_content(parse_id):
             }), 404
             
     except Exception as e:
-        logger.error(f"获取解析内容API异常: {str(e)}")
+        logger.error("获取解析内容API异常: %s", e)
         return jsonify({
             "success": False,
             "error": f"服务器内部错误: {str(e)}"
@@ -225,7 +271,7 @@ def delete_parse_record(parse_id):
             }), 404
             
     except Exception as e:
-        logger.error(f"删除解析记录API异常: {str(e)}")
+        logger.error("删除解析记录API异常: %s", e)
         return jsonify({
             "success": False,
             "error": f"服务器内部错误: {str(e)}"
@@ -253,16 +299,18 @@ def download_parsed_text(parse_id):
         success, result = parse_controller.download_parsed_text(parse_id)
         
         if success:
-            # 创建内存文件对象
-            file_data = io.BytesIO()
-            file_data.write(result["content"].encode('utf-8'))
-            file_data.seek(0)
-            
-            return send_file(
-                file_data,
+            # 流式返回文本内容，不在内存中拼出完整文件
+            filename = result["filename"]
+            ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '').strip() or 'parsed.txt'
+            return Response(
+                stream_with_context(result["content"]),
                 mimetype=result["mimetype"],
-                as_attachment=True,
-                download_name=result["filename"]
+                headers={
+                    "Content-Disposition": (
+                        f'attachment; filename="{ascii_name}"; '
+                        f"filename*=UTF-8''{quote(filename)}"
+                    )
+                }
             )
         else:
             return jsonify({
@@ -271,7 +319,7 @@ def download_parsed_text(parse_id):
             }), 404
             
     except Exception as e:
-        logger.error(f"下载解析文本API异常: {str(e)}")
+        logger.error("下载解析文本API异常: %s", e)
         return jsonify({
             "success": False,
             "error": f"服务器内部错误: {str(e)}"
@@ -319,7 +367,7 @@ def search_parsed_texts():
             }), 400
             
     except Exception as e:
-        logger.error(f"搜索解析文本API异常: {str(e)}")
+        logger.error("搜索解析文本API异常: %s", e)
         return jsonify({
             "success": False,
             "error": f"服务器内部错误: {str(e)}"
@@ -5,30 +5,142 @@ qa_routes.py
 
 提供以下接口：
 1. POST /api/qa/rag - RAG 问答接口
-2. GET /api/qa/health - 问答服务健康检查
-3. GET /api/qa/available-files - 获取可用于问答的文件列表
+2. POST /api/qa/rag/stream - RAG 流式问答接口（SSE）
+3. GET /api/qa/health - 问答服务健康检查
+4. GET /api/qa/available-files - 获取可用于问答的文件列表
 
 作者：AI Assistant
 日期：2025-08-07
 """
 
 import logging
-from flask import Blueprint, request, jsonify
+import threading
+import orjson
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from typing import Dict, Any, List
 import time
 
 # 导入业务逻辑服务
 from services.retriever import get_retriever_service
 from services.generator import get_generator_service
+from schemas import load_json
 
 logger = logging.getLogger(__name__)
 
 # 创建 Blueprint
 qa_bp = Blueprint('qa', __name__, url_prefix='/api/qa')
 
-# 初始化服务
-retriever_service = get_retriever_service()
-generator_service = get_generator_service()
+# 检索/生成服务在第一个请求时创建（导入蓝图时不建立 OpenAI 客户端、不加载 tokenizer），每个进程各路由共享一份
+_services = None
+_services_lock = threading.Lock()
+
+
+def _get_services():
+    """
+    获取检索服务和生成服务（懒加载）
+    
+    Returns:
+        Tuple[RetrieverService, GeneratorService]: (检索服务, 生成服务)
+    """
+    global _services
+    
+    if _services is None:
+        with _services_lock:
+            if _services is None:
+                _services = (get_retriever_service(), get_generator_service())
+    
+    return _services
+
+
+def _bad_request(msg: str):
+    """构建 400 响应"""
+    return jsonify({
+        "success": False,
+        "code": 400,
+        "msg": msg,
+        "data": None
+    }), 400
+
+
+def _parse_rag_request():
+    """
+    解析并校验 RAG 问答请求体
+    
+    Returns:
+        Tuple[Dict, Any]: (参数字典, None)；校验失败时为 (None, 400 响应)
+    """
+    data = load_json(request.get_data(cache=False))
+    if not data or 'question' not in data:
+        return None, _bad_request("缺少必需参数 'question'")
+    
+    question = data['question'].strip()
+    if not question:
+        return None, _bad_request("问题内容不能为空")
+    
+    # 获取可选参数
+    params = {
+        'question': question,
+        'file_ids': data.get('file_ids', []),
+        'top_k': data.get('top_k', 3),
+        'min_similarity': data.get('min_similarity', 0.0),
+        'use_openai_embedding': data.get('use_openai_embedding', True),
+        'temperature': data.get('temperature', 0.1),
+        'max_tokens': data.get('max_tokens', 1000)
+    }
+    
+    # 参数验证
+    if params['top_k'] <= 0 or params['top_k'] > 20:
+        return None, _bad_request("top_k 必须在 1-20 之间")
+    
+    logger.info(f"处理问题: '{question[:50]}...'")
+    return params, None
+
+
+def _retrieve_context(params: Dict[str, Any]):
+    """
+    检索相关文档段落并格式化为 RAG 上下文
+    
+    Returns:
+        Tuple: (检索结果, 上下文, 被引用段落, 检索耗时)
+    """
+    question = params['question']
+    file_ids = params['file_ids']
+    retriever_service, _ = _get_services()
+    retrieval_start_time = time.time()
+    
+    if file_ids:
+        # 从指定文件检索
+        logger.info(f"从指定的 {len(file_ids)} 个文件检索")
+        # 各文件检索后在 numpy 中合并，直接得到全局 top_k
+        final_segments = retriever_service.retrieve_top_k(
+            query=question,
+            file_ids=file_ids,
+            top_k=params['top_k'],
+            min_similarity=params['min_similarity'],
+            use_openai=params['use_openai_embedding']
+        )
+    else:
+        # 从所有可用文件检索
+        logger.info("从所有可用文件检索")
+        final_segments = retriever_service.retrieve_all_available(
+            query=question,
+            top_k_total=params['top_k'],
+            min_similarity=params['min_similarity'],
+            use_openai=params['use_openai_embedding']
+        )
+    
+    retrieval_time = time.time() - retrieval_start_time
+    
+    # 格式化检索上下文
+    context, cited_segments = retriever_service.format_context_for_rag(final_segments)
+    
+    logger.info(f"检索完成，找到 {len(cited_segments)} 个相关段落，耗时 {retrieval_time:.3f}s")
+    return final_segments, context, cited_segments, retrieval_time
+
+
+def _sse(event: Dict[str, Any]) -> bytes:
+    """编码一条 SSE 事件"""
+    return b"data: " + orjson.dumps(event, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n\n"
 
 
 @qa_bp.route('/rag', methods=['POST'])
@@ -68,83 +180,19 @@ def rag_qa():
     try:
         start_time = time.time()
         logger.info("RAG 问答 API 被调用")
+        _, generator_service = _get_services()
         
         # 验证请求数据
-        data = request.get_json()
-        if not data or 'question' not in data:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "缺少必需参数 'question'",
-                "data": None
-            }), 400
+        params, error = _parse_rag_request()
+        if error:
+            return error
+        question = params['question']
+        min_similarity = params['min_similarity']
+        temperature = params['temperature']
+        max_tokens = params['max_tokens']
         
-        question = data['question'].strip()
-        if not question:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "问题内容不能为空",
-                "data": None
-            }), 400
-        
-        # 获取可选参数
-        file_ids = data.get('file_ids', [])
-        top_k = data.get('top_k', 3)
-        min_similarity = data.get('min_similarity', 0.0)
-        use_openai_embedding = data.get('use_openai_embedding', True)
-        temperature = data.get('temperature', 0.1)
-        max_tokens = data.get('max_tokens', 1000)
-        
-        # 参数验证
-        if top_k <= 0 or top_k > 20:
-            return jsonify({
-                "success": False,
-                "code": 400,
-                "msg": "top_k 必须在 1-20 之间",
-                "data": None
-            }), 400
-        
-        logger.info(f"处理问题: '{question[:50]}...'")
-        
-        # 步骤1: 检索相关文档段落
-        retrieval_start_time = time.time()
-        
-        if file_ids:
-            # 从指定文件检索
-            logger.info(f"从指定的 {len(file_ids)} 个文件检索")
-            retrieval_results = retriever_service.retrieve_from_multiple_files(
-                query=question,
-                file_ids=file_ids,
-                top_k_per_file=max(1, top_k // len(file_ids)),
-                min_similarity=min_similarity,
-                use_openai=use_openai_embedding
-            )
-            
-            # 合并多文件结果
-            all_segments = []
-            for file_id, segments in retrieval_results.items():
-                all_segments.extend(segments)
-            
-            # 按相似度排序并取 top_k
-            all_segments.sort(key=lambda x: x.get('similarity', 0), reverse=True)
-            final_segments = all_segments[:top_k]
-        else:
-            # 从所有可用文件检索
-            logger.info("从所有可用文件检索")
-            final_segments = retriever_service.retrieve_all_available(
-                query=question,
-                top_k_total=top_k,
-                min_similarity=min_similarity,
-                use_openai=use_openai_embedding
-            )
-        
-        retrieval_time = time.time() - retrieval_start_time
-        
-        # 步骤2: 格式化检索上下文
-        context, cited_segments = retriever_service.format_context_for_rag(final_segments)
-        
-        logger.info(f"检索完成，找到 {len(cited_segments)} 个相关段落，耗时 {retrieval_time:.3f}s")
+        # 步骤1-2: 检索相关文档段落并格式化检索上下文
+        final_segments, context, cited_segments, retrieval_time = _retrieve_context(params)
         
         # 步骤3: 使用 OpenAI 生成回答
         generation_result = generator_service.generate_answer(
@@ -216,6 +264,95 @@ def rag_qa():
         }), 500
 
 
+@qa_bp.route('/rag/stream', methods=['POST'])
+def rag_qa_stream():
+    """
+    基于检索增强生成的流式问答接口（Server-Sent Events）
+    
+    URL: POST /api/qa/rag/stream
+    
+    Body: 同 POST /api/qa/rag
+    
+    Returns:
+        text/event-stream，每条事件为 "data: {json}"：
+        {"type": "start", "response_type": ..., "retrieval_results": {...}}
+        {"type": "content", "delta": "..."}                      // 逐段输出的回答内容
+        {"type": "end", "answer": ..., "quality_assessment": {...}, "total_time": ...}
+        {"type": "error", "error": "..."}                         // 生成失败时
+    """
+    try:
+        start_time = time.time()
+        logger.info("RAG 流式问答 API 被调用")
+        _, generator_service = _get_services()
+        
+        params, error = _parse_rag_request()
+        if error:
+            return error
+        
+        # 检索在返回响应前完成，参数或检索错误仍以普通 JSON 响应返回
+        final_segments, context, cited_segments, retrieval_time = _retrieve_context(params)
+        
+    except Exception as e:
+        logger.error(f"RAG 流式问答 API 异常: {str(e)}")
+        return jsonify({
+            "success": False,
+            "code": 500,
+            "msg": f"服务器内部错误: {str(e)}",
+            "data": None
+        }), 500
+    
+    question = params['question']
+    
+    def generate():
+        for event in generator_service.generate_answer_stream(
+            question=question,
+            context=context,
+            cited_segments=cited_segments,
+            temperature=params['temperature'],
+            max_tokens=params['max_tokens']
+        ):
+            event_type = event['type']
+            if event_type == 'content':
+                yield _sse({"type": "content", "delta": event['content']})
+            elif event_type == 'start':
+                yield _sse({
+                    "type": "start",
+                    "question": question,
+                    "response_type": event['response_type'],
+                    "context_used": event['context_used'],
+                    "retrieval_results": {
+                        "total_segments": len(final_segments),
+                        "used_segments": len(cited_segments),
+                        "search_time": round(retrieval_time, 3),
+                        "min_similarity": params['min_similarity'],
+                        "cited_segments": cited_segments
+                    }
+                })
+            elif event_type == 'end':
+                # 回答完整后再评估质量，随结束事件一起发送
+                answer = event['full_answer']
+                yield _sse({
+                    "type": "end",
+                    "answer": answer,
+                    "model": event['model'],
+                    "generation_time": round(event['generation_time'], 3),
+                    "total_time": round(time.time() - start_time, 3),
+                    "quality_assessment": generator_service.evaluate_answer_quality(
+                        question=question,
+                        answer=answer,
+                        context=context
+                    )
+                })
+            else:
+                yield _sse(event)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # 关闭反向代理（nginx）缓冲，事件逐条到达客户端
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @qa_bp.route('/health', methods=['GET'])
 def qa_health_check():
     """
@@ -225,6 +362,7 @@ def qa_health_check():
     """
     try:
         logger.info("问答服务健康检查")
+        retriever_service, generator_service = _get_services()
         
         # 检查检索服务状态
         retriever_status = retriever_service.get_service_status()
@@ -282,6 +420,7 @@ def get_available_files():
     """
     try:
         logger.info("获取可用文件列表")
+        retriever_service, _ = _get_services()
         
         # 获取所有向量索引
         all_indices = retriever_service.vector_store.list_all_indices()
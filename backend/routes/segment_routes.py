@@ -6,6 +6,8 @@ from flask import Blueprint, request, jsonify
 import logging
 
 from controllers.segment_controller import segment_controller
+from schemas import load_json
+from config import Config
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -48,6 +50,46 @@ def create_segments(file_id):
             "data": None
         }), 500
 
+@segment_bp.route('/create/batch', methods=['POST'])
+def create_segments_batch():
+    """
+    批量为多个文件创建分段
+    
+    Request Body:
+        {
+            "file_ids": ["文件ID1", "文件ID2"]
+        }
+    
+    Returns:
+        JSON: 批量分段结果
+    """
+    try:
+        data = load_json(request.get_data(cache=False)) or {}
+        file_ids = data.get("file_ids")
+        if not file_ids or not isinstance(file_ids, list):
+            return jsonify({
+                "code": 400,
+                "msg": "file_ids 必须是非空列表",
+                "data": None
+            }), 400
+        if len(file_ids) > Config.BATCH_MAX_FILES:
+            return jsonify({
+                "code": 400,
+                "msg": f"file_ids 不能超过 {Config.BATCH_MAX_FILES} 个",
+                "data": None
+            }), 400
+        
+        success, result = segment_controller.create_segments_from_files(file_ids)
+        return jsonify(result), result["code"]
+            
+    except Exception as e:
+        logger.error(f"批量创建分段API异常: {str(e)}")
+        return jsonify({
+            "code": 500,
+            "msg": f"服务器内部错误: {str(e)}",
+            "data": None
+        }), 500
+
 @segment_bp.route('/file/<file_id>', methods=['GET'])
 def get_file_segments(file_id):
     """
@@ -98,7 +140,7 @@ def update_segment_tags():
         JSON: 更新结果
     """
     try:
-        data = request.get_json()
+        data = load_json(request.get_data(cache=False))
         if not data:
             return jsonify({
                 "code": 400,
@@ -142,7 +184,7 @@ def batch_update_tags():
         JSON: 批量更新结果
     """
     try:
-        data = request.get_json()
+        data = load_json(request.get_data(cache=False))
         if not data:
             return jsonify({
                 "code": 400,
@@ -5,38 +5,37 @@ upload_routes.py - 文档上传相关的 API 接口路由
 
 from flask import Blueprint, request, jsonify, send_file, current_app
 from werkzeug.exceptions import RequestEntityTooLarge
-from pymongo import MongoClient
 from pymongo.errors import PyMongoError
+from urllib.parse import unquote
+import logging
 import os
 
 # 导入模型和控制器
 from models.file_model import FileModel
 from controllers.file_controller import FileController
 from config import Config
+from db import get_db
+
+logger = logging.getLogger(__name__)
 
 # 创建蓝图
 upload_bp = Blueprint("upload", __name__, url_prefix="/api")
 
-# 全局变量，用于存储数据库连接和控制器实例
-_db = None
+# 全局变量，用于存储控制器实例
 _file_controller = None
 
 def get_file_controller():
     """获取文件控制器实例（单例模式）"""
-    global _db, _file_controller
+    global _file_controller
     
     if _file_controller is None:
         try:
-            # 创建MongoDB连接
-            client = MongoClient(Config.MONGO_URI)
-            _db = client[Config.MONGO_DB_NAME]
-            
-            # 创建文件模型和控制器实例
-            file_model = FileModel(_db)
+            # 使用进程内共享的 MongoDB 连接池
+            file_model = FileModel(get_db())
             _file_controller = FileController(file_model)
             
         except Exception as e:
-            print(f"Error initializing file controller: {e}")
+            logger.exception("Error initializing file controller: %s", e)
             return None
     
     return _file_controller
@@ -44,8 +43,10 @@ def get_file_controller():
 @upload_bp.route('/upload', methods=['POST'])
 def upload_files():
     """
-    文件上传接口
+    文件上传接口（multipart/form-data）
     支持单个或多个文件上传
+    
+    已弃用：大文件请使用 /api/upload/stream，避免 multipart 解析和临时文件落盘的开销
     """
     try:
         # 获取文件控制器
@@ -99,11 +100,66 @@ def upload_files():
     except RequestEntityTooLarge:
         return jsonify({
             'success': False,
-            'error': f'File too large. Maximum size is {Config.MAX_CONTENT_LENGTH / 1024 / 1024:.1f}MB'
+            'error': f'File too large. Maximum size is {Config.MAX_CONTENT_LENGTH_MB_STR}MB'
         }), 413
     
     except Exception as e:
-        print(f"Upload error: {e}")
+        logger.exception("Upload error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error during file upload'
+        }), 500
+
+@upload_bp.route('/upload/stream', methods=['POST'])
+def upload_stream():
+    """
+    流式文件上传接口
+    请求体为文件原始内容，文件名通过 X-Filename 请求头传递（支持 URL 编码），
+    直接分块读取 request.stream 写入磁盘，不经过 multipart 解析
+    """
+    try:
+        # 先校验请求头，拒绝的请求不读取请求体
+        filename = unquote(request.headers.get('X-Filename', '')).strip()
+        if not filename:
+            return jsonify({
+                'success': False,
+                'error': 'Missing X-Filename header'
+            }), 400
+        
+        if request.content_length is not None and request.content_length > Config.MAX_CONTENT_LENGTH:
+            raise RequestEntityTooLarge()
+        
+        # 获取文件控制器
+        controller = get_file_controller()
+        if not controller:
+            return jsonify({
+                'success': False,
+                'error': 'Service unavailable'
+            }), 500
+        
+        mime_type = request.headers.get('Content-Type', 'application/octet-stream')
+        result = controller.upload_stream(request.stream, filename, mime_type)
+        
+        if result['success']:
+            return jsonify({
+                'success': True,
+                'message': 'Successfully uploaded 1 files',
+                'data': result['data']
+            }), 200
+        else:
+            return jsonify({
+                'success': False,
+                'error': result['error']
+            }), 400
+    
+    except RequestEntityTooLarge:
+        return jsonify({
+            'success': False,
+            'error': f'File too large. Maximum size is {Config.MAX_CONTENT_LENGTH_MB_STR}MB'
+        }), 413
+    
+    except Exception as e:
+        logger.exception("Stream upload error: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error during file upload'
@@ -127,9 +183,16 @@ def get_files():
         # 获取查询参数
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 50, type=int), 100)  # 限制最大每页数量
+        cursor = request.args.get('cursor')  # 上一页返回的 next_cursor，深分页时优先使用
         
         # 获取文件列表
-        result = controller.get_all_files(page=page, per_page=per_page)
+        try:
+            result = controller.get_all_files(page=page, per_page=per_page, cursor=cursor)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid cursor'
+            }), 400
         
         return jsonify({
             'success': True,
@@ -138,7 +201,7 @@ def get_files():
         }), 200
     
     except Exception as e:
-        print(f"Get files error: {e}")
+        logger.exception("Get files error: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error while fetching files'
@@ -175,7 +238,7 @@ def delete_file(file_id):
             }), status_code
     
     except Exception as e:
-        print(f"Delete file error: {e}")
+        logger.exception("Delete file error: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error while deleting file'
@@ -205,16 +268,20 @@ def download_file(file_id):
                 'error': 'File not found or file does not exist on disk'
             }), 404
         
-        # 返回文件
+        # 返回文件：按路径传入，由 WSGI 服务器的 file_wrapper 使用 sendfile 零拷贝发送；
+        # 附带 ETag/Last-Modified，客户端带条件请求时直接返回 304，Range 请求返回 206
         return send_file(
             file_info['path'],
             as_attachment=True,
             download_name=file_info['filename'],
-            mimetype=file_info['mime_type']
+            mimetype=file_info['mime_type'],
+            conditional=True,
+            etag=True,
+            max_age=Config.DOWNLOAD_MAX_AGE
         )
     
     except Exception as e:
-        print(f"Download file error: {e}")
+        logger.exception("Download file error: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error while downloading file'
@@ -244,7 +311,7 @@ def get_file_stats():
         }), 200
     
     except Exception as e:
-        print(f"Get stats error: {e}")
+        logger.exception("Get stats error: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error while fetching statistics'
@@ -256,7 +323,7 @@ def too_large(e):
     """处理文件过大错误"""
     return jsonify({
         'success': False,
-        'error': f'File too large. Maximum size is {Config.MAX_CONTENT_LENGTH / 1024 / 1024:.1f}MB'
+        'error': f'File too large. Maximum size is {Config.MAX_CONTENT_LENGTH_MB_STR}MB'
     }), 413
 
 @upload_bp.errorhandler(500)
@@ -0,0 +1,67 @@
+"""
+schemas.py - 请求体结构定义
+使用 msgspec 在 C 层一次完成 JSON 解码和字段校验（类型、默认值、取值范围），
+路由中无需再逐个 get 字段并手写判断
+"""
+
+from typing import Annotated, List, Literal, Optional
+
+import msgspec
+
+# 查询文本：至少包含一个非空白字符
+Query = Annotated[str, msgspec.Meta(pattern=r"\S")]
+# 返回结果数量
+TopK = Annotated[int, msgspec.Meta(ge=1, le=100)]
+PositiveInt = Annotated[int, msgspec.Meta(ge=1)]
+
+
+class CreateEmbeddingRequest(msgspec.Struct):
+    """创建 embedding 请求体（可为空）"""
+    recreate: bool = False
+    batch_size: PositiveInt = 32
+    max_tokens_per_batch: Optional[PositiveInt] = None
+    # 新建索引的向量存储精度，默认使用配置值
+    dtype: Optional[Literal["float32", "float16", "bfloat16", "int8", "binary"]] = None
+    # 新建索引的结构；IVF 的聚类数和 PQ 子量化器个数，不指定时按向量数/维度自动选择
+    index_type: Literal["flat", "ivf", "ivf_pq"] = "flat"
+    nlist: Optional[PositiveInt] = None
+    pq_m: Optional[PositiveInt] = None
+
+
+class SearchRequest(msgspec.Struct):
+    """单文件向量搜索请求体"""
+    query: Query
+    top_k: TopK = 5
+    min_score: float = 0.0
+    # IVF 索引探查的聚类数，不指定时使用索引默认值
+    nprobe: Optional[PositiveInt] = None
+
+
+class MultiSearchRequest(SearchRequest, kw_only=True):
+    """多文件向量搜索请求体"""
+    file_ids: Annotated[List[str], msgspec.Meta(min_length=1)]
+
+
+def load_json(body: bytes):
+    """
+    解码没有固定结构的 JSON 请求体
+    :param body: 原始请求体
+    :return: 解码结果，空请求体或 JSON 格式错误时返回 None
+    """
+    if not body:
+        return None
+    try:
+        return msgspec.json.decode(body)
+    except msgspec.DecodeError:
+        return None
+
+
+def decode_request(body: bytes, schema):
+    """
+    解码并校验请求体，空请求体按空对象处理
+    :param body: 原始请求体
+    :param schema: 请求体结构类型
+    :return: 结构实例
+    :raises msgspec.DecodeError: JSON 格式错误或字段校验失败（ValidationError 为其子类）
+    """
+    return msgspec.json.decode(body or b"{}", type=schema)
@@ -14,10 +14,12 @@ embedding_service.py
 """
 
 import logging
+import tempfile
 import numpy as np
 from typing import List, Dict, Any, Tuple
 from sentence_transformers import SentenceTransformer
 import torch
+from config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -47,7 +49,7 @@ class EmbeddingService:
         加载 sentence-transformers 模型
         """
         try:
-            logger.info(f"正在加载 sentence-transformers 模型: {self.model_name}")
+            logger.info("正在加载 sentence-transformers 模型: %s", self.model_name)
             
             # 加载预训练模型
             self.model = SentenceTransformer(self.model_name)
@@ -55,10 +57,10 @@ class EmbeddingService:
             # 获取向量维度
             self.embedding_dim = self.model.get_sentence_embedding_dimension()
             
-            logger.info(f"模型加载成功，向量维度: {self.embedding_dim}")
+            logger.info("模型加载成功，向量维度: %s", self.embedding_dim)
             
         except Exception as e:
-            logger.error(f"模型加载失败: {str(e)}")
+            logger.exception("模型加载失败: %s", e)
             raise Exception(f"Failed to load embedding model: {str(e)}")
     
     def encode_text(self, text: str) -> np.ndarray:
@@ -86,16 +88,18 @@ class EmbeddingService:
             return embedding.astype(np.float32)
             
         except Exception as e:
-            logger.error(f"文本编码失败: {str(e)}")
+            logger.exception("文本编码失败: %s", e)
             return np.zeros(self.embedding_dim, dtype=np.float32)
     
-    def encode_batch(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+    def encode_batch(self, texts: List[str], batch_size: int = 32,
+                     max_tokens_per_batch: int = None) -> np.ndarray:
         """
         批量将文本转换为 embedding 向量
         
         Args:
             texts (List[str]): 待编码的文本列表
-            batch_size (int): 批处理大小，默认32
+            batch_size (int): 批处理大小，默认32（未指定 max_tokens_per_batch 时生效）
+            max_tokens_per_batch (int): 每批估算 token 上限，指定后按文本长度打包批次
             
         Returns:
             np.ndarray: 文本向量矩阵 (shape: [len(texts), embedding_dim])
@@ -105,7 +109,8 @@ class EmbeddingService:
                 logger.warning("输入文本列表为空")
                 return np.array([]).reshape(0, self.embedding_dim)
             
-            logger.info(f"开始批量编码 {len(texts)} 个文本，批大小: {batch_size}")
+            logger.info(f"开始批量编码 {len(texts)} 个文本，批大小: {batch_size}，"
+                        f"token 上限: {max_tokens_per_batch}")
             
             # 过滤空文本
             valid_texts = []
@@ -119,33 +124,94 @@ class EmbeddingService:
                 logger.warning("所有输入文本都为空，返回零向量矩阵")
                 return np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
             
-            # 批量编码
-            embeddings = self.model.encode(
-                valid_texts,
-                batch_size=batch_size,
-                convert_to_numpy=True,
-                normalize_embeddings=True,
-                show_progress_bar=True
-            )
+            # 预分配连续的 float32 结果矩阵，空文本对应零向量
+            result = self._allocate_embeddings(len(texts))
+            valid_indices = np.asarray(valid_indices, dtype=np.int64)
             
-            # 处理空文本的情况
-            result = np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
-            for i, valid_idx in enumerate(valid_indices):
-                result[valid_idx] = embeddings[i]
+            # 逐批编码并按原始顺序直接写入结果矩阵（大矩阵为 memmap 时可保持内存占用平稳）
+            for batch in self._iter_batches(valid_texts, batch_size, max_tokens_per_batch):
+                result[valid_indices[batch]] = self.model.encode(
+                    [valid_texts[i] for i in batch],
+                    batch_size=len(batch),
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=False
+                )
             
-            logger.info(f"批量编码完成，生成 {len(texts)} 个向量")
+            logger.info("批量编码完成，生成 %s 个向量", len(texts))
             return result
             
         except Exception as e:
-            logger.error(f"批量编码失败: {str(e)}")
+            logger.exception("批量编码失败: %s", e)
             return np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
     
-    def encode_segments(self, segments: List[Dict[str, Any]]) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+    def _iter_batches(self, texts: List[str], batch_size: int, max_tokens_per_batch: int = None):
+        """
+        生成编码批次（文本下标数组）
+        
+        指定 max_tokens_per_batch 时，按估算 token 数（长度 // 4，不超过模型最大序列长度）
+        从短到长排序后贪心打包，短文本批次更大、长文本批次更小，同时减少批内 padding；
+        否则按 batch_size 固定数量分批。
+        
+        Args:
+            texts (List[str]): 非空文本列表
+            batch_size (int): 固定批大小
+            max_tokens_per_batch (int): 每批估算 token 上限
+            
+        Yields:
+            np.ndarray: 一个批次内的文本下标
+        """
+        if not max_tokens_per_batch:
+            step = max(batch_size, 1)
+            for start in range(0, len(texts), step):
+                yield np.arange(start, min(start + step, len(texts)))
+            return
+        
+        max_seq_length = getattr(self.model, 'max_seq_length', None) or max_tokens_per_batch
+        token_counts = [max(1, min(len(text) // 4, max_seq_length)) for text in texts]
+        
+        batch = []
+        batch_tokens = 0
+        for i in sorted(range(len(texts)), key=token_counts.__getitem__):
+            if batch and batch_tokens + token_counts[i] > max_tokens_per_batch:
+                yield np.asarray(batch, dtype=np.int64)
+                batch = []
+                batch_tokens = 0
+            batch.append(i)
+            batch_tokens += token_counts[i]
+        
+        if batch:
+            yield np.asarray(batch, dtype=np.int64)
+    
+    def _allocate_embeddings(self, count: int) -> np.ndarray:
+        """
+        分配用于存放向量的 C 连续 float32 矩阵
+        
+        矩阵超过 Config.EMBEDDING_MEMMAP_THRESHOLD_MB 时使用临时文件支持的 memmap
+        
+        Args:
+            count (int): 向量数量
+            
+        Returns:
+            np.ndarray: 全零矩阵 (shape: [count, embedding_dim])
+        """
+        shape = (count, self.embedding_dim)
+        size_mb = count * self.embedding_dim * np.dtype(np.float32).itemsize / (1024 * 1024)
+        
+        if size_mb > Config.EMBEDDING_MEMMAP_THRESHOLD_MB:
+            logger.info("向量矩阵约 %.1fMB，使用 memmap 存储", size_mb)
+            return np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode='w+', shape=shape)
+        
+        return np.zeros(shape, dtype=np.float32)
+    
+    def encode_segments(self, segments: List[Dict[str, Any]],
+                        max_tokens_per_batch: int = None) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
         """
         将段落数据转换为 embedding 向量
         
         Args:
             segments (List[Dict]): 段落数据列表，每个段落包含 'text' 字段
+            max_tokens_per_batch (int): 每批估算 token 上限，默认使用 Config.EMBEDDING_MAX_TOKENS_PER_BATCH
             
         Returns:
             Tuple[np.ndarray, List[Dict]]: 
@@ -153,7 +219,7 @@ class EmbeddingService:
                 - 对应的元数据列表
         """
         try:
-            logger.info(f"开始处理 {len(segments)} 个段落的向量化")
+            logger.info("开始处理 %s 个段落的向量化", len(segments))
             
             # 提取文本内容
             texts = []
@@ -177,14 +243,24 @@ class EmbeddingService:
                 }
                 metadata.append(meta)
             
-            # 批量编码
-            embeddings = self.encode_batch(texts)
+            # 按 token 预算打包批量编码
+            if max_tokens_per_batch is None:
+                max_tokens_per_batch = Config.EMBEDDING_MAX_TOKENS_PER_BATCH
+            
+            # 相同文本（页眉、页脚等重复内容）只编码一次，再按原顺序展开
+            unique_texts = list(dict.fromkeys(texts))
+            embeddings = self.encode_batch(unique_texts, max_tokens_per_batch=max_tokens_per_batch)
+            if len(unique_texts) < len(texts):
+                logger.info("去重后需编码 %s 个文本（原 %s 个）", len(unique_texts), len(texts))
+                positions = {text: i for i, text in enumerate(unique_texts)}
+                embeddings = embeddings[np.fromiter((positions[text] for text in texts),
+                                                    dtype=np.int64, count=len(texts))]
             
-            logger.info(f"段落向量化完成，生成 {len(embeddings)} 个向量")
+            logger.info("段落向量化完成，生成 %s 个向量", len(embeddings))
             return embeddings, metadata
             
         except Exception as e:
-            logger.error(f"段落向量化失败: {str(e)}")
+            logger.exception("段落向量化失败: %s", e)
             return np.array([]).reshape(0, self.embedding_dim), []
     
     def calculate_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
@@ -211,7 +287,7 @@ class EmbeddingService:
             return float(similarity)
             
         except Exception as e:
-            logger.error(f"相似度计算失败: {str(e)}")
+            logger.exception("相似度计算失败: %s", e)
             return 0.0
     
     def get_model_info(self) -> Dict[str, Any]:
@@ -260,7 +336,7 @@ def preload_embedding_model():
         get_embedding_service()
         logger.info("embedding 模型预加载完成")
     except Exception as e:
-        logger.error(f"embedding 模型预加载失败: {str(e)}")
+        logger.exception("embedding 模型预加载失败: %s", e)
 
 
 if __name__ == "__main__":
@@ -14,15 +14,25 @@ OpenAI 文本生成服务
 日期：2025-08-07
 """
 
+import hashlib
 import logging
+import threading
 import openai
 import tiktoken
+from cachetools import TTLCache
 from typing import List, Dict, Any, Optional, Iterator, Tuple
 from config import Config
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "你是一个专业的化工领域专家，具有丰富的理论知识和实践经验。请提供准确、专业、有用的回答。"
+
+
+def _digest(*parts) -> str:
+    """计算缓存键摘要"""
+    return hashlib.blake2b("\x1f".join(map(str, parts)).encode('utf-8'), digest_size=16).hexdigest()
+
 
 class GeneratorService:
     """
@@ -37,6 +47,10 @@ class GeneratorService:
         self.chat_model = Config.OPENAI_CHAT_MODEL
         self.max_context_length = Config.RAG_MAX_CONTEXT_LENGTH
         
+        # 回答缓存: (模型, 提示词, 温度, 最大 token 数) 摘要 -> 生成结果
+        self._answer_cache = TTLCache(maxsize=max(Config.ANSWER_CACHE_SIZE, 1), ttl=Config.ANSWER_CACHE_TTL)
+        self._answer_cache_lock = threading.Lock()
+        
         # 初始化 tokenizer
         try:
             self.tokenizer = tiktoken.encoding_for_model(self.chat_model)
@@ -158,13 +172,22 @@ class GeneratorService:
                 prompt = f"作为化工领域专家，请回答以下问题：\\n\\n{question}"
                 response_type = "direct_answer"
             
+            # 相同提示词（问题 + 检索上下文）和生成参数直接返回缓存的回答，不再调用 OpenAI
+            cache_key = _digest(self.chat_model, prompt, temperature, max_tokens)
+            if Config.ANSWER_CACHE_SIZE > 0:
+                with self._answer_cache_lock:
+                    cached = self._answer_cache.get(cache_key)
+                if cached is not None:
+                    logger.info("回答缓存命中，类型: %s", response_type)
+                    return dict(cached, generation_time=0.0, cached=True)
+            
             logger.info(f"开始生成回答，类型: {response_type}")
             
             # 构建消息
             messages = [
                 {
                     "role": "system",
-                    "content": "你是一个专业的化工领域专家，具有丰富的理论知识和实践经验。请提供准确、专业、有用的回答。"
+                    "content": SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -172,6 +195,9 @@ class GeneratorService:
                 }
             ]
             
+            # 按上下文分组的 prompt_cache_key：相同上下文的请求路由到同一服务端缓存，复用已计算的前缀
+            extra_body = {"prompt_cache_key": _digest(context)} if Config.OPENAI_PROMPT_CACHE_KEY else None
+            
             # 调用 OpenAI API
             response = self.openai_client.chat.completions.create(
                 model=self.chat_model,
@@ -180,7 +206,8 @@ class GeneratorService:
                 max_tokens=max_tokens,
                 top_p=0.9,
                 frequency_penalty=0.0,
-                presence_penalty=0.0
+                presence_penalty=0.0,
+                extra_body=extra_body
             )
             
             # 提取回答
@@ -198,7 +225,7 @@ class GeneratorService:
             
             logger.info(f"回答生成完成，耗时: {generation_time:.2f}s, tokens: {total_tokens}")
             
-            return {
+            result = {
                 'success': True,
                 'answer': answer,
                 'response_type': response_type,
@@ -213,6 +240,10 @@ class GeneratorService:
                 'cited_segments': cited_segments or [],
                 'context_used': bool(context.strip())
             }
+            if Config.ANSWER_CACHE_SIZE > 0:
+                with self._answer_cache_lock:
+                    self._answer_cache[cache_key] = result
+            return result
             
         except Exception as e:
             logger.error(f"生成回答失败: {str(e)}")
@@ -261,7 +292,7 @@ class GeneratorService:
             messages = [
                 {
                     "role": "system",
-                    "content": "你是一个专业的化工领域专家，具有丰富的理论知识和实践经验。请提供准确、专业、有用的回答。"
+                    "content": SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -277,26 +308,28 @@ class GeneratorService:
                 'cited_segments': cited_segments or []
             }
             
+            extra_body = {"prompt_cache_key": _digest(context)} if Config.OPENAI_PROMPT_CACHE_KEY else None
+            
             # 调用 OpenAI 流式 API
             stream = self.openai_client.chat.completions.create(
                 model=self.chat_model,
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
-                stream=True
+                stream=True,
+                extra_body=extra_body
             )
             
-            # 流式输出
-            full_answer = ""
+            # 流式输出（只发送增量，完整回答在结束时拼接一次）
+            parts = []
             for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
                     content = chunk.choices[0].delta.content
-                    full_answer += content
+                    parts.append(content)
                     
                     yield {
                         'type': 'content',
-                        'content': content,
-                        'accumulated': full_answer
+                        'content': content
                     }
             
             # 发送完成状态
@@ -304,7 +337,7 @@ class GeneratorService:
             
             yield {
                 'type': 'end',
-                'full_answer': full_answer,
+                'full_answer': ''.join(parts),
                 'generation_time': generation_time,
                 'model': self.chat_model
             }
@@ -4,9 +4,10 @@
 
 import fitz  # PyMuPDF
 from docx import Document
+import io
 import os
 import logging
-from typing import Tuple, Optional
+from typing import BinaryIO, Optional, Tuple, Union
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +19,8 @@ class DocumentParsingService:
     def __init__(self):
         """初始化解析服务"""
         self.supported_types = {'pdf', 'docx', 'doc', 'txt'}
+        # 可直接从文件对象解析的类型（PDF 解析需要文件路径或完整内存数据）
+        self.streamable_types = {'docx', 'doc', 'txt'}
     
     def parse_document(self, file_path: str, file_type: str) -> Tuple[bool, str]:
         """
@@ -54,12 +57,71 @@ class DocumentParsingService:
             logger.error(f"文档解析异常: {str(e)}")
             return False, f"解析失败: {str(e)}"
     
-    def _parse_pdf(self, file_path: str) -> Tuple[bool, str]:
+    def parse_bytes(self, data: bytes, file_type: str, name: str = "<upload>") -> Tuple[bool, str]:
+        """
+        直接从内存中的文件内容解析文本（无需先写入临时文件）
+        
+        Args:
+            data (bytes): 文件内容
+            file_type (str): 文件类型 (pdf, docx, txt)
+            name (str): 文件名，仅用于日志
+        
+        Returns:
+            Tuple[bool, str]: (是否成功, 解析的文本内容或错误信息)
+        """
+        try:
+            file_type = file_type.lower()
+            if file_type not in self.supported_types:
+                return False, f"不支持的文件类型: {file_type}"
+            
+            if file_type == 'pdf':
+                return self._parse_pdf(name, data)
+            elif file_type in ['docx', 'doc']:
+                return self._parse_docx(name, data)
+            elif file_type == 'txt':
+                return self._parse_txt(name, data)
+            else:
+                return False, f"未实现的文件类型: {file_type}"
+                
+        except Exception as e:
+            logger.error(f"文档解析异常: {str(e)}")
+            return False, f"解析失败: {str(e)}"
+    
+    def parse_document_stream(self, stream: BinaryIO, file_type: str, name: str = "<upload>") -> Tuple[bool, str]:
+        """
+        直接从可随机读取的文件对象解析文本（无需先写入临时文件）
+        
+        Args:
+            stream (BinaryIO): 文件对象，需支持 seek
+            file_type (str): 文件类型 (docx, txt)
+            name (str): 文件名，仅用于日志
+        
+        Returns:
+            Tuple[bool, str]: (是否成功, 解析的文本内容或错误信息)
+        """
+        try:
+            file_type = file_type.lower()
+            if file_type not in self.streamable_types:
+                return False, f"不支持从文件流解析的类型: {file_type}"
+            
+            stream.seek(0)
+            if file_type in ['docx', 'doc']:
+                # docx 为 zip 包，python-docx 按需读取其中的部件
+                return self._parse_docx(name, stream)
+            else:
+                return self._parse_txt(name, stream.read())
+                
+        except Exception as e:
+            logger.error(f"文档解析异常: {str(e)}")
+            return False, f"解析失败: {str(e)}"
+    
+    def _parse_pdf(self, file_path: str, data: Optional[bytes] = None) -> Tuple[bool, str]:
         """
         解析 PDF 文件
         
         Args:
             file_path (str): PDF 文件路径
+            data (Optional[bytes]): 文件内容，提供时直接从内存解析
         
         Returns:
             Tuple[bool, str]: (是否成功, 文本内容或错误信息)
@@ -67,13 +129,19 @@ class DocumentParsingService:
         doc = None
         try:
             # 验证文件是否为有效的PDF
-            with open(file_path, 'rb') as f:
-                header = f.read(4)
-                if header != b'%PDF':
-                    return False, "文件不是有效的PDF格式"
+            if data is not None:
+                header = data[:4]
+            else:
+                with open(file_path, 'rb') as f:
+                    header = f.read(4)
+            if header != b'%PDF':
+                return False, "文件不是有效的PDF格式"
             
             # 尝试打开PDF文档
-            doc = fitz.open(file_path)
+            if data is not None:
+                doc = fitz.open(stream=data, filetype='pdf')
+            else:
+                doc = fitz.open(file_path)
             
             # 检查文档是否有效
             if doc.is_closed:
@@ -123,18 +191,25 @@ class DocumentParsingService:
                 except:
                     pass
     
-    def _parse_docx(self, file_path: str) -> Tuple[bool, str]:
+    def _parse_docx(self, file_path: str, data: Union[bytes, BinaryIO, None] = None) -> Tuple[bool, str]:
         """
         解析 DOCX/DOC 文件
         
         Args:
             file_path (str): DOCX 文件路径
+            data (Union[bytes, BinaryIO, None]): 文件内容或文件对象，提供时直接从内存/文件流解析
         
         Returns:
             Tuple[bool, str]: (是否成功, 文本内容或错误信息)
         """
         try:
-            doc = Document(file_path)
+            if data is None:
+                source = file_path
+            elif isinstance(data, (bytes, bytearray)):
+                source = io.BytesIO(data)
+            else:
+                source = data
+            doc = Document(source)
             text_content = []
             
             # 提取所有段落
@@ -155,12 +230,13 @@ class DocumentParsingService:
             logger.error(f"DOCX 解析失败: {str(e)}")
             return False, f"DOCX 解析失败: {str(e)}"
     
-    def _parse_txt(self, file_path: str) -> Tuple[bool, str]:
+    def _parse_txt(self, file_path: str, data: Optional[bytes] = None) -> Tuple[bool, str]:
         """
         解析 TXT 文件
         
         Args:
             file_path (str): TXT 文件路径
+            data (Optional[bytes]): 文件内容，提供时直接从内存解析
         
         Returns:
             Tuple[bool, str]: (是否成功, 文本内容或错误信息)
@@ -171,8 +247,11 @@ class DocumentParsingService:
             
             for encoding in encodings:
                 try:
-                    with open(file_path, 'r', encoding=encoding) as file:
-                        content = file.read()
+                    if data is not None:
+                        content = data.decode(encoding)
+                    else:
+                        with open(file_path, 'r', encoding=encoding) as file:
+                            content = file.read()
                         
                     if content.strip():
                         logger.info(f"成功解析 TXT 文件: {file_path} (编码: {encoding})")
@@ -13,16 +13,111 @@ retriever.py
 日期：2025-08-07
 """
 
+import os
+import time
+import queue
 import logging
+import heapq
+import threading
 import openai
 import numpy as np
+from cachetools import TTLCache
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from itertools import chain
+from operator import attrgetter, itemgetter
 from typing import List, Dict, Any, Tuple, Optional
 from config import Config
 from services.vector_store import get_vector_store
 from services.embedding_service import get_embedding_service
+from services.worker_pool import get_search_pool
 
 logger = logging.getLogger(__name__)
 
+# 格式化上下文缓存: (最大长度, ((文件ID, 索引文件版本, 段落ID), ...)) -> (上下文, 被引用的段落信息)
+_context_cache = TTLCache(maxsize=max(Config.RAG_CONTEXT_CACHE_SIZE, 1), ttl=Config.RAG_CONTEXT_CACHE_TTL)
+_context_cache_lock = threading.Lock()
+
+
+def clear_context_cache():
+    """清空格式化上下文缓存（索引重建或删除后，相同段落ID对应的文本可能已变化）"""
+    with _context_cache_lock:
+        _context_cache.clear()
+
+
+class EmbeddingBatcher:
+    """
+    查询向量化微批器
+    
+    后台线程收集并发提交的查询，达到批大小或等待窗口结束时合并为一次
+    OpenAI embeddings 调用，再把向量分发给各自的 Future；
+    API 调用交给小线程池执行，调用进行中时后台线程继续收集下一批
+    """
+    
+    def __init__(self, client, model: str, max_batch_size: int, max_wait_ms: float, max_workers: int):
+        self.client = client
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_workers = max(1, max_workers)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+    
+    def submit(self, text: str) -> Future:
+        """提交一个查询，返回其向量的 Future"""
+        future = Future()
+        self._get_queue().put((text, future))
+        return future
+    
+    def _get_queue(self) -> queue.Queue:
+        """按进程懒启动后台线程（fork 出的子进程中线程不存在，需要重新启动）"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._queue = queue.Queue()
+                    executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                  thread_name_prefix="embedding-batch")
+                    threading.Thread(target=self._run, args=(self._queue, executor), daemon=True,
+                                     name="embedding-batcher").start()
+                    self._pid = pid
+        return self._queue
+    
+    def _run(self, pending: queue.Queue, executor: ThreadPoolExecutor):
+        """收集一批请求并交给线程池发送"""
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            executor.submit(self._flush, batch)
+    
+    def _flush(self, batch: List[Tuple[str, Future]]):
+        """一次调用向量化整批查询（相同文本只发送一次）"""
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            response = self.client.embeddings.create(
+                model=self.model,
+                input=texts,
+                encoding_format="float"
+            )
+            vectors = {
+                text: np.array(item.embedding, dtype=np.float32)
+                for text, item in zip(texts, sorted(response.data, key=attrgetter('index')))
+            }
+            logger.debug("合并 %d 个查询为一次 embeddings 调用", len(texts))
+            for text, future in batch:
+                future.set_result(vectors[text])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
 
 class RetrieverService:
     """
@@ -41,6 +136,13 @@ class RetrieverService:
         self.embedding_model = Config.OPENAI_EMBEDDING_MODEL
         self.top_k = Config.RAG_TOP_K
         self.min_similarity = Config.RAG_MIN_SIMILARITY
+        self.embedding_batcher = None
+        if Config.OPENAI_EMBEDDING_BATCH_WAIT_MS > 0:
+            self.embedding_batcher = EmbeddingBatcher(
+                self.openai_client, self.embedding_model,
+                Config.OPENAI_EMBEDDING_BATCH_SIZE, Config.OPENAI_EMBEDDING_BATCH_WAIT_MS,
+                Config.OPENAI_EMBEDDING_BATCH_WORKERS
+            )
         
         logger.info(f"RetrieverService 初始化完成，使用模型: {self.embedding_model}")
     
@@ -57,15 +159,26 @@ class RetrieverService:
         try:
             logger.info(f"使用 OpenAI 模型 {self.embedding_model} 编码查询: '{query[:50]}...'")
             
-            # 调用 OpenAI embedding API
-            response = self.openai_client.embeddings.create(
-                model=self.embedding_model,
-                input=query,
-                encoding_format="float"
-            )
-            
-            # 提取向量
-            embedding = np.array(response.data[0].embedding, dtype=np.float32)
+            embedding = None
+            if self.embedding_batcher is not None:
+                # 与并发的其他查询合并为一次 API 调用；合并调用迟迟没有返回时改为单独调用
+                try:
+                    embedding = self.embedding_batcher.submit(query).result(
+                        timeout=Config.OPENAI_EMBEDDING_BATCH_TIMEOUT
+                    )
+                except FuturesTimeoutError:
+                    logger.warning("合并的 embeddings 调用超时，改为单独调用")
+            
+            if embedding is None:
+                # 调用 OpenAI embedding API
+                response = self.openai_client.embeddings.create(
+                    model=self.embedding_model,
+                    input=query,
+                    encoding_format="float"
+                )
+                
+                # 提取向量
+                embedding = np.array(response.data[0].embedding, dtype=np.float32)
             
             logger.info(f"OpenAI 查询向量化完成，维度: {embedding.shape}")
             
@@ -190,15 +303,15 @@ class RetrieverService:
             else:
                 query_vector = self.encode_query_local(query)
             
-            # 在多个文件中搜索
-            all_results = {}
-            for file_id in file_ids:
+            # 在多个文件中并发搜索（FAISS 搜索时释放 GIL）
+            def search_file(file_id):
                 try:
-                    results = self.vector_store.search(file_id, query_vector, top_k_per_file)
-                    all_results[file_id] = results
+                    return self.vector_store.search(file_id, query_vector, top_k_per_file)
                 except Exception as e:
                     logger.error(f"搜索文件 {file_id} 失败: {str(e)}")
-                    all_results[file_id] = []
+                    return []
+            
+            all_results = dict(zip(file_ids, get_search_pool().map(search_file, file_ids)))
             
             # 过滤低相似度结果并添加查询信息
             filtered_results = {}
@@ -223,6 +336,82 @@ class RetrieverService:
             logger.error(f"多文件检索失败: {str(e)}")
             return {}
     
+    def retrieve_top_k(self, query: str, file_ids: List[str], top_k: int = None,
+                       min_similarity: float = None, use_openai: bool = True) -> List[Dict[str, Any]]:
+        """
+        从多个文件中检索全局最相关的 top_k 个段落
+        
+        各文件并发检索 top_k 个候选（只取原始数组），在 numpy 中拼接后用 argpartition 选出前 top_k，
+        只为最终入选的段落构建结果字典
+        
+        Args:
+            query (str): 查询文本
+            file_ids (List[str]): 文件ID列表
+            top_k (int): 返回的最相关结果数量
+            min_similarity (float): 最小相似度阈值
+            use_openai (bool): 是否使用 OpenAI embedding
+            
+        Returns:
+            List[Dict[str, Any]]: 检索结果列表，按相似度降序
+        """
+        try:
+            if top_k is None:
+                top_k = self.top_k
+            if min_similarity is None:
+                min_similarity = self.min_similarity
+            
+            file_ids = [fid for fid in dict.fromkeys(file_ids) if self.vector_store.index_exists(fid)]
+            if not file_ids:
+                logger.warning("指定的文件均没有向量索引")
+                return []
+            
+            # 将查询向量化（只需要做一次）
+            if use_openai and Config.OPENAI_API_KEY:
+                query_vector = self.encode_query_openai(query)
+            else:
+                query_vector = self.encode_query_local(query)
+            
+            # 各文件并发检索，得到 (相似度, 下标, 元数据) 原始结果
+            raw_results = list(get_search_pool().map(
+                lambda fid: self.vector_store.search_raw(fid, query_vector, top_k), file_ids
+            ))
+            
+            counts = [len(similarities) for similarities, _, _ in raw_results]
+            if not sum(counts):
+                return []
+            similarities = np.concatenate([r[0] for r in raw_results])
+            positions = np.concatenate([r[1] for r in raw_results])
+            owners = np.repeat(np.arange(len(raw_results)), counts)
+            metadata_sizes = np.array([len(r[2]) for r in raw_results])
+            
+            # 过滤无效下标和低相似度结果，再选出全局前 top_k 并排序
+            candidates = np.flatnonzero(
+                (positions >= 0) & (positions < metadata_sizes[owners]) & (similarities >= min_similarity)
+            )
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-similarities[candidates], top_k - 1)[:top_k]]
+            candidates = candidates[np.argsort(-similarities[candidates], kind='stable')]
+            
+            results = []
+            for rank, (score, owner, position) in enumerate(zip(
+                similarities[candidates].tolist(), owners[candidates].tolist(), positions[candidates].tolist()
+            ), 1):
+                results.append({
+                    'rank': rank,
+                    'score': score,
+                    'similarity': score,
+                    'metadata': raw_results[owner][2][position],
+                    'query': query,
+                    'file_id': file_ids[owner]
+                })
+            
+            logger.info("多文件检索完成，返回 %s 个相关段落", len(results))
+            return results
+            
+        except Exception as e:
+            logger.error(f"多文件检索失败: {str(e)}")
+            return []
+    
     def retrieve_all_available(self, query: str, top_k_total: int = None, 
                              min_similarity: float = None, use_openai: bool = True) -> List[Dict[str, Any]]:
         """
@@ -261,17 +450,9 @@ class RetrieverService:
                 query, file_ids, per_file_top_k, min_similarity, use_openai
             )
             
-            # 合并所有结果
-            all_results = []
-            for file_id, results in multi_results.items():
-                all_results.extend(results)
-            
-            # 按相似度排序
-            all_results.sort(key=lambda x: x.get('similarity', 0), reverse=True)
-            
-            # 过滤低质量内容
+            # 合并所有结果并过滤低质量内容
             quality_filtered_results = []
-            for result in all_results:
+            for result in chain.from_iterable(multi_results.values()):
                 metadata = result.get('metadata', {})
                 text = metadata.get('text_preview', '') or metadata.get('text', '')
                 similarity = result.get('similarity', 0)
@@ -287,8 +468,8 @@ class RetrieverService:
                 
                 quality_filtered_results.append(result)
             
-            # 截取 top_k_total 个结果
-            final_results = quality_filtered_results[:top_k_total]
+            # 取相似度最高的 top_k_total 个结果（堆选择，无需全量排序；结果中总有 similarity 字段）
+            final_results = heapq.nlargest(top_k_total, quality_filtered_results, key=itemgetter('similarity'))
             
             logger.info(f"全局检索完成，返回 {len(final_results)} 个最相关段落")
             return final_results
@@ -316,6 +497,28 @@ class RetrieverService:
             if not retrieval_results:
                 return "没有找到相关资料。", []
             
+            # 检索到的段落（及顺序）相同时，上下文文本也相同，只需替换本次查询的相似度
+            cache_key = None
+            if Config.RAG_CONTEXT_CACHE_SIZE > 0:
+                # 键中包含索引文件版本：索引被（其他 worker）重建后，相同段落ID不会命中旧文本
+                index_versions = self.vector_store.index_versions
+                segment_keys = tuple(
+                    (result.get('file_id'), index_versions.get(result.get('file_id')),
+                     result.get('metadata', {}).get('segment_id'))
+                    for result in retrieval_results
+                )
+                if all(segment_id for _, _, segment_id in segment_keys):
+                    cache_key = (max_length, segment_keys)
+                    with _context_cache_lock:
+                        cached = _context_cache.get(cache_key)
+                    if cached is not None:
+                        formatted_context, cached_segments = cached
+                        cited_segments = [
+                            dict(segment_info, similarity=result.get('similarity', 0))
+                            for segment_info, result in zip(cached_segments, retrieval_results)
+                        ]
+                        return formatted_context, cited_segments
+            
             context_parts = []
             cited_segments = []
             current_length = 0
@@ -352,6 +555,9 @@ class RetrieverService:
             formatted_context = "\\n\\n".join(context_parts)
             
             logger.info(f"上下文格式化完成，包含 {len(cited_segments)} 个段落，总长度: {len(formatted_context)}")
+            if cache_key is not None:
+                with _context_cache_lock:
+                    _context_cache[cache_key] = (formatted_context, cited_segments)
             return formatted_context, cited_segments
             
         except Exception as e:
@@ -16,15 +16,41 @@ FAISS 向量库管理服务
 
 import os
 import json
+import math
 import logging
 import pickle
+import tempfile
 import numpy as np
 from typing import List, Dict, Any, Tuple, Optional
 import faiss
 from pathlib import Path
+from config import Config
 
 logger = logging.getLogger(__name__)
 
+# 索引向量存储精度 -> FAISS 标量量化类型（float32 使用不量化的 Flat 索引）
+_SQ_TYPES = {
+    'float16': faiss.ScalarQuantizer.QT_fp16,
+    'int8': faiss.ScalarQuantizer.QT_8bit,
+}
+# bfloat16 与 float32 取值范围相同、内存占用与 float16 相同，需要 FAISS >= 1.8
+if hasattr(faiss.ScalarQuantizer, 'QT_bf16'):
+    _SQ_TYPES['bfloat16'] = faiss.ScalarQuantizer.QT_bf16
+_SQ_DTYPES = {qtype: dtype for dtype, qtype in _SQ_TYPES.items()}
+
+# IVF 索引中每个倒排列表的向量编码（按向量存储精度）
+_IVF_CODES = {
+    'float32': 'Flat',
+    'float16': 'SQfp16',
+    'bfloat16': 'SQbf16',
+    'int8': 'SQ8',
+}
+
+# 二值量化索引：按汉明距离取 top_k 的若干倍候选，再用 float16 原始向量重新打分
+_BINARY_RERANK_FACTOR = 4
+# FAISS 二值索引文件头（fourcc）以 IB 开头
+_BINARY_FOURCC_PREFIX = b'IB'
+
 
 class VectorStore:
     """
@@ -50,11 +76,19 @@ class VectorStore:
         # 确保目录存在
         os.makedirs(self.base_dir, exist_ok=True)
         
+        # 新建索引的默认向量存储精度 (float32 / float16 / int8)
+        self.index_dtype = Config.EMBEDDING_DTYPE
+        
         # 索引缓存
         self.index_cache = {}
         self.metadata_cache = {}
+        # 二值索引重排序用的 float16 向量（磁盘映射，只读取候选行）
+        self.rerank_cache = {}
+        # 缓存的索引对应的索引文件版本 (inode, 修改时间, 大小)；多 worker 部署时，
+        # 其他进程重建、追加或删除索引后文件版本改变，本进程的缓存随之失效
+        self.index_versions = {}
         
-        logger.info(f"向量存储服务初始化完成，存储目录: {self.base_dir}")
+        logger.info("向量存储服务初始化完成，存储目录: %s", self.base_dir)
     
     def _get_index_path(self, file_id: str) -> str:
         """获取索引文件路径"""
@@ -68,7 +102,116 @@ class VectorStore:
         """获取向量数据文件路径"""
         return os.path.join(self.base_dir, f"{file_id}_embeddings.pkl")
     
-    def create_index(self, embedding_dim: int, metric: str = "cosine") -> faiss.Index:
+    def _get_rerank_path(self, file_id: str) -> str:
+        """获取二值索引重排序向量文件路径"""
+        return os.path.join(self.base_dir, f"{file_id}_rerank.npy")
+    
+    def _load_rerank_vectors(self, file_id: str) -> np.ndarray:
+        """以磁盘映射方式加载二值索引的重排序向量"""
+        vectors = self.rerank_cache.get(file_id)
+        if vectors is None:
+            vectors = np.load(self._get_rerank_path(file_id), mmap_mode='r')
+            self.rerank_cache[file_id] = vectors
+        return vectors
+    
+    def _append_rerank_vectors(self, file_id: str, embeddings: np.ndarray):
+        """
+        追加二值索引的重排序向量（float16）并写回磁盘
+        
+        原文件可能正被本进程的搜索线程或其他 worker 磁盘映射，不能原地截断重写：
+        先写入同目录的临时文件再原子替换，已有映射继续读取旧文件直到释放
+        """
+        vectors = embeddings.astype(np.float16)
+        rerank_path = self._get_rerank_path(file_id)
+        if os.path.exists(rerank_path):
+            vectors = np.concatenate([self._load_rerank_vectors(file_id), vectors])
+        
+        fd, tmp_path = tempfile.mkstemp(dir=self.base_dir, prefix=f"{file_id}_rerank.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.save(fh, vectors)
+            os.replace(tmp_path, rerank_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.rerank_cache.pop(file_id, None)
+    
+    def index_version(self, file_id: str) -> Optional[Tuple[int, int, int]]:
+        """
+        获取索引文件当前的版本（每次保存都原子替换为新文件，inode 随之改变）
+        
+        Args:
+            file_id (str): 文件ID
+            
+        Returns:
+            Optional[Tuple]: (inode, 修改时间, 大小)，索引不存在时返回 None
+        """
+        try:
+            st = os.stat(self._get_index_path(file_id))
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+    
+    def _evict(self, file_id: str):
+        """从内存中移除指定文件的索引、元数据和重排序向量"""
+        self.index_cache.pop(file_id, None)
+        self.metadata_cache.pop(file_id, None)
+        self.rerank_cache.pop(file_id, None)
+        self.index_versions.pop(file_id, None)
+    
+    def _get_cached(self, file_id: str) -> Optional[Tuple[faiss.Index, List[Dict[str, Any]]]]:
+        """
+        获取内存中的索引和元数据，索引文件已被（其他进程）替换或删除时视为未缓存
+        
+        Returns:
+            Optional[Tuple]: (索引, 元数据)，未缓存或已失效时返回 None
+        """
+        index = self.index_cache.get(file_id)
+        if index is None:
+            return None
+        if self.index_version(file_id) != self.index_versions.get(file_id):
+            logger.info("索引文件已变化，丢弃缓存: %s", file_id)
+            self._evict(file_id)
+            return None
+        return index, self.metadata_cache.get(file_id, [])
+    
+    def _get_index(self, file_id: str) -> Tuple[faiss.Index, List[Dict[str, Any]]]:
+        """获取索引和元数据：优先使用仍然有效的缓存，否则从磁盘加载"""
+        cached = self._get_cached(file_id)
+        return cached if cached is not None else self.load_index(file_id)
+    
+    def _atomic_write(self, path: str, write):
+        """
+        先写入同目录的临时文件再原子替换目标文件，其他进程不会读到写了一半的文件
+        
+        Args:
+            path (str): 目标文件路径
+            write (Callable[[str], None]): 将内容写入给定路径的函数
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.base_dir, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    @staticmethod
+    def _default_nlist(n_vectors: int) -> int:
+        """默认聚类数 4*sqrt(N)，并保证每个聚类至少有 39 个训练向量"""
+        return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+    
+    @staticmethod
+    def default_nprobe(index: faiss.Index) -> int:
+        """IVF 索引搜索时默认探查的聚类数"""
+        return Config.IVF_NPROBE or max(1, int(math.sqrt(index.nlist)))
+    
+    def create_index(self, embedding_dim: int, metric: str = "cosine", dtype: str = None,
+                     index_type: str = "flat", n_vectors: int = 0, nlist: int = None,
+                     pq_m: int = None) -> faiss.Index:
         """
         创建 FAISS 索引
         
@@ -78,14 +221,42 @@ class VectorStore:
                         - cosine: 余弦相似度 (推荐)
                         - l2: 欧氏距离
                         - ip: 内积 (适用于归一化向量)
+            dtype (str): 向量存储精度 ("float32", "float16", "bfloat16", "int8", "binary")，默认使用配置值
+            index_type (str): 索引结构 ("flat", "ivf", "ivf_pq")；IVF 只探查部分聚类，搜索开销随向量数亚线性增长
+            n_vectors (int): 首批向量数，向量数不足 Config.IVF_MIN_VECTORS 时 IVF 退化为 Flat
+            nlist (int): IVF 聚类数，默认 4*sqrt(n_vectors)
+            pq_m (int): ivf_pq 的子量化器个数（须整除维度），默认 维度/8
         
         Returns:
             faiss.Index: FAISS 索引对象
         """
         try:
-            logger.info(f"创建 FAISS 索引，维度: {embedding_dim}, 度量: {metric}")
-            
-            if metric == "cosine":
+            dtype = dtype or self.index_dtype
+            if not self.supports_dtype(dtype):
+                raise ValueError(f"不支持的向量存储精度: {dtype}（bfloat16 需要 FAISS >= 1.8）")
+            if index_type != "flat" and n_vectors < Config.IVF_MIN_VECTORS:
+                logger.info("向量数 %s 少于 %s，使用 Flat 索引", n_vectors, Config.IVF_MIN_VECTORS)
+                index_type = "flat"
+            logger.info("创建 FAISS 索引，维度: %s, 度量: %s, 精度: %s, 结构: %s",
+                        embedding_dim, metric, dtype, index_type)
+            
+            if metric in ("cosine", "ip") and index_type in ("ivf", "ivf_pq"):
+                if dtype == "binary":
+                    raise ValueError("二值索引不支持 IVF 结构")
+                # 倒排索引：先用首批向量训练聚类中心（add_vectors 中完成），搜索时只探查 nprobe 个聚类
+                nlist = nlist or self._default_nlist(n_vectors)
+                code = f"PQ{pq_m or embedding_dim // 8}x8" if index_type == "ivf_pq" else _IVF_CODES[dtype]
+                index = faiss.index_factory(embedding_dim, f"IVF{nlist},{code}", faiss.METRIC_INNER_PRODUCT)
+            elif metric in ("cosine", "ip") and dtype == "binary":
+                # 二值量化：每维 1 bit，按汉明距离搜索，内存约为 float32 的 1/32（维度须为 8 的倍数）
+                index = faiss.IndexBinaryFlat(embedding_dim)
+            elif metric in ("cosine", "ip") and dtype in _SQ_TYPES:
+                # 标量量化：每维按 2 字节（fp16/bf16）或 1 字节（8bit）存储，搜索时读取的数据量相应减少；
+                # 8bit 需先训练（add_vectors 中用首批向量训练），fp16/bf16 无需训练
+                index = faiss.IndexScalarQuantizer(
+                    embedding_dim, _SQ_TYPES[dtype], faiss.METRIC_INNER_PRODUCT
+                )
+            elif metric == "cosine":
                 # 余弦相似度 = 归一化向量的内积
                 index = faiss.IndexFlatIP(embedding_dim)
             elif metric == "l2":
@@ -97,14 +268,16 @@ class VectorStore:
             else:
                 raise ValueError(f"不支持的度量方式: {metric}")
             
-            logger.info(f"FAISS 索引创建成功")
+            logger.info("FAISS 索引创建成功")
             return index
             
         except Exception as e:
-            logger.error(f"创建 FAISS 索引失败: {str(e)}")
+            logger.exception("创建 FAISS 索引失败: %s", e)
             raise Exception(f"Failed to create FAISS index: {str(e)}")
     
-    def add_vectors(self, file_id: str, embeddings: np.ndarray, metadata: List[Dict[str, Any]]) -> bool:
+    def add_vectors(self, file_id: str, embeddings: np.ndarray, metadata: List[Dict[str, Any]],
+                    dtype: str = None, index_type: str = "flat", nlist: int = None,
+                    pq_m: int = None) -> bool:
         """
         添加向量到指定文件的索引中
         
@@ -112,6 +285,10 @@ class VectorStore:
             file_id (str): 文件ID
             embeddings (np.ndarray): 向量矩阵 [n_vectors, embedding_dim]
             metadata (List[Dict]): 对应的元数据列表
+            dtype (str): 新建索引时的向量存储精度，默认使用配置值（已有索引保持原精度）
+            index_type (str): 新建索引时的索引结构 ("flat", "ivf", "ivf_pq")
+            nlist (int): 新建 IVF 索引的聚类数
+            pq_m (int): 新建 ivf_pq 索引的子量化器个数
             
         Returns:
             bool: 是否成功
@@ -121,30 +298,40 @@ class VectorStore:
                 raise ValueError("向量数量与元数据数量不匹配")
             
             if len(embeddings) == 0:
-                logger.warning(f"文件 {file_id} 没有向量数据")
+                logger.warning("文件 %s 没有向量数据", file_id)
                 return True
             
-            logger.info(f"为文件 {file_id} 添加 {len(embeddings)} 个向量")
+            logger.info("为文件 %s 添加 %s 个向量", file_id, len(embeddings))
             
             # 检查向量维度
             embedding_dim = embeddings.shape[1]
             
             # 创建或加载索引
-            if file_id in self.index_cache:
-                index = self.index_cache[file_id]
-                existing_metadata = self.metadata_cache[file_id]
+            cached = self._get_cached(file_id)
+            if cached is not None:
+                index, existing_metadata = cached
             else:
                 # 尝试加载现有索引
                 if self.index_exists(file_id):
                     index, existing_metadata = self.load_index(file_id)
                 else:
                     # 创建新索引
-                    index = self.create_index(embedding_dim)
+                    index = self.create_index(
+                        embedding_dim, dtype=dtype, index_type=index_type,
+                        n_vectors=len(embeddings), nlist=nlist, pq_m=pq_m
+                    )
                     existing_metadata = []
             
-            # 添加向量到索引
-            embeddings_f32 = embeddings.astype(np.float32)
-            index.add(embeddings_f32)
+            # 添加向量到索引（已是连续 float32 时不会产生拷贝）
+            embeddings_f32 = np.ascontiguousarray(embeddings, dtype=np.float32)
+            if isinstance(index, faiss.IndexBinary):
+                # 按符号位打包为二值编码；同时保存 float16 向量用于搜索时重新打分
+                index.add(np.packbits(embeddings_f32 > 0, axis=1))
+                self._append_rerank_vectors(file_id, embeddings_f32)
+            else:
+                if not index.is_trained:
+                    index.train(embeddings_f32)
+                index.add(embeddings_f32)
             
             # 更新元数据
             updated_metadata = existing_metadata + metadata
@@ -156,11 +343,11 @@ class VectorStore:
             # 保存到磁盘
             self.save_index(file_id, index, updated_metadata)
             
-            logger.info(f"文件 {file_id} 的向量添加完成，总向量数: {index.ntotal}")
+            logger.info("文件 %s 的向量添加完成，总向量数: %s", file_id, index.ntotal)
             return True
             
         except Exception as e:
-            logger.error(f"添加向量失败: {str(e)}")
+            logger.exception("添加向量失败: %s", e)
             return False
     
     def save_index(self, file_id: str, index: faiss.Index, metadata: List[Dict[str, Any]]) -> bool:
@@ -176,20 +363,24 @@ class VectorStore:
             bool: 是否成功
         """
         try:
-            # 保存 FAISS 索引
-            index_path = self._get_index_path(file_id)
-            faiss.write_index(index, index_path)
+            # 先保存元数据再保存索引：其他进程以索引文件版本判断缓存是否失效，
+            # 看到新索引时元数据已经是新的；两个文件都原子替换，不会读到写了一半的文件
+            def write_metadata(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
             
-            # 保存元数据
-            metadata_path = self._get_metadata_path(file_id)
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+            self._atomic_write(self._get_metadata_path(file_id), write_metadata)
             
-            logger.info(f"索引和元数据保存成功: {file_id}")
+            # 保存 FAISS 索引
+            write = faiss.write_index_binary if isinstance(index, faiss.IndexBinary) else faiss.write_index
+            self._atomic_write(self._get_index_path(file_id), lambda path: write(index, path))
+            self.index_versions[file_id] = self.index_version(file_id)
+            
+            logger.info("索引和元数据保存成功: %s", file_id)
             return True
             
         except Exception as e:
-            logger.error(f"保存索引失败: {str(e)}")
+            logger.exception("保存索引失败: %s", e)
             return False
     
     def load_index(self, file_id: str) -> Tuple[faiss.Index, List[Dict[str, Any]]]:
@@ -203,12 +394,15 @@ class VectorStore:
             Tuple[faiss.Index, List[Dict]]: 索引和元数据
         """
         try:
-            # 加载 FAISS 索引
+            # 加载 FAISS 索引（先记录文件版本：读取期间文件被替换时，下次访问会重新加载）
             index_path = self._get_index_path(file_id)
-            if not os.path.exists(index_path):
+            version = self.index_version(file_id)
+            if version is None:
                 raise FileNotFoundError(f"索引文件不存在: {index_path}")
             
-            index = faiss.read_index(index_path)
+            with open(index_path, 'rb') as f:
+                is_binary = f.read(len(_BINARY_FOURCC_PREFIX)) == _BINARY_FOURCC_PREFIX
+            index = faiss.read_index_binary(index_path) if is_binary else faiss.read_index(index_path)
             
             # 加载元数据
             metadata_path = self._get_metadata_path(file_id)
@@ -216,75 +410,148 @@ class VectorStore:
                 with open(metadata_path, 'r', encoding='utf-8') as f:
                     metadata = json.load(f)
             else:
-                logger.warning(f"元数据文件不存在: {metadata_path}")
+                logger.warning("元数据文件不存在: %s", metadata_path)
                 metadata = []
             
             # 缓存到内存
+            self.rerank_cache.pop(file_id, None)
             self.index_cache[file_id] = index
             self.metadata_cache[file_id] = metadata
+            self.index_versions[file_id] = version
             
-            logger.info(f"索引加载成功: {file_id}, 向量数: {index.ntotal}")
+            logger.info("索引加载成功: %s, 向量数: %s", file_id, index.ntotal)
             return index, metadata
             
         except Exception as e:
-            logger.error(f"加载索引失败: {str(e)}")
+            logger.exception("加载索引失败: %s", e)
             raise Exception(f"Failed to load index: {str(e)}")
     
-    def search(self, file_id: str, query_vector: np.ndarray, top_k: int = 5) -> List[Dict[str, Any]]:
+    def search_raw(self, file_id: str, query_vector: np.ndarray, top_k: int = 5,
+                   nprobe: int = None) -> Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]:
         """
-        在指定文件的索引中搜索相似向量
+        在指定文件的索引中搜索相似向量，返回未组装的原始结果
         
         Args:
             file_id (str): 文件ID
             query_vector (np.ndarray): 查询向量
             top_k (int): 返回的相似结果数量
+            nprobe (int): IVF 索引探查的聚类数，默认使用 default_nprobe
             
         Returns:
-            List[Dict]: 搜索结果列表，包含元数据和相似度分数
+            Tuple[np.ndarray, np.ndarray, List[Dict]]:
+                - 相似度数组 (float32, 按排名排列)
+                - 元数据下标数组 (int64, -1 表示无效结果)
+                - 该文件的元数据列表
         """
+        empty = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64), [])
         try:
             # 获取索引
-            if file_id in self.index_cache:
-                index = self.index_cache[file_id]
-                metadata = self.metadata_cache[file_id]
-            else:
-                index, metadata = self.load_index(file_id)
+            index, metadata = self._get_index(file_id)
             
             if index.ntotal == 0:
-                logger.warning(f"文件 {file_id} 的索引为空")
-                return []
+                logger.warning("文件 %s 的索引为空", file_id)
+                return empty
             
             # 确保查询向量格式正确
             query_vector = query_vector.astype(np.float32).reshape(1, -1)
             
+            if isinstance(index, faiss.IndexBinary):
+                return self._search_binary(file_id, index, query_vector, top_k) + (metadata,)
+            
             # 搜索
             actual_k = min(top_k, index.ntotal)
-            distances, indices = index.search(query_vector, actual_k)
-            
-            # 构建结果
-            results = []
-            for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-                if idx == -1:  # FAISS 返回 -1 表示无效索引
-                    continue
-                
-                if idx >= len(metadata):
-                    logger.warning(f"索引 {idx} 超出元数据范围")
-                    continue
-                
-                result = {
-                    'rank': i + 1,
-                    'score': float(distance),
-                    'similarity': float(distance),  # 对于余弦相似度，距离就是相似度
-                    'metadata': metadata[idx]
-                }
-                results.append(result)
-            
-            logger.info(f"搜索完成，返回 {len(results)} 个结果")
-            return results
+            if isinstance(index, faiss.IndexIVF):
+                # 通过搜索参数传入 nprobe，不修改共享的索引对象（多线程并发搜索安全）
+                params = faiss.SearchParametersIVF(nprobe=nprobe or self.default_nprobe(index))
+                distances, indices = index.search(query_vector, actual_k, params=params)
+            else:
+                distances, indices = index.search(query_vector, actual_k)
+            
+            return distances[0], indices[0].astype(np.int64), metadata
             
         except Exception as e:
-            logger.error(f"搜索失败: {str(e)}")
-            return []
+            logger.exception("搜索失败: %s", e)
+            return empty
+    
+    def _search_binary(self, file_id: str, index: faiss.IndexBinary, query_vector: np.ndarray,
+                       top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        二值索引搜索：按汉明距离取候选，再用 float16 原始向量计算内积重新排序
+        
+        Args:
+            file_id (str): 文件ID
+            index (faiss.IndexBinary): 二值索引
+            query_vector (np.ndarray): 查询向量 [1, embedding_dim]
+            top_k (int): 返回的相似结果数量
+            
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 相似度数组、元数据下标数组（按相似度降序）
+        """
+        candidate_k = min(top_k * _BINARY_RERANK_FACTOR, index.ntotal)
+        _, candidates = index.search(np.packbits(query_vector > 0, axis=1), candidate_k)
+        candidates = candidates[0][candidates[0] >= 0].astype(np.int64)
+        
+        # 只读取候选行（磁盘映射），按内积重新打分
+        vectors = self._load_rerank_vectors(file_id)
+        scores = vectors[candidates].astype(np.float32) @ query_vector[0]
+        order = np.argsort(-scores)[:top_k]
+        return scores[order], candidates[order]
+    
+    @staticmethod
+    def build_results(similarities: np.ndarray, indices: np.ndarray,
+                      metadata: List[Dict[str, Any]], min_score: float = None) -> List[Dict[str, Any]]:
+        """
+        将原始搜索结果组装为结果列表，无效下标和低分结果通过布尔掩码一次过滤
+        
+        Args:
+            similarities (np.ndarray): 相似度数组
+            indices (np.ndarray): 元数据下标数组
+            metadata (List[Dict]): 元数据列表
+            min_score (float): 最小相似度阈值，None 表示不过滤
+            
+        Returns:
+            List[Dict]: 搜索结果列表，包含元数据和相似度分数
+        """
+        # FAISS 返回 -1 表示无效索引
+        mask = (indices >= 0) & (indices < len(metadata))
+        if (indices >= len(metadata)).any():
+            logger.warning("部分索引超出元数据范围")
+        if min_score is not None:
+            mask &= similarities >= min_score
+        
+        # 在 numpy 中一次切出命中的排名、分数和下标，再整体转换为 Python 数值，
+        # 组装结果时只需按顺序 zip，循环内没有数组或列表下标访问
+        hits = np.flatnonzero(mask)
+        ranks = (hits + 1).tolist()
+        scores = similarities[hits].tolist()
+        hit_metadata = [metadata[i] for i in indices[hits].tolist()]
+        return [
+            {
+                'rank': rank,
+                'score': score,
+                'similarity': score,  # 对于余弦相似度，距离就是相似度
+                'metadata': meta
+            }
+            for rank, score, meta in zip(ranks, scores, hit_metadata)
+        ]
+    
+    def search(self, file_id: str, query_vector: np.ndarray, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        在指定文件的索引中搜索相似向量
+        
+        Args:
+            file_id (str): 文件ID
+            query_vector (np.ndarray): 查询向量
+            top_k (int): 返回的相似结果数量
+            
+        Returns:
+            List[Dict]: 搜索结果列表，包含元数据和相似度分数
+        """
+        similarities, indices, metadata = self.search_raw(file_id, query_vector, top_k)
+        results = self.build_results(similarities, indices, metadata)
+        
+        logger.info("搜索完成，返回 %s 个结果", len(results))
+        return results
     
     def search_multiple_files(self, file_ids: List[str], query_vector: np.ndarray, 
                             top_k: int = 5) -> Dict[str, List[Dict[str, Any]]]:
@@ -307,14 +574,76 @@ class VectorStore:
                     file_results = self.search(file_id, query_vector, top_k)
                     results[file_id] = file_results
                 else:
-                    logger.warning(f"文件 {file_id} 的索引不存在")
+                    logger.warning("文件 %s 的索引不存在", file_id)
                     results[file_id] = []
             except Exception as e:
-                logger.error(f"搜索文件 {file_id} 失败: {str(e)}")
+                logger.exception("搜索文件 %s 失败: %s", file_id, e)
                 results[file_id] = []
         
         return results
     
+    @staticmethod
+    def supports_dtype(dtype: str) -> bool:
+        """
+        检查当前 FAISS 版本是否支持指定的向量存储精度
+        
+        Args:
+            dtype (str): 向量存储精度
+            
+        Returns:
+            bool: 是否支持
+        """
+        return dtype in ('float32', 'binary') or dtype in _SQ_TYPES
+    
+    @staticmethod
+    def index_dtype_of(index: faiss.Index) -> str:
+        """
+        获取索引的向量存储精度
+        
+        Args:
+            index (faiss.Index): FAISS 索引
+            
+        Returns:
+            str: float32 / float16 / bfloat16 / int8 / binary / pq
+        """
+        if isinstance(index, faiss.IndexBinary):
+            return 'binary'
+        if isinstance(index, faiss.IndexIVFPQ):
+            return 'pq'
+        if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+            return _SQ_DTYPES.get(index.sq.qtype, 'float32')
+        return 'float32'
+    
+    @staticmethod
+    def index_type_of(index: faiss.Index) -> str:
+        """
+        获取索引结构
+        
+        Args:
+            index (faiss.Index): FAISS 索引
+            
+        Returns:
+            str: flat / ivf / ivf_pq
+        """
+        if isinstance(index, faiss.IndexIVFPQ):
+            return 'ivf_pq'
+        if isinstance(index, faiss.IndexIVF):
+            return 'ivf'
+        return 'flat'
+    
+    def get_index_dtype(self, file_id: str) -> Optional[str]:
+        """
+        获取已加载索引的向量存储精度
+        
+        Args:
+            file_id (str): 文件ID
+            
+        Returns:
+            Optional[str]: 向量存储精度，索引未加载时返回 None
+        """
+        cached = self._get_cached(file_id)
+        return self.index_dtype_of(cached[0]) if cached is not None else None
+    
     def index_exists(self, file_id: str) -> bool:
         """
         检查指定文件的索引是否存在
@@ -340,28 +669,26 @@ class VectorStore:
         """
         try:
             # 从缓存中移除
-            if file_id in self.index_cache:
-                del self.index_cache[file_id]
-            if file_id in self.metadata_cache:
-                del self.metadata_cache[file_id]
+            self._evict(file_id)
             
             # 删除文件
             files_to_delete = [
                 self._get_index_path(file_id),
                 self._get_metadata_path(file_id),
-                self._get_embeddings_path(file_id)
+                self._get_embeddings_path(file_id),
+                self._get_rerank_path(file_id)
             ]
             
             for file_path in files_to_delete:
                 if os.path.exists(file_path):
                     os.remove(file_path)
-                    logger.info(f"删除文件: {file_path}")
+                    logger.info("删除文件: %s", file_path)
             
-            logger.info(f"索引删除成功: {file_id}")
+            logger.info("索引删除成功: %s", file_id)
             return True
             
         except Exception as e:
-            logger.error(f"删除索引失败: {str(e)}")
+            logger.exception("删除索引失败: %s", e)
             return False
     
     def get_index_info(self, file_id: str) -> Dict[str, Any]:
@@ -379,28 +706,29 @@ class VectorStore:
                 return {'exists': False}
             
             # 加载索引
-            if file_id in self.index_cache:
-                index = self.index_cache[file_id]
-                metadata = self.metadata_cache[file_id]
-            else:
-                index, metadata = self.load_index(file_id)
+            index, metadata = self._get_index(file_id)
             
             info = {
                 'exists': True,
                 'file_id': file_id,
                 'vector_count': index.ntotal,
                 'embedding_dimension': index.d,
+                'dtype': self.index_dtype_of(index),
+                'index_type': self.index_type_of(index),
                 'metadata_count': len(metadata),
                 'index_path': self._get_index_path(file_id),
                 'metadata_path': self._get_metadata_path(file_id),
                 'index_size_mb': self._get_file_size_mb(self._get_index_path(file_id)),
                 'metadata_size_mb': self._get_file_size_mb(self._get_metadata_path(file_id))
             }
+            if isinstance(index, faiss.IndexIVF):
+                info['nlist'] = index.nlist
+                info['nprobe'] = self.default_nprobe(index)
             
             return info
             
         except Exception as e:
-            logger.error(f"获取索引信息失败: {str(e)}")
+            logger.exception("获取索引信息失败: %s", e)
             return {'exists': False, 'error': str(e)}
     
     def _get_file_size_mb(self, file_path: str) -> float:
@@ -431,10 +759,10 @@ class VectorStore:
                     if info.get('exists'):
                         indices.append(info)
             
-            logger.info(f"发现 {len(indices)} 个索引")
+            logger.info("发现 %s 个索引", len(indices))
             
         except Exception as e:
-            logger.error(f"列出索引失败: {str(e)}")
+            logger.exception("列出索引失败: %s", e)
         
         return indices
     
@@ -442,6 +770,8 @@ class VectorStore:
         """清空内存缓存"""
         self.index_cache.clear()
         self.metadata_cache.clear()
+        self.rerank_cache.clear()
+        self.index_versions.clear()
         logger.info("向量存储缓存已清空")
 
 
@@ -0,0 +1,107 @@
+# worker_pool.py - CPU 密集任务执行池
+# 批量解析、分段等纯计算任务在子进程中执行，绕开 GIL 以利用多核
+# 子进程只做计算，不访问数据库；数据库读写仍在调用方线程中完成
+# 单个请求内的解析/分段交给有界线程池执行，限制同时进行的重计算数量并设置超时
+
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# 请求内 CPU 任务线程池：导入时创建，线程按需启动
+_cpu_pool = ThreadPoolExecutor(
+    max_workers=Config.CPU_THREAD_POOL_WORKERS,
+    thread_name_prefix='cpu-task'
+)
+
+# 多文件向量搜索线程池：FAISS 搜索期间释放 GIL，各文件的搜索可并行执行；
+# 进程内共享，避免每个请求创建和销毁线程
+_search_pool = ThreadPoolExecutor(
+    max_workers=Config.SEARCH_THREAD_POOL_WORKERS or min(32, os.cpu_count() or 4),
+    thread_name_prefix='vector-search'
+)
+
+
+def _init_worker():
+    """子进程初始化：统一日志格式"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s %(message)s'
+    )
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    获取共享的进程池（懒加载）
+    
+    使用 spawn 方式启动子进程：Web worker 中已有多个线程（以及 torch 线程池），
+    直接 fork 可能继承被其他线程持有的锁而死锁
+    
+    Returns:
+        ProcessPoolExecutor: 进程池实例
+    """
+    global _pool
+    
+    with _pool_lock:
+        if _pool is None:
+            max_workers = Config.PROCESS_POOL_WORKERS or os.cpu_count() or 1
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+            logger.info("CPU 任务进程池已启动，进程数: %s", max_workers)
+        return _pool
+
+
+def run_blocking(fn, *args, timeout: Optional[float] = None, **kwargs):
+    """
+    在 CPU 任务线程池中执行函数并等待结果
+    
+    Args:
+        fn: 要执行的函数
+        timeout (Optional[float]): 等待秒数，默认使用 Config.CPU_TASK_TIMEOUT
+    
+    Returns:
+        函数返回值
+    
+    Raises:
+        concurrent.futures.TimeoutError: 等待超时（任务本身会在后台继续执行完毕）
+    """
+    future = _cpu_pool.submit(fn, *args, **kwargs)
+    return future.result(timeout=Config.CPU_TASK_TIMEOUT if timeout is None else timeout)
+
+
+def get_search_pool() -> ThreadPoolExecutor:
+    """
+    获取共享的向量搜索线程池
+    
+    Returns:
+        ThreadPoolExecutor: 线程池实例
+    """
+    return _search_pool
+
+
+def shutdown():
+    """关闭进程池和各线程池（进程退出时自动调用）"""
+    global _pool
+    
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+    _cpu_pool.shutdown(wait=False, cancel_futures=True)
+    _search_pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown)
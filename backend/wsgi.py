@@ -0,0 +1,9 @@
+"""
+wsgi.py - WSGI 服务入口
+供 Gunicorn 等 WSGI 服务器加载：gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+from app import create_app
+
+app = create_app(os.getenv("FLASK_CONFIG", "production"))